@@ -0,0 +1,17 @@
+"""Almacenamiento local (SQLite) compartido por todas las sesiones del servidor."""
+import os
+import sqlite3
+
+LOCAL_DB_PATH = os.environ.get(
+    "CALCULADORA_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculadora_local.db"),
+)
+
+def connect_local_db(db_path=None):
+    """
+    Abre una conexión a la base local. Cada hilo debe usar su propia conexión.
+    isolation_level=None deja el control de transacciones (BEGIN IMMEDIATE) al llamador.
+    """
+    conn = sqlite3.connect(db_path or LOCAL_DB_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
@@ -0,0 +1,319 @@
+"""
+API HTTP/JSON (tornado) para registrar operaciones sin la interfaz de Streamlit: terminales
+punto de venta, el bot de Telegram o cualquier script.
+
+    POST /operaciones      {"cliente": "alias", "operaciones": [{"tipo": "Compra", "monto": 18550, "moneda": "MXN"}, ...],
+                            "tasa_compra": 18.55, "tasa_venta": 19.44}
+                           o {"lotes": [{...}, {...}]} para registrar varios lotes en una petición
+    GET  /clientes/<alias> saldo actual del cliente
+    GET  /estado           replicación pendiente, envíos agrupados a Sheets y últimos errores
+
+Las operaciones usan el formato de la importación masiva (importacion.py): tipo
+Compra/Venta/Pago/Recibo, monto y moneda MXN/USDT. Las tasas son opcionales; por defecto
+se usan las de la hoja 'Tasas'. Cada lote responde con sus folios y el saldo nuevo del
+cliente; los comprobantes se siguen adjuntando desde la app.
+
+El servicio es el mismo de la app (get_ledger_service de calculadora_cambio.py), así que
+los folios y las filas del registro son idénticos. Los lotes que llegan dentro de una
+ventana de COALESCE_WINDOW_SECONDS, de cualquier cliente, se registran juntos: una sola
+reserva de folios y un solo aviso al replicador, que los escribe en un append_rows junto
+con el último saldo de cada cliente. Los lotes se registran uno tras otro, así que cada
+cliente parte del saldo que dejó su lote anterior.
+
+Todas las peticiones llevan `Authorization: Bearer <token>` con el token de la variable de
+entorno CALCULADORA_API_TOKEN (o API_TOKEN en los secrets de Streamlit o en config.py).
+
+Uso:
+    CALCULADORA_API_TOKEN=... python api.py --port 8600
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+import pytz
+import tornado.web
+
+import calculadora_cambio as app
+from cola_comprobantes import pending_count
+from espejo_local import failed_entries, pending_replication_count
+from importacion import bulk_quote_inputs, normalize_operations
+from servicio import TIMEZONE
+
+DEFAULT_PORT = 8600
+COALESCE_WINDOW_SECONDS = 0.05
+MAX_LOTS_PER_GROUP = 200
+MAX_LOTS_PER_REQUEST = 50
+RATES_TTL_SECONDS = 300
+
+def api_token():
+    """Token de la API. Prioridad: variable de entorno, secrets de Streamlit, config.py."""
+    token = os.environ.get("CALCULADORA_API_TOKEN")
+    if token:
+        return token
+    try:
+        return app.st.secrets["API_TOKEN"]
+    except (FileNotFoundError, KeyError):
+        try:
+            from config import API_TOKEN
+            return API_TOKEN
+        except ImportError:
+            return None
+
+class RatesCache:
+    """Tasas de la hoja 'Tasas' leídas como mucho cada `ttl` segundos (igual que la app)."""
+    def __init__(self, service, ttl=RATES_TTL_SECONDS):
+        self.service = service
+        self.ttl = ttl
+        self._rates = None
+        self._read_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._rates is None or time.monotonic() - self._read_at > self.ttl:
+                self._rates = self.service.rates()
+                self._read_at = time.monotonic()
+            return self._rates
+
+# --- LOTES ---
+
+def _lot_error(lot, status, message):
+    return {"cliente": lot.get("cliente"), "error": message, "status": status}
+
+def _parse_lot(lot):
+    """Valida un lote y devuelve (alias, argumentos del cotizador). Lanza ValueError con el motivo."""
+    alias = lot.get("cliente")
+    operaciones = lot.get("operaciones")
+    if not isinstance(alias, str) or not alias:
+        raise ValueError("falta 'cliente'")
+    if not isinstance(operaciones, list) or not operaciones or not all(isinstance(op, dict) for op in operaciones):
+        raise ValueError("'operaciones' debe ser una lista no vacía de objetos con tipo, monto y moneda")
+    for field in ("tasa_compra", "tasa_venta"):
+        rate = lot.get(field)
+        if rate is not None and (isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0):
+            raise ValueError(f"'{field}' debe ser un número mayor a cero")
+    operations, errors = normalize_operations(pd.DataFrame(operaciones))
+    if errors:
+        raise ValueError("; ".join(errors))
+    if operations.empty:
+        raise ValueError("no hay operaciones con monto mayor a cero")
+    return alias, bulk_quote_inputs(operations)
+
+def _quote_lot(service, lot, inputs, rates, balance_usdt):
+    precio_compra = lot.get("tasa_compra") or rates()[0]
+    precio_venta = lot.get("tasa_venta") or rates()[1]
+    return service.quote(inputs["amounts_vende"], inputs["amounts_compra"], inputs["mode_vende"], inputs["mode_compra"],
+                         precio_compra, precio_venta, inputs["ajustes"], balance_usdt)
+
+def commit_lots(service, lots, rates):
+    """
+    Registra varios lotes {cliente, operaciones, tasa_compra?, tasa_venta?} con una sola
+    reserva de folios y un solo aviso a los hilos de fondo. `rates()` devuelve las tasas
+    por defecto. Devuelve un resultado por lote, en orden: {cliente, folios, saldo_usdt,
+    saldo_mxn, en_linea} o {cliente, error, status} con el código HTTP del error.
+    """
+    results = [None] * len(lots)
+    # Primera pasada: validar y contar las operaciones de cada lote. El número de
+    # operaciones no depende del saldo, así que se cotiza con saldo 0 solo para contarlas.
+    parsed = []
+    for i, lot in enumerate(lots):
+        try:
+            alias, inputs = _parse_lot(lot)
+            service.client_balance(alias)
+        except ValueError as e:
+            results[i] = _lot_error(lot, 400, str(e))
+            continue
+        except LookupError as e:
+            results[i] = _lot_error(lot, 404, str(e))
+            continue
+        try:
+            count = len(service.build_batch(_quote_lot(service, lot, inputs, rates, 0.0)))
+        except Exception as e:
+            results[i] = _lot_error(lot, 503, f"No se pudieron leer las tasas: {e}")
+            continue
+        parsed.append((i, alias, inputs, count))
+    if not parsed:
+        return results
+
+    now = datetime.now(pytz.timezone(TIMEZONE))
+    try:
+        folios, online = service.reserve_folios(now.strftime("%y-%m-%d"), sum(count for *_, count in parsed))
+    except Exception as e:
+        for i, *_ in parsed:
+            results[i] = _lot_error(lots[i], 503, f"No se pudieron reservar los folios: {e}")
+        return results
+
+    # Segunda pasada: cotizar con el saldo vigente (que ya incluye los lotes anteriores
+    # del mismo cliente) y registrar cada lote con su tramo de folios
+    start = 0
+    for i, alias, inputs, count in parsed:
+        lot_folios = folios[start:start + count]
+        start += count
+        try:
+            balance_usdt, _ = service.client_balance(alias)
+            quote = _quote_lot(service, lots[i], inputs, rates, balance_usdt)
+            result = service.commit(alias, quote, service.build_batch(quote), now=now, reserved=(lot_folios, online), notify=False)
+        except Exception as e:
+            results[i] = _lot_error(lots[i], 500, str(e))
+            continue
+        results[i] = {"cliente": alias, "folios": lot_folios, "saldo_usdt": result["balance_final_usdt"],
+                      "saldo_mxn": result["balance_final_pesos"], "en_linea": online}
+    service.notify_background()
+    return results
+
+class LotCoalescer:
+    """
+    Junta los lotes que llegan dentro de `window` segundos (hasta `max_lots`) y los registra
+    juntos con `commit_group(lotes)` en un solo hilo, sin bloquear el event loop.
+    """
+    def __init__(self, commit_group, window=COALESCE_WINDOW_SECONDS, max_lots=MAX_LOTS_PER_GROUP):
+        self.commit_group = commit_group
+        self.window = window
+        self.max_lots = max_lots
+        self.stats = Counter()
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-registro")
+
+    async def submit(self, lot):
+        """Encola un lote y espera su resultado."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((lot, future))
+        return await future
+
+    async def _next_group(self):
+        loop = asyncio.get_running_loop()
+        group = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(group) < self.max_lots:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                group.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return group
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            group = await self._next_group()
+            self.stats["grupos"] += 1
+            self.stats["lotes"] += len(group)
+            try:
+                results = await loop.run_in_executor(self._executor, self.commit_group, [lot for lot, _ in group])
+            except Exception as e:
+                results = [_lot_error(lot, 500, str(e)) for lot, _ in group]
+            for (_, future), result in zip(group, results):
+                if not future.done():
+                    future.set_result(result)
+
+# --- HANDLERS ---
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, service, coalescer, token):
+        self.service = service
+        self.coalescer = coalescer
+        self.token = token
+
+    def prepare(self):
+        expected = f"Bearer {self.token}".encode()
+        if not hmac.compare_digest(self.request.headers.get("Authorization", "").encode(), expected):
+            self.fail(401, "Token inválido")
+
+    def fail(self, status, message):
+        """Responde el error como JSON {error} (el texto va en el cuerpo, no en la línea de estado)."""
+        self.set_status(status)
+        self.finish({"error": message})
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({"error": self._reason})
+
+class OperationsHandler(BaseHandler):
+    async def post(self):
+        try:
+            body = json.loads(self.request.body)
+        except ValueError:
+            return self.fail(400, "El cuerpo no es JSON válido")
+        batched = isinstance(body, dict) and "lotes" in body
+        lots = body["lotes"] if batched else [body]
+        if not isinstance(lots, list) or not lots or not all(isinstance(lot, dict) for lot in lots):
+            return self.fail(400, "Se espera un lote o {'lotes': [lote, ...]}")
+        if len(lots) > MAX_LOTS_PER_REQUEST:
+            return self.fail(400, f"Máximo {MAX_LOTS_PER_REQUEST} lotes por petición")
+        results = await asyncio.gather(*(self.coalescer.submit(lot) for lot in lots))
+        if batched:
+            self.finish({"lotes": results})
+        else:
+            result = dict(results[0])
+            self.set_status(result.pop("status", 200))
+            self.finish(result)
+
+class ClientHandler(BaseHandler):
+    async def get(self, alias):
+        loop = asyncio.get_running_loop()
+        try:
+            usdt, mxn = await loop.run_in_executor(None, self.service.client_balance, alias)
+        except LookupError as e:
+            return self.fail(404, str(e))
+        self.finish({"cliente": alias, "saldo_usdt": usdt, "saldo_mxn": mxn})
+
+class StatusHandler(BaseHandler):
+    async def get(self):
+        replicator, worker = self.service.replicator, self.service.receipt_worker
+        stats = self.coalescer.stats
+        self.finish({
+            "replicacion_pendiente": pending_replication_count(self.service.db_path),
+            "replicacion_fallida": failed_entries(self.service.db_path),
+            "comprobantes_pendientes": pending_count(self.service.db_path),
+            "error_replicacion": str(replicator.last_error) if replicator and replicator.last_error else None,
+            "error_comprobantes": str(worker.last_error) if worker and worker.last_error else None,
+            "grupos": stats["grupos"],
+            "lotes": stats["lotes"],
+            "envios_sheets": replicator.flush_summary() if replicator else {},
+        })
+
+def make_app(service, token, window=COALESCE_WINDOW_SECONDS):
+    """Aplicación tornado y su LotCoalescer (hay que correr `coalescer.run()` en el mismo loop)."""
+    rates = RatesCache(service)
+    coalescer = LotCoalescer(lambda lots: commit_lots(service, lots, rates.get), window=window)
+    handler_args = {"service": service, "coalescer": coalescer, "token": token}
+    return tornado.web.Application([
+        (r"/operaciones", OperationsHandler, handler_args),
+        (r"/clientes/([^/]+)", ClientHandler, handler_args),
+        (r"/estado", StatusHandler, handler_args),
+    ]), coalescer
+
+def connect_service():
+    """El mismo servicio de la app, conectado con las credenciales de secrets o config.py."""
+    gsheet_client, spreadsheet_id, sheet_tab_name = app.connect_to_google_sheets()
+    return app.get_ledger_service(app.get_sheet_registry(gsheet_client), spreadsheet_id, sheet_tab_name)
+
+async def serve(args, token):
+    application, coalescer = make_app(connect_service(), token, window=args.window)
+    application.listen(args.port, args.address)
+    print(f"API escuchando en http://{args.address}:{args.port}")
+    await coalescer.run()
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP/JSON para registrar operaciones.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--window", type=float, default=COALESCE_WINDOW_SECONDS,
+                        help="segundos que se esperan para juntar lotes en un solo registro")
+    args = parser.parse_args()
+    token = api_token()
+    if not token:
+        parser.error("define el token en CALCULADORA_API_TOKEN (o API_TOKEN en secrets/config.py)")
+    asyncio.run(serve(args, token))
+
+if __name__ == "__main__":
+    main()
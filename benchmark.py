@@ -0,0 +1,585 @@
+"""
+Pruebas de carga y benchmarks de la calculadora contra dobles en memoria (fakes.py).
+
+Uso:
+    python benchmark.py folios --savers 48 --processes 4
+    python benchmark.py handles --reruns 20
+    python benchmark.py offline --saves 20
+    python benchmark.py quote --rows 10000
+    python benchmark.py money --saves 100000
+    python benchmark.py save --sizes 1 10 100 --latency 0.02
+    python benchmark.py coalesce --sessions 12 --windows 0 0.2
+    python benchmark.py startup --runs 5
+
+`save` guarda cada corrida como una línea JSON en benchmark_results.jsonl (con el commit,
+los parámetros y los resultados) y la compara con la última corrida de otro commit que
+usó los mismos parámetros.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+from PIL import Image
+
+from clientes import CLIENT_SHEET_NAME, ClientDirectoryCache, fetch_client_columns, write_client_balance
+from cola_comprobantes import enqueue_receipts, pending_count, process_pending
+from comprobantes import ReceiptFile
+from cotizador import MODE_PESOS_TO_USDT, MODE_USDT_TO_PESOS, PESOS_DECIMALS, USDT_DECIMALS, quote_rows, quote_totals, row_records
+from dinero import MICRO, from_micro, mul_div, to_micro
+from espejo_local import (SheetsReplicator, load_client_directory, pending_balances, pending_replication_count, record_batch,
+                          replay_journal, store_client_directory)
+from fakes import FakeDropbox, FakeGSheetClient
+from folios import FOLIO_SHEET_NAME, get_folio_counter_sheet, reserve_folios
+from hojas import WorksheetRegistry, is_unavailable_error
+from servicio import ExchangeLedgerService
+from trazas import tracer
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.jsonl")
+SPREADSHEET_ID = "bench"
+SHEET_TAB_NAME = "Operaciones"
+LEDGER_HEADERS = ["Folio", "Fecha", "Cliente", "Tipo", "Pesos", "USDT", "Tasa", "Link"]
+CLIENT_HEADERS = ["ID", "Alias Cliente", "Saldo USDT", "Saldo MXN"]
+
+def make_fake_backend(clients=100, ledger_rows=0, latency=0.0):
+    """Cliente de gspread en memoria con las pestañas que usa la app."""
+    gsheet_client = FakeGSheetClient(latency=latency)
+    gsheet_client.create_spreadsheet(SPREADSHEET_ID, {
+        SHEET_TAB_NAME: [LEDGER_HEADERS] + [[f"25-01-01-{i:04d}", "2025-01-01 10:00:00", f"cliente{i % clients}", "Compra", 1000, 54, 18.5, ""] for i in range(1, ledger_rows + 1)],
+        CLIENT_SHEET_NAME: [CLIENT_HEADERS] + [[i, f"cliente{i}", 0, 0] for i in range(clients)],
+        "Tasas": [["Compra", "Venta"], [18.55, 19.44]],
+    })
+    return gsheet_client
+
+def _stress_worker(db_path, savers, batches, latency, seed):
+    """Lanza `savers` hilos que reservan bloques de folios en paralelo; devuelve los folios emitidos."""
+    gsheet_client = FakeGSheetClient(latency=latency)
+    gsheet_client.create_spreadsheet(SPREADSHEET_ID, {SHEET_TAB_NAME: [LEDGER_HEADERS]})
+    counter = get_folio_counter_sheet(gsheet_client.open_by_key(SPREADSHEET_ID), SHEET_TAB_NAME)
+    issued, lock = [], threading.Lock()
+    rng = random.Random(seed)
+    sizes = [[rng.randint(1, 10) for _ in range(batches)] for _ in range(savers)]
+
+    def saver(block_sizes):
+        for size in block_sizes:
+            folios = reserve_folios(counter, "25-01-01", size, db_path=db_path)
+            assert len(folios) == size
+            with lock:
+                issued.extend(folios)
+
+    threads = [threading.Thread(target=saver, args=(s,)) for s in sizes]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return issued
+
+def bench_folios(args):
+    db_path = os.path.join(tempfile.mkdtemp(), "folios.db")
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(_stress_worker, [(db_path, args.savers, args.batches, args.latency, seed) for seed in range(args.processes)])
+    elapsed = time.perf_counter() - start
+    issued = [folio for result in results for folio in result]
+    duplicates = len(issued) - len(set(issued))
+    numbers = sorted(int(f.split('-')[3]) for f in issued)
+    gaps = numbers != list(range(1, len(numbers) + 1))
+    print(f"folios: {args.processes} procesos x {args.savers} hilos, {len(issued)} folios en {elapsed:.2f}s, "
+          f"duplicados={duplicates}, huecos={'sí' if gaps else 'no'}")
+    return 1 if duplicates or gaps else 0
+
+def _save_rerun(open_worksheet, db_path):
+    """Patrón de acceso a Sheets de un rerun que guarda: tasas, clientes, folios, registro y saldo."""
+    open_worksheet("Tasas").row_values(2)
+    open_worksheet(CLIENT_SHEET_NAME).get_all_records()
+    folios = reserve_folios(open_worksheet(FOLIO_SHEET_NAME), "25-01-01", 2, db_path=db_path)
+    open_worksheet(SHEET_TAB_NAME).append_rows([[f] + LEDGER_HEADERS[1:] for f in folios])
+    write_client_balance(open_worksheet(CLIENT_SHEET_NAME), "cliente1", 10, 0)
+
+def bench_handles(args):
+    results = {}
+    for label in ("antes", "después"):
+        db_path = os.path.join(tempfile.mkdtemp(), "folios.db")
+        gsheet_client = make_fake_backend()
+        get_folio_counter_sheet(gsheet_client.open_by_key(SPREADSHEET_ID), SHEET_TAB_NAME)
+        if label == "antes":
+            open_worksheet = lambda title: gsheet_client.open_by_key(SPREADSHEET_ID).worksheet(title)
+        else:
+            registry = WorksheetRegistry(gsheet_client)
+            open_worksheet = lambda title: registry.worksheet(SPREADSHEET_ID, title)
+        gsheet_client.calls.clear()
+        for _ in range(args.reruns):
+            _save_rerun(open_worksheet, db_path)
+        results[label] = gsheet_client.calls.copy()
+    for label, calls in results.items():
+        total = sum(calls.values())
+        breakdown = ", ".join(f"{name}={n / args.reruns:.1f}" for name, n in sorted(calls.items()))
+        print(f"handles [{label}]: {total / args.reruns:.1f} peticiones HTTP por rerun ({breakdown})")
+    return 0
+
+def _offline_save(registry, db_path, alias, balance, with_receipt):
+    """Un guardado como el de la app: folios (con respaldo local), comprobante en cola y diario."""
+    try:
+        counter = registry.worksheet(SPREADSHEET_ID, FOLIO_SHEET_NAME,
+                                     create=lambda spreadsheet: get_folio_counter_sheet(spreadsheet, SHEET_TAB_NAME))
+    except Exception as e:
+        if not is_unavailable_error(e):
+            raise
+        counter = None
+    folios = reserve_folios(counter, "25-01-01", 2, db_path=db_path)
+    rows = [[folio, "2025-01-01 10:00:00", alias, "Compra", 1855, 100, 18.55, ""] for folio in folios]
+    if with_receipt:
+        enqueue_receipts({folios[0]: ReceiptFile(f"{folios[0]}.jpg", folios[0].encode() * 64)}, alias, db_path=db_path)
+        rows[0][7] = "Pendiente de subir"
+    record_batch(rows, alias, balance, -balance * 18.55, db_path=db_path)
+    return folios
+
+def bench_offline(args):
+    db_path = os.path.join(tempfile.mkdtemp(), "offline.db")
+    gsheet_client, dbx_client = make_fake_backend(clients=10), FakeDropbox()
+    registry = WorksheetRegistry(gsheet_client)
+    ledger = lambda: registry.worksheet(SPREADSHEET_ID, SHEET_TAB_NAME)
+    clients = lambda: registry.worksheet(SPREADSHEET_ID, CLIENT_SHEET_NAME)
+
+    # 1) Caída total: los guardados solo llegan al diario local
+    gsheet_client.offline = dbx_client.offline = True
+    issued, balances = [], {}
+    for i in range(args.saves):
+        alias = f"cliente{i % 3}"
+        balances[alias] = balances.get(alias, 0) + 100
+        issued += _offline_save(registry, db_path, alias, balances[alias], with_receipt=i % 2 == 0)
+    try:
+        replay_journal(ledger(), clients(), db_path=db_path)
+    except Exception as e:
+        assert is_unavailable_error(e), e
+    print(f"offline: {args.saves} guardados sin conexión, {pending_replication_count(db_path)} entradas en el diario, "
+          f"{pending_count(db_path)} comprobantes en cola")
+
+    # 2) Vuelve la red pero se pierde la respuesta del primer append_rows (queda 'enviando')
+    gsheet_client.offline = dbx_client.offline = False
+    gsheet_client.drop_responses.add("append_rows")
+    try:
+        replay_journal(ledger(), clients(), db_path=db_path)
+    except Exception as e:
+        assert is_unavailable_error(e), e
+
+    # 3) Reproducción: no debe duplicar los folios que ya habían llegado
+    gsheet_client.calls.clear()
+    replay_journal(ledger(), clients(), db_path=db_path)
+    while process_pending(dbx_client, ledger(), db_path=db_path):
+        pass
+    ledger_rows = gsheet_client.spreadsheets[SPREADSHEET_ID].worksheet(SHEET_TAB_NAME).rows[1:]
+    folios = [row[0] for row in ledger_rows]
+    client_rows = {row[1]: row for row in gsheet_client.spreadsheets[SPREADSHEET_ID].worksheet(CLIENT_SHEET_NAME).rows[1:]}
+    wrong_balances = [alias for alias, usdt in balances.items() if float(client_rows[alias][2]) != usdt]
+    missing_links = [row[0] for row in ledger_rows if row[7] == "Pendiente de subir"]
+    duplicates = len(folios) - len(set(folios))
+    print(f"offline: reproducción con {sum(gsheet_client.calls.values())} peticiones ({', '.join(f'{k}={v}' for k, v in sorted(gsheet_client.calls.items()))}); "
+          f"{len(folios)}/{len(issued)} folios en la hoja, duplicados={duplicates}, saldos incorrectos={len(wrong_balances)}, "
+          f"links pendientes={len(missing_links)}, diario pendiente={pending_replication_count(db_path)}")
+    ok = sorted(folios) == sorted(issued) and not duplicates and not wrong_balances and not missing_links
+    ok = ok and not pending_replication_count(db_path)
+    return 0 if _concurrent_balance_check(args) and ok else 1
+
+def _concurrent_balance_check(args):
+    """
+    `args.threads` hilos guardan `args.commits` veces +1 USDT al mismo cliente, repartidos
+    entre dos servicios que comparten la base local (como la app y api.py) y cotizando con
+    el saldo que leyeron antes. El saldo final debe subir exactamente hilos × guardados.
+    """
+    db_path = os.path.join(tempfile.mkdtemp(), "concurrencia.db")
+    backend = argparse.Namespace(clients=10, ledger_rows=0, latency=0.0, dropbox_latency=0.0, dropbox_mbps=20.0)
+    services = [_make_save_backend(backend, db_path)[3] for _ in range(2)]
+    alias = "cliente0"
+    start_usdt, _ = services[0].client_balance(alias)
+
+    def session(i):
+        service = services[i % 2]
+        for _ in range(args.commits):
+            balance_usdt, _ = service.client_balance(alias)
+            quote = service.quote(np.array([1.0]), np.zeros(1), MODE_USDT_TO_PESOS, MODE_USDT_TO_PESOS,
+                                  18.55, 19.44, balance_inicial_usdt=balance_usdt)
+            service.commit(alias, quote, service.build_batch(quote))
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(args.threads)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    expected = from_micro(to_micro(start_usdt) + args.threads * args.commits * MICRO)
+    final_usdt = min(service.client_balance(alias)[0] for service in services)
+    print(f"offline: {args.threads} hilos × {args.commits} guardados de +1 USDT al mismo cliente: "
+          f"saldo final {final_usdt:,.2f} (esperado {expected:,.2f})")
+    return final_usdt == expected
+
+def _quote_row_by_row(amounts_vende, amounts_compra, modes_vende, modes_compra, precio_compra, precio_venta):
+    """Referencia fila por fila con Decimal (el cálculo que hacía la interfaz, redondeado half-up)."""
+    pesos_q, usdt_q = Decimal(1).scaleb(-PESOS_DECIMALS), Decimal(1).scaleb(-USDT_DECIMALS)
+    compra, venta = Decimal(repr(precio_compra)), Decimal(repr(precio_venta))
+    rows = []
+    for vende, compra_monto, mode_vende, mode_compra in zip(amounts_vende, amounts_compra, modes_vende, modes_compra):
+        vende, compra_monto = Decimal(repr(vende)), Decimal(repr(compra_monto))
+        if mode_vende == MODE_PESOS_TO_USDT:
+            pesos_pagar, usdt_recibir = vende, vende / compra
+        else:
+            pesos_pagar, usdt_recibir = vende * compra, vende
+        if mode_compra == MODE_PESOS_TO_USDT:
+            pesos_cobrar, usdt_entregar = compra_monto, compra_monto / venta
+        else:
+            pesos_cobrar, usdt_entregar = compra_monto * venta, compra_monto
+        rows.append({"pesos_pagar": float(pesos_pagar.quantize(pesos_q, ROUND_HALF_UP)),
+                     "usdt_recibir": float(usdt_recibir.quantize(usdt_q, ROUND_HALF_UP)),
+                     "pesos_cobrar": float(pesos_cobrar.quantize(pesos_q, ROUND_HALF_UP)),
+                     "usdt_entregar": float(usdt_entregar.quantize(usdt_q, ROUND_HALF_UP))})
+    return rows
+
+def bench_quote(args):
+    rng = np.random.default_rng(7)
+    amounts_vende = np.round(rng.uniform(0, 2_000_000, args.rows), 2)
+    amounts_compra = np.round(rng.uniform(0, 100_000, args.rows), 2)
+    modes = np.array([MODE_PESOS_TO_USDT, MODE_USDT_TO_PESOS])
+    modes_vende, modes_compra = modes[rng.integers(0, 2, args.rows)], modes[rng.integers(0, 2, args.rows)]
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        reference = _quote_row_by_row(amounts_vende.tolist(), amounts_compra.tolist(), modes_vende.tolist(), modes_compra.tolist(), 18.55, 19.44)
+    row_by_row = (time.perf_counter() - start) / args.repeat
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        rows = quote_rows(amounts_vende, amounts_compra, modes_vende, modes_compra, 18.55, 19.44)
+        totals = quote_totals(rows, 0, 0, 0)
+    vectorized = (time.perf_counter() - start) / args.repeat
+    mismatches = sum(a != b for a, b in zip(row_records(rows), reference))
+    print(f"quote: {args.rows} filas, fila por fila (Decimal) {row_by_row * 1000:.1f} ms, vectorizado {vectorized * 1000:.2f} ms "
+          f"(x{row_by_row / vectorized:.0f}); filas distintas al redondeo Decimal: {mismatches}; "
+          f"balance final {from_micro(totals['balance_final_usdt']):,.6f} USDT")
+    return 1 if mismatches else 0
+
+def bench_money(args):
+    """Saldo acumulado en muchos guardados (pesos -> USDT): float vs. Decimal vs. micro-unidades."""
+    rng = np.random.default_rng(11)
+    amounts = np.round(rng.uniform(-50_000, 50_000, args.saves), 2)
+    rates = np.round(rng.uniform(17.5, 20.5, args.saves), 4)
+    amount_list, rate_list = amounts.tolist(), rates.tolist()
+
+    start = time.perf_counter()
+    balance_float = 0.0
+    for amount, rate in zip(amount_list, rate_list):
+        balance_float += amount / rate
+    float_time = time.perf_counter() - start
+
+    usdt_q = Decimal(1).scaleb(-6)
+    start = time.perf_counter()
+    balance_decimal = Decimal(0)
+    for amount, rate in zip(amount_list, rate_list):
+        balance_decimal += (Decimal(repr(amount)) / Decimal(repr(rate))).quantize(usdt_q, ROUND_HALF_UP)
+    decimal_time = time.perf_counter() - start
+
+    amounts_micro, rates_micro = [to_micro(a) for a in amount_list], [to_micro(r) for r in rate_list]
+    start = time.perf_counter()
+    balance_micro = 0
+    for amount, rate in zip(amounts_micro, rates_micro):
+        q, r = divmod(abs(amount) * MICRO, rate)
+        balance_micro += (q + (2 * r >= rate)) * (1 if amount >= 0 else -1)
+    micro_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    balance_vector = int(mul_div(to_micro(amounts), MICRO, to_micro(rates)).sum())
+    vector_time = time.perf_counter() - start
+
+    exact = int(balance_decimal.scaleb(6))
+    print(f"money: {args.saves} guardados; float {float_time * 1e9 / args.saves:.0f} ns/op (deriva {balance_float - float(balance_decimal):+.9f} USDT), "
+          f"Decimal {decimal_time * 1e9 / args.saves:.0f} ns/op, micro int {micro_time * 1e9 / args.saves:.0f} ns/op "
+          f"(diferencia {balance_micro - exact} µUSDT), micro vectorizado {vector_time * 1e9 / args.saves:.1f} ns/op "
+          f"(diferencia {balance_vector - exact} µUSDT); saldo {from_micro(balance_vector):,.6f}")
+    return 1 if balance_micro != exact or balance_vector != exact else 0
+
+def _git_revision():
+    """Commit actual (con '+' si hay cambios sin commitear) para comparar corridas entre commits."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+    return revision + ("+" if dirty else "")
+
+def _make_photo(rng, width, height):
+    """Foto sintética de ruido (el peor caso para JPEG), como la de un comprobante tomado con el celular."""
+    output = io.BytesIO()
+    Image.frombytes("RGB", (width, height), rng.bytes(width * height * 3)).save(output, format="JPEG", quality=95)
+    return output.getvalue()
+
+def _make_save_backend(args, db_path):
+    """Sheets y Dropbox falsos con latencia y el servicio de registro armado como en la app (sin hilos de fondo)."""
+    gsheet_client = make_fake_backend(clients=args.clients, ledger_rows=args.ledger_rows, latency=args.latency)
+    dbx_client = FakeDropbox(latency=args.dropbox_latency, bytes_per_second=args.dropbox_mbps * 125_000)
+    registry = WorksheetRegistry(gsheet_client)
+    client_cache = ClientDirectoryCache(
+        fetch_columns=lambda: registry.run(SPREADSHEET_ID, CLIENT_SHEET_NAME, fetch_client_columns),
+        get_version=lambda: registry.spreadsheet(SPREADSHEET_ID).get_lastUpdateTime(),
+        overrides=lambda: pending_balances(db_path),
+        on_sync=lambda directory: store_client_directory(directory, db_path),
+        fallback=lambda: load_client_directory(db_path),
+    )
+    service = ExchangeLedgerService(registry, SPREADSHEET_ID, SHEET_TAB_NAME, client_cache, db_path=db_path)
+    return gsheet_client, dbx_client, registry, service
+
+def _pipeline_save(service, dbx_client, alias, amounts, receipts):
+    """
+    Un guardado de la interfaz sin Streamlit, con ExchangeLedgerService: saldo del cliente,
+    tasas, cotización y commit (folios, compresión y subida de los comprobantes {índice de
+    operación: archivo} y registro en el espejo local). La réplica a Sheets se mide aparte;
+    con replicador devuelve el Future que se resuelve cuando el lote llega a la hoja.
+    """
+    balance_usdt, _ = service.client_balance(alias)
+    precio_compra, precio_venta = service.rates()
+    quote = service.quote(amounts, np.zeros_like(amounts), MODE_PESOS_TO_USDT, MODE_PESOS_TO_USDT,
+                          precio_compra, precio_venta, balance_inicial_usdt=balance_usdt)
+    result = service.commit(alias, quote, service.build_batch(quote), receipts={("Compra", i): f for i, f in receipts.items()},
+                            dbx_client=dbx_client, compress_options={})
+    if result["upload_errors"]:
+        raise RuntimeError(f"Fallaron subidas en el benchmark: {result['upload_errors']}")
+    return result["replicated"]
+
+def _bench_save_size(args, size):
+    """
+    Corre un guardado de calentamiento (crea la hoja de folios y llena las cachés), `args.repeat`
+    guardados medidos de `size` operaciones y uno más con tracemalloc para la memoria pico.
+    """
+    db_path = os.path.join(tempfile.mkdtemp(), "save.db")
+    tracer.db_path = db_path
+    gsheet_client, dbx_client, registry, service = _make_save_backend(args, db_path)
+    ledger = lambda: registry.worksheet(SPREADSHEET_ID, SHEET_TAB_NAME)
+    clients = lambda: registry.worksheet(SPREADSHEET_ID, CLIENT_SHEET_NAME)
+    rng = np.random.default_rng(size)
+    width, height = map(int, args.receipt_size.split("x"))
+    save_times, replication_times = [], []
+    save_calls, replication_calls, dropbox_calls = Counter(), Counter(), Counter()
+    n_receipts = round(size * args.receipts)
+
+    def one_save(i):
+        amounts = np.round(rng.uniform(100, 50_000, size), 2)
+        # Fotos distintas en cada guardado para que ninguna reutilice el link de otra
+        receipts = {j: ReceiptFile(f"comprobante_{i}_{j}.jpg", _make_photo(rng, width, height)) for j in range(n_receipts)}
+        alias = f"cliente{i % args.clients}"
+        before = gsheet_client.calls.copy(), dbx_client.calls.copy()
+        start = time.perf_counter()
+        _pipeline_save(service, dbx_client, alias, amounts, receipts)
+        saved = time.perf_counter()
+        middle = gsheet_client.calls.copy()
+        replay_journal(ledger(), clients(), service.client_cache.patch_balances, db_path=db_path)
+        replicated = time.perf_counter()
+        save_calls.update(middle - before[0])
+        replication_calls.update(gsheet_client.calls - middle)
+        dropbox_calls.update(dbx_client.calls - before[1])
+        return saved - start, replicated - saved
+
+    one_save(0)
+    save_calls.clear(), replication_calls.clear(), dropbox_calls.clear()
+    for i in range(1, args.repeat + 1):
+        save_time, replication_time = one_save(i)
+        save_times.append(save_time)
+        replication_times.append(replication_time)
+    tracemalloc.start()
+    one_save(args.repeat + 1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    per_save = lambda calls: {name: n / (args.repeat + 1) for name, n in sorted(calls.items())}
+    return {
+        "guardado_p50_ms": round(float(np.percentile(save_times, 50)) * 1000, 2),
+        "guardado_p95_ms": round(float(np.percentile(save_times, 95)) * 1000, 2),
+        "replica_p50_ms": round(float(np.percentile(replication_times, 50)) * 1000, 2),
+        "llamadas_sheets_guardado": per_save(save_calls),
+        "llamadas_sheets_replica": per_save(replication_calls),
+        "llamadas_dropbox": per_save(dropbox_calls),
+        "memoria_pico_mb": round(peak / 1e6, 2),
+    }
+
+def _previous_run(path, params, revision):
+    """Última corrida guardada con los mismos parámetros y de otro commit (o None)."""
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["parametros"] == params and record["commit"] != revision:
+                previous = record
+    return previous
+
+def bench_save(args):
+    """Pipeline de guardado completo (ExchangeLedgerService) contra Sheets y Dropbox falsos para lotes de varios tamaños."""
+    params = {name: getattr(args, name) for name in ("sizes", "repeat", "clients", "ledger_rows", "latency",
+                                                     "dropbox_latency", "dropbox_mbps", "receipts", "receipt_size")}
+    revision = _git_revision()
+    results = {}
+    for size in args.sizes:
+        result = results[str(size)] = _bench_save_size(args, size)
+        total = lambda calls: sum(calls.values())
+        print(f"save: lote de {size}: guardado p50 {result['guardado_p50_ms']:.1f} ms (p95 {result['guardado_p95_ms']:.1f}), "
+              f"réplica p50 {result['replica_p50_ms']:.1f} ms; por guardado {total(result['llamadas_sheets_guardado']):.1f} llamadas a Sheets "
+              f"+ {total(result['llamadas_sheets_replica']):.1f} en la réplica, {total(result['llamadas_dropbox']):.1f} a Dropbox; "
+              f"memoria pico {result['memoria_pico_mb']:.2f} MB")
+    previous = _previous_run(args.output, params, revision)
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"commit": revision, "fecha": datetime.now().isoformat(timespec="seconds"),
+                            "python": platform.python_version(), "parametros": params, "resultados": results}, ensure_ascii=False) + "\n")
+    print(f"save: resultados del commit {revision} agregados a {args.output}")
+    if previous:
+        for size, result in results.items():
+            before = previous["resultados"].get(size)
+            if before:
+                change = lambda key: (result[key] - before[key]) / before[key] if before[key] else 0.0
+                print(f"save: lote de {size} vs. {previous['commit']}: guardado {change('guardado_p50_ms'):+.0%}, "
+                      f"réplica {change('replica_p50_ms'):+.0%}, memoria {change('memoria_pico_mb'):+.0%}")
+    return 0
+
+def _bench_coalesce_window(args, window):
+    """`args.sessions` sesiones guardando a la vez con el replicador de la app y una ventana de `window` segundos."""
+    db_path = os.path.join(tempfile.mkdtemp(), "coalesce.db")
+    tracer.db_path = db_path
+    gsheet_client, dbx_client, registry, service = _make_save_backend(args, db_path)
+    service.replicator = SheetsReplicator(
+        get_ledger_sheet=lambda: registry.worksheet(SPREADSHEET_ID, SHEET_TAB_NAME),
+        get_client_sheet=lambda: registry.worksheet(SPREADSHEET_ID, CLIENT_SHEET_NAME),
+        on_balances_written=service.client_cache.patch_balances,
+        flush_window=window, db_path=db_path)
+    _pipeline_save(service, dbx_client, "cliente0", np.array([1000.0]), {}).result(timeout=60)
+    service.replicator.flushes.clear()
+    calls_before = gsheet_client.calls.copy()
+
+    save_times, replication_times, lock = [], [], threading.Lock()
+    def session(i):
+        rng = np.random.default_rng(i)
+        for _ in range(args.saves):
+            time.sleep(rng.uniform(0, args.think))
+            start = time.perf_counter()
+            replicated = _pipeline_save(service, dbx_client, f"cliente{i}", np.round(rng.uniform(100, 50_000, args.ops), 2), {})
+            saved = time.perf_counter()
+            replicated.result(timeout=60)
+            with lock:
+                save_times.append(saved - start)
+                replication_times.append(time.perf_counter() - saved)
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(args.sessions)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    calls = gsheet_client.calls - calls_before
+    return save_times, replication_times, calls, service.replicator.flush_summary()
+
+def bench_coalesce(args):
+    """Varias sesiones guardando a la vez: llamadas a Sheets, tamaño de los envíos agrupados y latencia hasta la hoja."""
+    for window in args.windows:
+        save_times, replication_times, calls, flushes = _bench_coalesce_window(args, window)
+        saves = len(save_times)
+        print(f"coalesce: ventana {window * 1000:.0f} ms, {saves} guardados de {args.sessions} sesiones: "
+              f"{sum(calls.values()) / saves:.2f} llamadas a Sheets por guardado "
+              f"(append_rows {calls['append_rows']}, batch_update {calls['batch_update']}); "
+              f"{flushes['entradas por envío']} guardados y {flushes['filas por envío']} filas por envío; "
+              f"guardado p50 {np.percentile(save_times, 50) * 1000:.1f} ms, "
+              f"hasta la hoja p50 {np.percentile(replication_times, 50) * 1000:.1f} ms (p95 {np.percentile(replication_times, 95) * 1000:.1f})")
+    return 0
+
+STARTUP_HEAVY_MODULES = ("gspread", "google.oauth2", "dropbox", "pandas", "pytz")
+_STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import calculadora_cambio as app
+import_seconds = time.perf_counter() - start
+loaded = [name for name in {heavy!r} if name in sys.modules]
+import benchmark
+backend = benchmark.make_fake_backend(clients={clients}, ledger_rows={ledger_rows}, latency={latency})
+app.connect_to_google_sheets = lambda: (backend, benchmark.SPREADSHEET_ID, benchmark.SHEET_TAB_NAME)
+# Como en un arranque en frío: el script empieza con las importaciones
+app.SCRIPT_STARTED = time.perf_counter() - import_seconds
+app.main()
+timings = {{row["sección"]: row["último (ms)"] for row in app.get_render_timings().summary()}}
+print(json.dumps({{"import_ms": import_seconds * 1000, "loaded": loaded, "first_paint_ms": timings["primer dibujo"],
+                  "page_ms": timings["página completa"]}}))
+"""
+
+def bench_startup(args):
+    """
+    Arranque en frío (un proceso nuevo por corrida): tiempo de importar calculadora_cambio,
+    qué SDKs pesados quedan cargados al importarla y, corriendo main() sin servidor contra
+    Sheets falso, el primer dibujo (hasta el esqueleto) y la página completa.
+    """
+    probe = _STARTUP_PROBE.format(heavy=STARTUP_HEAVY_MODULES, clients=args.clients, ledger_rows=args.ledger_rows, latency=args.latency)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(args.runs):
+        env = dict(os.environ, CALCULADORA_DB_PATH=os.path.join(tempfile.mkdtemp(), "startup.db"))
+        output = subprocess.run([sys.executable, "-c", probe], cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    median = lambda key: float(np.median([run[key] for run in runs]))
+    loaded = runs[-1]["loaded"]
+    print(f"startup: {args.runs} arranques en frío: importar la app {median('import_ms'):.0f} ms "
+          f"(SDKs pesados cargados: {', '.join(loaded) if loaded else 'ninguno'}); primer dibujo {median('first_paint_ms'):.0f} ms, "
+          f"página completa {median('page_ms'):.0f} ms (mediana)")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("folios", help="Reservas concurrentes de folios: verifica que no se repita ninguno")
+    p.add_argument("--savers", type=int, default=48)
+    p.add_argument("--batches", type=int, default=5)
+    p.add_argument("--processes", type=int, default=4)
+    p.add_argument("--latency", type=float, default=0.005)
+    p.set_defaults(func=bench_folios)
+    p = sub.add_parser("handles", help="Peticiones HTTP por rerun abriendo las hojas cada vez vs. con el registro de handles")
+    p.add_argument("--reruns", type=int, default=20)
+    p.set_defaults(func=bench_handles)
+    p = sub.add_parser("offline", help="Guardados durante una caída de Sheets/Dropbox y reproducción idempotente del diario")
+    p.add_argument("--saves", type=int, default=20)
+    p.add_argument("--threads", type=int, default=16, help="Hilos que guardan a la vez al mismo cliente")
+    p.add_argument("--commits", type=int, default=10, help="Guardados de +1 USDT por hilo")
+    p.set_defaults(func=bench_offline)
+    p = sub.add_parser("quote", help="Cotización de muchas filas: motor vectorizado vs. fila por fila con Decimal")
+    p.add_argument("--rows", type=int, default=10_000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_quote)
+    p = sub.add_parser("money", help="Deriva y costo por operación del saldo: float vs. Decimal vs. micro-unidades")
+    p.add_argument("--saves", type=int, default=100_000)
+    p.set_defaults(func=bench_money)
+    p = sub.add_parser("save", help="Pipeline de guardado completo (sin Streamlit) contra Sheets y Dropbox falsos: tiempo, llamadas y memoria")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="Operaciones por guardado")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--ledger-rows", type=int, default=5000)
+    p.add_argument("--latency", type=float, default=0.02, help="Segundos por llamada a Sheets")
+    p.add_argument("--dropbox-latency", type=float, default=0.05, help="Segundos por llamada a Dropbox")
+    p.add_argument("--dropbox-mbps", type=float, default=20.0, help="Ancho de banda de subida a Dropbox (Mbit/s)")
+    p.add_argument("--receipts", type=float, default=0.2, help="Fracción de operaciones con comprobante")
+    p.add_argument("--receipt-size", default="1600x1200", help="Tamaño de las fotos sintéticas (ANCHOxALTO)")
+    p.add_argument("--output", default=RESULTS_FILE)
+    p.set_defaults(func=bench_save)
+    p = sub.add_parser("coalesce", help="Sesiones concurrentes: envíos agrupados a Sheets con y sin ventana de espera")
+    p.add_argument("--sessions", type=int, default=12)
+    p.add_argument("--saves", type=int, default=5, help="Guardados por sesión")
+    p.add_argument("--ops", type=int, default=6, help="Operaciones por guardado")
+    p.add_argument("--think", type=float, default=0.5, help="Pausa máxima (s) entre guardados de una sesión")
+    p.add_argument("--windows", type=float, nargs="+", default=[0.0, 0.2], help="Ventanas de espera del replicador (s)")
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--ledger-rows", type=int, default=5000)
+    p.add_argument("--latency", type=float, default=0.02, help="Segundos por llamada a Sheets")
+    p.set_defaults(func=bench_coalesce, dropbox_latency=0.0, dropbox_mbps=20.0)
+    p = sub.add_parser("startup", help="Arranque en frío: tiempo de importación, SDKs cargados y primer dibujo de la página")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--ledger-rows", type=int, default=5000)
+    p.add_argument("--latency", type=float, default=0.2, help="Segundos por llamada a Sheets")
+    p.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
+import time
+SCRIPT_STARTED = time.perf_counter()  # El primer dibujo se mide desde aquí, importaciones incluidas
+
 import streamlit as st
-import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime
-import pandas as pd
-import dropbox
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import contextvars
 import os
-import pytz
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cotizador import MODE_PESOS_TO_USDT, MODE_USDT_TO_PESOS
+from dinero import from_micro
+from tiempos import RenderTimings
+from trazas import TRACE_RETENTION, tracer
+# gspread, google-auth, dropbox y pandas (y los módulos de la app que los usan) se importan
+# dentro de las funciones que los necesitan: la página se dibuja antes de cargarlos y la
+# conexión a Google Sheets se hace en segundo plano (ver start_initial_loads).
 
 # --- Importar credenciales (solo para entorno local) ---
 try:
@@ -16,9 +24,12 @@ except ImportError:
 # --- FUNCIONES DE CONEXIÓN Y DATOS ---
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive.file"]
 
-@st.cache_resource
+@st.cache_resource(show_spinner=False)
 def connect_to_google_sheets():
     """Conecta a Google Sheets."""
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from peticiones import RateLimitedHTTPClient
     try:
         creds_dict = st.secrets["google_creds"]
         spreadsheet_id = st.secrets["SPREADSHEET_ID"]
@@ -28,13 +39,19 @@ def connect_to_google_sheets():
         spreadsheet_id = SPREADSHEET_ID
         sheet_tab_name = SHEET_TAB_NAME
     creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-    client = gspread.authorize(creds)
+    client = gspread.authorize(creds, http_client=RateLimitedHTTPClient)
     return client, spreadsheet_id, sheet_tab_name
 
+@st.cache_resource(show_spinner=False)
+def get_sheet_registry(_gsheet_client):
+    """Registro de handles de Spreadsheet/Worksheet compartido por todas las sesiones."""
+    from hojas import WorksheetRegistry
+    return WorksheetRegistry(_gsheet_client)
+
 @st.cache_resource
 def connect_to_dropbox(manual_token=None):
     """
-    Conecta a Dropbox. 
+    Conecta a Dropbox. Solo se llama cuando hay comprobantes que subir.
     Prioridad 1: Token manual ingresado en la app.
     Prioridad 2: Secrets de Streamlit.
     Prioridad 3: Archivo config.py.
@@ -54,169 +71,171 @@ def connect_to_dropbox(manual_token=None):
                 pass
     
     if token:
+        import dropbox
         return dropbox.Dropbox(token)
     else:
         return None
 
-@st.cache_data(ttl=60)
-def get_client_data(_gsheet_client, spreadsheet_id):
-    """Lee la hoja 'Clientes' y devuelve los datos como un DataFrame."""
+@st.cache_resource(show_spinner=False)
+def start_receipt_worker(_sheets, spreadsheet_id, sheet_tab_name):
+    """Arranca (una vez por proceso) el hilo que sube los comprobantes en cola."""
+    from cola_comprobantes import ReceiptUploadWorker
+    return ReceiptUploadWorker(lambda: _sheets.worksheet(spreadsheet_id, sheet_tab_name))
+
+@st.cache_resource(show_spinner=False)
+def get_client_cache(_sheets, spreadsheet_id):
+    """Caché del directorio de clientes (una por proceso), ver ClientDirectoryCache."""
+    from clientes import CLIENT_SHEET_NAME, ClientDirectoryCache, fetch_client_columns
+    from espejo_local import load_client_directory, pending_balances, store_client_directory
+    def fetch_columns():
+        with tracer.span("sheets_clientes"):
+            return _sheets.run(spreadsheet_id, CLIENT_SHEET_NAME, fetch_client_columns)
+    def get_version():
+        with tracer.span("drive_version_clientes"):
+            return _sheets.spreadsheet(spreadsheet_id).get_lastUpdateTime()
+    return ClientDirectoryCache(
+        fetch_columns=fetch_columns,
+        get_version=get_version,
+        overrides=pending_balances,
+        on_sync=store_client_directory,
+        fallback=load_client_directory,
+    )
+
+@st.cache_resource(show_spinner=False)
+def start_replicator(_sheets, spreadsheet_id, sheet_tab_name):
+    """Arranca (una vez por proceso) el hilo que replica el espejo local a Google Sheets."""
+    from clientes import CLIENT_SHEET_NAME
+    from espejo_local import SheetsReplicator
+    client_cache = get_client_cache(_sheets, spreadsheet_id)
+    return SheetsReplicator(
+        get_ledger_sheet=lambda: _sheets.worksheet(spreadsheet_id, sheet_tab_name),
+        get_client_sheet=lambda: _sheets.worksheet(spreadsheet_id, CLIENT_SHEET_NAME),
+        on_balances_written=client_cache.patch_balances,
+    )
+
+def get_client_data(client_cache, loaded):
+    """
+    Devuelve el directorio de clientes indexado por alias (ver ClientDirectoryCache) que
+    `loaded`, un Future de client_cache.get(), cargó en segundo plano.
+    """
+    import gspread
+    from clientes import empty_client_directory
     try:
-        spreadsheet = _gsheet_client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet("Clientes")
-        data = worksheet.get_all_records()
-        if not data: return pd.DataFrame(columns=['Alias Cliente', 'Saldo USDT', 'Saldo MXN'])
-            
-        df = pd.DataFrame(data)
-        df['Saldo USDT'] = df['Saldo USDT'].astype(str).str.replace(r'[$,]', '', regex=True)
-        df['Saldo MXN'] = df['Saldo MXN'].astype(str).str.replace(r'[$,]', '', regex=True)
-        df['Saldo USDT'] = pd.to_numeric(df['Saldo USDT'], errors='coerce').fillna(0)
-        df['Saldo MXN'] = pd.to_numeric(df['Saldo MXN'], errors='coerce').fillna(0)
-        return df
+        directory = loaded.result()
+        if client_cache.last_error:
+            st.warning(f"⚠️ Saldos tomados de la copia local; no se pudo sincronizar con Google Sheets: {client_cache.last_error}")
+        return directory
     except gspread.exceptions.WorksheetNotFound:
         st.error("Error: No se encontró la hoja 'Clientes' en tu Google Sheet.")
-        return pd.DataFrame()
+        return empty_client_directory()
     except Exception as e:
         st.error(f"No se pudo cargar la lista de clientes: {e}")
-        return pd.DataFrame()
+        return empty_client_directory()
 
-def upload_to_dropbox(dbx_client, file_object, client_name):
-    """Sube un archivo a Dropbox y devuelve el link para compartir."""
-    if dbx_client is None:
-        return "Error: Token de Dropbox no configurado"
-        
-    try:
-        mexico_tz = pytz.timezone("America/Mexico_City")
-        timestamp = datetime.now(mexico_tz).strftime("%Y%m%d_%H%M%S")
-        dropbox_path = f"/{client_name.replace(' ', '_')}/{timestamp}_{file_object.name}"
-        
-        dbx_client.files_upload(file_object.getvalue(), dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
-        
-        try:
-            links = dbx_client.sharing_list_shared_links(path=dropbox_path).links
-            link = links[0].url if links else None
-        except dropbox.exceptions.ApiError as err:
-            if 'shared_link_already_exists' in str(err):
-                links = dbx_client.sharing_list_shared_links(path=dropbox_path).links
-                link = links[0].url if links else None
-            else: raise
-
-        if link is None:
-            link_metadata = dbx_client.sharing_create_shared_link_with_settings(dropbox_path)
-            link = link_metadata.url
-        
-        return link.replace("?dl=0", "?raw=1")
-    except Exception as e:
-        st.warning(f"No se pudo subir el archivo a Dropbox: {e}")
-        return ""
+@st.cache_resource(show_spinner=False)
+def get_ledger_service(_sheets, spreadsheet_id, sheet_tab_name):
+    """Servicio de cotización y registro (uno por proceso) con los hilos de fondo, ver ExchangeLedgerService."""
+    from servicio import ExchangeLedgerService
+    return ExchangeLedgerService(
+        _sheets, spreadsheet_id, sheet_tab_name,
+        client_cache=get_client_cache(_sheets, spreadsheet_id),
+        replicator=start_replicator(_sheets, spreadsheet_id, sheet_tab_name),
+        receipt_worker=start_receipt_worker(_sheets, spreadsheet_id, sheet_tab_name),
+    )
 
-def update_client_balance(_gsheet_client, spreadsheet_id, client_alias, new_usdt, new_mxn):
-    """Encuentra un cliente en la hoja 'Clientes' y actualiza sus saldos."""
-    try:
-        spreadsheet = _gsheet_client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet("Clientes")
-        cell = worksheet.find(client_alias, in_column=2)
-        if cell is None:
-            st.warning(f"No se pudo encontrar al cliente '{client_alias}' para actualizar su saldo.")
-            return False
-
-        headers = worksheet.row_values(1)
-        usdt_col = headers.index("Saldo USDT") + 1
-        mxn_col = headers.index("Saldo MXN") + 1
-        
-        worksheet.update_cell(cell.row, mxn_col, new_mxn)
-        worksheet.update_cell(cell.row, usdt_col, new_usdt)
-        return True
-    except Exception as e:
-        st.warning(f"Hubo un error al actualizar el saldo del cliente: {e}")
-        return False
+# --- NUEVA FUNCIÓN PARA LEER TASAS ---
+@st.cache_data(ttl=300, show_spinner=False)
+def get_initial_rates(_service, spreadsheet_id):
+    """Lee la hoja 'Tasas' y devuelve los valores iniciales. Lanza excepción si no se pudieron leer."""
+    return _service.rates()
 
-def get_next_folio_number(_gsheet_client, spreadsheet_id, sheet_tab_name):
-    """Revisa el último registro para determinar el siguiente folio."""
-    try:
-        spreadsheet = _gsheet_client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet(sheet_tab_name)
-        all_values = worksheet.get_all_values()
-        
-        if len(all_values) < 2: return 1
+# --- CARGA EN SEGUNDO PLANO ---
+@st.cache_resource
+def get_background_pool():
+    """Hilos compartidos por todas las sesiones para conectar y leer Sheets mientras se dibuja la página."""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="carga-inicial")
 
-        last_row = all_values[-1]
-        last_folio = last_row[0]
-        
-        parts = last_folio.split('-')
-        last_folio_date_str = f"{parts[0]}-{parts[1]}-{parts[2]}"
-        last_folio_num = int(parts[3])
+def run_in_background(function, *args):
+    """
+    Corre `function(*args)` en el pool con el contexto de la sesión actual (así las funciones
+    cacheadas de Streamlit se comportan igual que en el hilo del script) y en una copia de
+    los contextvars, para que sus tramos caigan en la traza del rerun. Devuelve un Future.
+    Lo que corre aquí no debe dibujar nada (Streamlit no admite escribir elementos desde dos
+    hilos a la vez): por eso las funciones cacheadas que alcanza start_initial_loads van con
+    show_spinner=False; la página ya muestra sus marcadores de "Cargando".
+    """
+    ctx = get_script_run_ctx()
+    def call():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return function(*args)
+    return get_background_pool().submit(contextvars.copy_context().run, call)
 
-        today_date_str = datetime.now(pytz.timezone("America/Mexico_City")).strftime("%y-%m-%d")
+def open_ledger_service():
+    """Conecta a Google Sheets y arma el servicio de registro: (registro de hojas, servicio, id de la hoja)."""
+    gsheet_client, spreadsheet_id, sheet_tab_name = connect_to_google_sheets()
+    sheets = get_sheet_registry(gsheet_client)
+    return sheets, get_ledger_service(sheets, spreadsheet_id, sheet_tab_name), spreadsheet_id
 
-        if last_folio_date_str == today_date_str:
-            return last_folio_num + 1
-        else:
-            return 1
-    except (ValueError, IndexError):
-        return 1
-    except Exception:
-        return 1
-        
-# --- NUEVA FUNCIÓN PARA LEER TASAS ---
-@st.cache_data(ttl=300)
-def get_initial_rates(_gsheet_client, spreadsheet_id):
-    """Lee la hoja 'Tasas' y devuelve los valores iniciales."""
-    try:
-        spreadsheet = _gsheet_client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet("Tasas")
-        rates = worksheet.row_values(2)
-        tasa_compra = float(rates[0])
-        tasa_venta = float(rates[1])
-        return tasa_compra, tasa_venta
-    except gspread.exceptions.WorksheetNotFound:
-        return 18.55, 19.44
-    except Exception:
-        return 18.55, 19.44
+def start_initial_loads():
+    """
+    Arranca en segundo plano la conexión a Google Sheets y, en cuanto está, la lectura de las
+    tasas y del directorio de clientes en paralelo. Devuelve los Futures {servicio, tasas,
+    clientes}; la página dibuja su esqueleto mientras tanto y los espera donde los necesita.
+    """
+    service_future = run_in_background(open_ledger_service)
+    def load_rates():
+        _, service, spreadsheet_id = service_future.result()
+        return get_initial_rates(service, spreadsheet_id)
+    def load_clients():
+        _, service, _ = service_future.result()
+        return service.client_cache.get()
+    return {"servicio": service_future, "tasas": run_in_background(load_rates), "clientes": run_in_background(load_clients)}
 
 # --- FUNCIONES DE LA INTERFAZ ---
 
-def create_calculation_row(row_index, precio_compra, precio_venta, mode_vende, mode_compra):
+def create_calculation_row(row_index, mode_vende, mode_compra):
+    """Dibuja una fila de cálculo; el resultado se llena después con render_row_results."""
     div_height = 78 if row_index == 0 else 38
     col_vende, _, col_compra = st.columns([1, 0.2, 1])
     if row_index == 0:
         with col_vende: st.subheader("Cliente Vende / Yo Compro")
         with col_compra: st.subheader("Cliente Compra / Yo Vendo")
     with col_vende:
-        label_vende = "Monto en USDT a Recibir" if mode_vende == "USDT -> Pesos" else "Monto en Pesos a Pagar"
-        resultado_suffix_vende = "MXN" if mode_vende == "USDT -> Pesos" else "USDT"
+        label_vende = "Monto en USDT a Recibir" if mode_vende == MODE_USDT_TO_PESOS else "Monto en Pesos a Pagar"
         col_monto, col_resultado, col_uploader = st.columns([0.8, 0.8, 0.4])
         with col_monto:
             label_visibility = "visible" if row_index == 0 else "collapsed"
             input_vende = st.number_input(label_vende, min_value=0.0, format="%.2f", step=100.0, key=f"input_vende_{row_index}", label_visibility=label_visibility)
         with col_resultado:
-            if mode_vende == "Pesos -> USDT":
-                pesos_a_pagar = input_vende; usdt_a_recibir = (pesos_a_pagar / precio_compra) if precio_compra > 0 else 0.0
-                resultado_vende = usdt_a_recibir
-            else: 
-                usdt_a_recibir = input_vende; pesos_a_pagar = usdt_a_recibir * precio_compra
-                resultado_vende = pesos_a_pagar
-            st.markdown(f"""<div style="display: flex; align-items: center; justify-content: start; height: {div_height}px;"><p style='font-size: 28px; font-weight: bold; color: #228B22; margin: 0;'>{resultado_vende:,.2f} {resultado_suffix_vende}</p></div>""", unsafe_allow_html=True)
+            resultado_vende = st.empty()
         with col_uploader:
-            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg"], key=f"uploader_vende_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
+            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg", "pdf"], key=f"uploader_vende_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
     with col_compra:
-        label_compra = "Monto en USDT a Entregar" if mode_compra == "USDT -> Pesos" else "Monto en Pesos a Cobrar"
-        resultado_suffix_compra = "MXN" if mode_compra == "USDT -> Pesos" else "USDT"
+        label_compra = "Monto en USDT a Entregar" if mode_compra == MODE_USDT_TO_PESOS else "Monto en Pesos a Cobrar"
         col_monto, col_resultado, col_uploader = st.columns([0.8, 0.8, 0.4])
         with col_monto:
             label_visibility = "visible" if row_index == 0 else "collapsed"
             input_compra = st.number_input(label_compra, min_value=0.0, format="%.2f", step=100.0, key=f"input_compra_{row_index}", label_visibility=label_visibility)
         with col_resultado:
-            if mode_compra == "Pesos -> USDT":
-                pesos_a_cobrar = input_compra; usdt_a_entregar = (pesos_a_cobrar / precio_venta) if precio_venta > 0 else 0.0
-                resultado_compra = usdt_a_entregar
-            else:
-                usdt_a_entregar = input_compra; pesos_a_cobrar = usdt_a_entregar * precio_venta
-                resultado_compra = pesos_a_cobrar
-            st.markdown(f"""<div style="display: flex; align-items: center; justify-content: start; height: {div_height}px;"><p style='font-size: 28px; font-weight: bold; color: #DC143C; margin: 0;'>{resultado_compra:,.2f} {resultado_suffix_compra}</p></div>""", unsafe_allow_html=True)
+            resultado_compra = st.empty()
         with col_uploader:
-            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg"], key=f"uploader_compra_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
-    return {"pesos_pagar": pesos_a_pagar, "usdt_recibir": usdt_a_recibir, "pesos_cobrar": pesos_a_cobrar, "usdt_entregar": usdt_a_entregar}
+            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg", "pdf"], key=f"uploader_compra_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
+    return {"input_vende": input_vende, "input_compra": input_compra, "div_height": div_height,
+            "resultado_vende": resultado_vende, "resultado_compra": resultado_compra}
+
+def render_row_results(row_widgets, row_data, mode_vende, mode_compra):
+    """Muestra el resultado cotizado de una fila en los huecos que dejó create_calculation_row."""
+    if mode_vende == MODE_PESOS_TO_USDT:
+        resultado_vende, suffix_vende = row_data["usdt_recibir"], "USDT"
+    else:
+        resultado_vende, suffix_vende = row_data["pesos_pagar"], "MXN"
+    if mode_compra == MODE_PESOS_TO_USDT:
+        resultado_compra, suffix_compra = row_data["usdt_entregar"], "USDT"
+    else:
+        resultado_compra, suffix_compra = row_data["pesos_cobrar"], "MXN"
+    div_height = row_widgets["div_height"]
+    row_widgets["resultado_vende"].markdown(f"""<div style="display: flex; align-items: center; justify-content: start; height: {div_height}px;"><p style='font-size: 28px; font-weight: bold; color: #228B22; margin: 0;'>{resultado_vende:,.2f} {suffix_vende}</p></div>""", unsafe_allow_html=True)
+    row_widgets["resultado_compra"].markdown(f"""<div style="display: flex; align-items: center; justify-content: start; height: {div_height}px;"><p style='font-size: 28px; font-weight: bold; color: #DC143C; margin: 0;'>{resultado_compra:,.2f} {suffix_compra}</p></div>""", unsafe_allow_html=True)
 
 def create_ajuste_row(row_index):
     col_pago, _, col_recibo = st.columns([1, 0.2, 1])
@@ -229,238 +248,382 @@ def create_ajuste_row(row_index):
             pago_monto = st.number_input("Monto del Pago", min_value=0.0, format="%.2f", key=f"pago_monto_{row_index}", label_visibility="collapsed")
             pago_moneda = st.radio("Moneda del Pago", ["MXN", "USDT"], key=f"pago_moneda_{row_index}", horizontal=True, index=1)
         with col_uploader:
-            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg"], key=f"uploader_pago_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
+            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg", "pdf"], key=f"uploader_pago_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
     with col_recibo:
         col_monto, col_uploader = st.columns([1, 0.4])
         with col_monto:
             recibo_monto = st.number_input("Monto del Recibo", min_value=0.0, format="%.2f", key=f"recibo_monto_{row_index}", label_visibility="collapsed")
             recibo_moneda = st.radio("Moneda del Recibo", ["MXN", "USDT"], key=f"recibo_moneda_{row_index}", horizontal=True, index=1)
         with col_uploader:
-            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg"], key=f"uploader_recibo_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
+            st.file_uploader("Comprobante", type=["png", "jpg", "jpeg", "pdf"], key=f"uploader_recibo_{row_index}_{st.session_state.upload_key_iter}", label_visibility="collapsed")
     return {"pago_monto": pago_monto, "pago_moneda": pago_moneda, "recibo_monto": recibo_monto, "recibo_moneda": recibo_moneda}
 
-def main():
-    st.set_page_config(page_title="Calculadora y Registro", page_icon="🏦", layout="wide")
-    st.markdown("""
-    <style>
-        [data-testid="stFileUploader"] section [data-testid="stFileUploaderDropzone"] {display: none;}
-        [data-testid="stFileUploader"] section {padding: 0;border: none;}
-        [data-testid="stFileUploader"] {padding-top: 28px;}
-    </style>
-    """, unsafe_allow_html=True)
-
-    # --- BARRA LATERAL PARA TOKEN ---
-    st.sidebar.header("Configuración")
-    manual_dbx_token = st.sidebar.text_input("Dropbox Access Token (Opcional)", type="password", help="Pega aquí tu token si hay errores de conexión")
-
-    st.markdown("<h1 style='text-align: center;'>Calculadora y Registro de Operaciones 🏦</h1>", unsafe_allow_html=True)
-    st.markdown("---")
-    
-    gsheet_client, SPREADSHEET_ID, SHEET_TAB_NAME = connect_to_google_sheets()
-    
-    # Pasamos el token manual a la función de conexión
-    dbx_client = connect_to_dropbox(manual_dbx_token)
-    
-    # Cargar tasas iniciales
-    initial_tasa_compra, initial_tasa_venta = get_initial_rates(gsheet_client, SPREADSHEET_ID)
-
-    if 'num_rows' not in st.session_state: st.session_state.num_rows = 1
-    if 'num_ajustes' not in st.session_state: st.session_state.num_ajustes = 1
-    if 'upload_key_iter' not in st.session_state: st.session_state.upload_key_iter = 0
-
-    def add_calculo_row():
-        st.session_state.num_rows += 1
-    def add_ajuste_row():
-        st.session_state.num_ajustes += 1
-    def limpiar_calculos_callback():
-        for i in range(st.session_state.get('num_rows', 1)):
-            if f"input_compra_{i}" in st.session_state:
-                st.session_state[f"input_compra_{i}"] = 0.0
-            if f"input_vende_{i}" in st.session_state:
-                st.session_state[f"input_vende_{i}"] = 0.0
-        st.session_state.num_rows = 1
-        st.session_state.upload_key_iter += 1
-    def limpiar_ajustes_callback():
-        for i in range(st.session_state.get('num_ajustes', 1)):
-            if f"pago_monto_{i}" in st.session_state:
-                st.session_state[f"pago_monto_{i}"] = 0.0
-            if f"recibo_monto_{i}" in st.session_state:
-                st.session_state[f"recibo_monto_{i}"] = 0.0
-        st.session_state.num_ajustes = 1
-        st.session_state.upload_key_iter += 1
-    def limpiar_todo_callback():
-        limpiar_calculos_callback()
-        limpiar_ajustes_callback()
-        st.session_state.num_rows = 1
-        st.session_state.num_ajustes = 1
-        if "cliente_selector" in st.session_state: st.session_state.cliente_selector = "-- Seleccione un Cliente --"
-
-    st.header("1. Configuración de Operación")
-    col_cliente, col_compra, col_venta = st.columns(3)
-    with col_cliente:
-        st.subheader("Cliente y Balance")
-        client_df = get_client_data(gsheet_client, SPREADSHEET_ID)
-        balance_inicial_usdt, balance_inicial_pesos, selected_client_name = 0.0, 0.0, ""
-        if not client_df.empty:
-            client_list = ["-- Seleccione un Cliente --"] + client_df['Alias Cliente'].tolist()
-            selected_client_name = st.selectbox("Cliente", client_list, key="cliente_selector")
-            if selected_client_name != "-- Seleccione un Cliente --":
-                client_data = client_df[client_df['Alias Cliente'] == selected_client_name].iloc[0]
-                balance_inicial_usdt = float(client_data['Saldo USDT'])
-                balance_inicial_pesos = float(client_data['Saldo MXN'])
-                metric_col1, metric_col2 = st.columns(2)
-                with metric_col1: st.metric("Saldo USDT", f"{balance_inicial_usdt:,.2f}")
-                with metric_col2: st.metric("Saldo Pesos", f"${balance_inicial_pesos:,.2f}")
-                st.caption("Positivo = cliente te debe. Negativo = tú le debes.")
+def render_bulk_import():
+    """
+    Captura masiva: un CSV/XLSX o una tabla pegada se revisa y corrige en una sola cuadrícula.
+    Devuelve los argumentos del cotizador (ver importacion.bulk_quote_inputs).
+    """
+    from importacion import CURRENCIES, OPERATION_TYPES, bulk_quote_inputs, empty_operations, normalize_operations, read_operations
+    col_file, col_paste = st.columns(2)
+    with col_file:
+        bulk_file = st.file_uploader("Archivo CSV o XLSX (columnas: tipo, monto, moneda)", type=["csv", "xlsx"], key=f"bulk_file_{st.session_state.upload_key_iter}")
+    with col_paste:
+        pasted = st.text_area("…o pega la tabla desde Excel", height=120, key=f"bulk_paste_{st.session_state.upload_key_iter}", placeholder="tipo\tmonto\tmoneda\nCompra\t18550\tMXN")
+    operations, errors = empty_operations(), []
+    try:
+        if bulk_file is not None:
+            operations, errors = normalize_operations(read_operations(bulk_file, bulk_file.name))
+        elif pasted.strip():
+            operations, errors = normalize_operations(read_operations(pasted))
+    except Exception as e:
+        st.error(f"No se pudo leer la tabla: {e}")
+    for message in errors:
+        st.warning(message)
+
+    source_key = bulk_file.file_id if bulk_file is not None else hash(pasted)
+    edited = st.data_editor(
+        operations, num_rows="dynamic", use_container_width=True, key=f"bulk_editor_{source_key}",
+        column_config={
+            "tipo": st.column_config.SelectboxColumn("Tipo", options=OPERATION_TYPES, required=True),
+            "monto": st.column_config.NumberColumn("Monto", min_value=0.0, format="%.2f", required=True),
+            "moneda": st.column_config.SelectboxColumn("Moneda", options=CURRENCIES, required=True),
+        })
+    edited, _ = normalize_operations(edited)
+    inputs = bulk_quote_inputs(edited)
+    st.caption(f"{len(edited)} filas válidas: {len(inputs['amounts_vende'])} compras/ventas y {len(inputs['ajustes'])} pagos/recibos.")
+    return inputs
+
+def render_latency_panel(replicator):
+    """
+    Panel de administrador: p50/p95 por tipo de llamada externa, desglose del último guardado
+    (ver trazas.py) y tamaño y latencia de los envíos agrupados a Sheets.
+    """
+    with st.sidebar.expander("📈 Latencias de llamadas externas", expanded=True):
+        st.caption(f"p50/p95 sobre los últimos {TRACE_RETENTION:,} tramos registrados")
+        st.dataframe(tracer.latency_summary(), hide_index=True)
+        flushes = replicator.flush_summary()
+        if flushes:
+            st.caption("Envíos agrupados a Sheets (guardados de todas las sesiones por envío)")
+            st.dataframe([flushes], hide_index=True)
+        last_save = tracer.last_trace("guardado")
+        if last_save:
+            st.caption("Desglose del último guardado")
+            st.dataframe(last_save, hide_index=True)
         else:
-            st.warning("No se pudieron cargar los clientes.")
-    with col_compra:
-        st.subheader("Configuración de Compra")
-        precio_compra_casa = st.number_input("Tasa de Compra", value=initial_tasa_compra, format="%.4f", key="precio_compra_input")
-        mode_vende = st.radio("Modo para 'Cliente Vende / Yo Compro'", ("Pesos -> USDT", "USDT -> Pesos"), horizontal=True, key="mode_vende")
-    with col_venta:
-        st.subheader("Configuración de Venta")
-        precio_venta_casa = st.number_input("Tasa de Venta", value=initial_tasa_venta, format="%.4f", key="precio_venta_input")
-        mode_compra = st.radio("Modo para 'Cliente Compra / Yo Vendo'", ("Pesos -> USDT", "USDT -> Pesos"), horizontal=True, key="mode_compra")
-    st.markdown("---")
-
-    st.header("2. Operaciones de Compra/Venta")
-    if 'num_rows' not in st.session_state: st.session_state.num_rows = 1
-    col1, col2, _ = st.columns([1.3, 1.3, 5])
-    with col1: st.button("➕ Añadir Cálculo", on_click=add_calculo_row, use_container_width=True)
-    with col2: st.button("🔄 Limpiar Cálculos", use_container_width=True, on_click=limpiar_calculos_callback)
-    st.markdown("<br>", unsafe_allow_html=True)
-    all_rows_data = [create_calculation_row(i, precio_compra_casa, precio_venta_casa, mode_vende, mode_compra) for i in range(st.session_state.num_rows)]
-    st.markdown("---")
-
-    st.header("3. Pagos y Recibos (Ajustes de Caja)")
-    if 'num_ajustes' not in st.session_state: st.session_state.num_ajustes = 1
-    all_ajustes_data = [create_ajuste_row(i) for i in range(st.session_state.num_ajustes)]
-    col_ajuste1, col_ajuste2, _ = st.columns([1.3, 1.3, 5])
-    with col_ajuste1: st.button("➕ Añadir Ajuste", on_click=add_ajuste_row, use_container_width=True)
-    with col_ajuste2: st.button("🔄 Limpiar Ajustes", use_container_width=True, on_click=limpiar_ajustes_callback)
-    st.markdown("---")
-    
-    st.header("4. Totales y Balance Final")
-    pagar_pesos_sum = sum(d['pesos_pagar'] for d in all_rows_data)
-    recibir_usdt_sum = sum(d['usdt_recibir'] for d in all_rows_data)
-    cobrar_pesos_sum = sum(d['pesos_cobrar'] for d in all_rows_data)
-    entregar_usdt_sum = sum(d['usdt_entregar'] for d in all_rows_data)
-    
-    # Lógica corregida: Pagos SUMAN (aumentan deuda), Recibos RESTAN (disminuyen deuda)
-    ajuste_neto_pesos = sum(d['pago_monto'] for d in all_ajustes_data if d['pago_moneda'] == 'MXN') - sum(d['recibo_monto'] for d in all_ajustes_data if d['recibo_moneda'] == 'MXN')
-    ajuste_neto_usdt = sum(d['pago_monto'] for d in all_ajustes_data if d['pago_moneda'] == 'USDT') - sum(d['recibo_monto'] for d in all_ajustes_data if d['recibo_moneda'] == 'USDT')
-    
-    st.subheader("Totales Consolidados 🧮")
-    total_recibidos_usdt_final = recibir_usdt_sum + (balance_inicial_usdt if balance_inicial_usdt > 0 else 0) + (ajuste_neto_usdt if ajuste_neto_usdt > 0 else 0)
-    total_entregados_usdt_final = entregar_usdt_sum + (abs(balance_inicial_usdt) if balance_inicial_usdt < 0 else 0) + (abs(ajuste_neto_usdt) if ajuste_neto_usdt < 0 else 0)
-    col_total_pagar, _, col_total_cobrar = st.columns([1, 0.2, 1])
-    with col_total_pagar:
-        st.metric(label="TOTAL PESOS PAGADOS (Operaciones)", value=f"${pagar_pesos_sum:,.2f}")
-        st.metric(label="TOTAL USDT RECIBIDOS (Op. + Saldos)", value=f"{total_recibidos_usdt_final:,.2f} USDT")
-    with col_total_cobrar:
-        st.metric(label="TOTAL PESOS COBRADOS (Operaciones)", value=f"${cobrar_pesos_sum:,.2f}")
-        st.metric(label="TOTAL USDT ENTREGADOS (Op. + Saldos)", value=f"{total_entregados_usdt_final:,.2f} USDT")
+            st.caption("Aún no hay guardados registrados.")
+
+# --- SECCIONES DE LA PÁGINA Y TIEMPOS DE RENDER ---
+def get_render_timings():
+    """Tiempos de render de la sesión actual (ver tiempos.RenderTimings)."""
+    if "render_timings" not in st.session_state:
+        st.session_state.render_timings = RenderTimings()
+    return st.session_state.render_timings
+
+def add_calculo_row():
+    st.session_state.num_rows += 1
+def add_ajuste_row():
+    st.session_state.num_ajustes += 1
+def limpiar_calculos_callback():
+    for i in range(st.session_state.get('num_rows', 1)):
+        if f"input_compra_{i}" in st.session_state:
+            st.session_state[f"input_compra_{i}"] = 0.0
+        if f"input_vende_{i}" in st.session_state:
+            st.session_state[f"input_vende_{i}"] = 0.0
+    st.session_state.num_rows = 1
+    st.session_state.upload_key_iter += 1
+def limpiar_ajustes_callback():
+    for i in range(st.session_state.get('num_ajustes', 1)):
+        if f"pago_monto_{i}" in st.session_state:
+            st.session_state[f"pago_monto_{i}"] = 0.0
+        if f"recibo_monto_{i}" in st.session_state:
+            st.session_state[f"recibo_monto_{i}"] = 0.0
+    st.session_state.num_ajustes = 1
+    st.session_state.upload_key_iter += 1
+def limpiar_todo_callback():
+    limpiar_calculos_callback()
+    limpiar_ajustes_callback()
+    st.session_state.num_rows = 1
+    st.session_state.num_ajustes = 1
+    if "cliente_selector" in st.session_state: st.session_state.cliente_selector = None
+
+@st.fragment
+def operations_section(service, manual_dbx_token, deferred_uploads, compress_receipts, compress_options,
+                       selected_client_name, balance_inicial_usdt, balance_inicial_pesos,
+                       precio_compra_casa, precio_venta_casa, mode_vende, mode_compra):
+    """
+    Secciones 2 a 5 (filas, ajustes, totales y guardado) como un fragmento: editar un monto
+    solo vuelve a correr esto. Sus dependencias son los argumentos (cliente, saldo, tasas y
+    modos); cambiar cualquiera de ellos corre la página completa, que vuelve a llamar al
+    fragmento con los valores nuevos. Los totales dependen de todas las filas y ajustes, por
+    eso esas secciones comparten el fragmento. La cotización y el guardado los hace `service`.
+    """
+    timings = get_render_timings()
+    with timings.section("fragmento de operaciones"):
+        notice = st.session_state.pop("save_notice", None)
+        bulk_mode = st.toggle("Importación masiva (CSV, XLSX o tabla pegada)", key="bulk_mode", help="Captura muchas operaciones y ajustes en una sola cuadrícula en lugar de una fila de widgets por operación.")
+        if bulk_mode:
+            with timings.section("filas (importación masiva)"):
+                st.header("2. Importación Masiva de Operaciones y Ajustes")
+                inputs = render_bulk_import()
+                quote = service.quote(inputs["amounts_vende"], inputs["amounts_compra"], inputs["mode_vende"], inputs["mode_compra"],
+                                      precio_compra_casa, precio_venta_casa, inputs["ajustes"], balance_inicial_usdt)
+                st.markdown("---")
+        else:
+            with timings.section("filas de cálculo"):
+                st.header("2. Operaciones de Compra/Venta")
+                col1, col2, _ = st.columns([1.3, 1.3, 5])
+                with col1: st.button("➕ Añadir Cálculo", on_click=add_calculo_row, use_container_width=True)
+                with col2: st.button("🔄 Limpiar Cálculos", use_container_width=True, on_click=limpiar_calculos_callback)
+                st.markdown("<br>", unsafe_allow_html=True)
+                row_widgets = [create_calculation_row(i, mode_vende, mode_compra) for i in range(st.session_state.num_rows)]
+                st.markdown("---")
+
+            with timings.section("ajustes"):
+                st.header("3. Pagos y Recibos (Ajustes de Caja)")
+                all_ajustes_data = [create_ajuste_row(i) for i in range(st.session_state.num_ajustes)]
+                col_ajuste1, col_ajuste2, _ = st.columns([1.3, 1.3, 5])
+                with col_ajuste1: st.button("➕ Añadir Ajuste", on_click=add_ajuste_row, use_container_width=True)
+                with col_ajuste2: st.button("🔄 Limpiar Ajustes", use_container_width=True, on_click=limpiar_ajustes_callback)
+                st.markdown("---")
+
+            with timings.section("cotización de filas"):
+                quote = service.quote([w["input_vende"] for w in row_widgets], [w["input_compra"] for w in row_widgets],
+                                      mode_vende, mode_compra, precio_compra_casa, precio_venta_casa, all_ajustes_data, balance_inicial_usdt)
+                for widgets, row_data in zip(row_widgets, quote.records):
+                    render_row_results(widgets, row_data, mode_vende, mode_compra)
+
+        with timings.section("totales"):
+            st.header("4. Totales y Balance Final")
+            totals = quote.totals
+            st.subheader("Totales Consolidados 🧮")
+            col_total_pagar, _, col_total_cobrar = st.columns([1, 0.2, 1])
+            with col_total_pagar:
+                st.metric(label="TOTAL PESOS PAGADOS (Operaciones)", value=f"${from_micro(totals['pagar_pesos']):,.2f}")
+                st.metric(label="TOTAL USDT RECIBIDOS (Op. + Saldos)", value=f"{from_micro(totals['recibidos_usdt']):,.2f} USDT")
+            with col_total_cobrar:
+                st.metric(label="TOTAL PESOS COBRADOS (Operaciones)", value=f"${from_micro(totals['cobrar_pesos']):,.2f}")
+                st.metric(label="TOTAL USDT ENTREGADOS (Op. + Saldos)", value=f"{from_micro(totals['entregados_usdt']):,.2f} USDT")
         
-    st.subheader("Balance Final de Cierre ⚖️")
-    balance_final_usdt = (recibir_usdt_sum + balance_inicial_usdt + ajuste_neto_usdt) - entregar_usdt_sum
-    # Calculamos pesos internamente para actualizar la hoja, aunque no se muestre
-    balance_final_pesos = 0 #(cobrar_pesos_sum + balance_inicial_pesos + ajuste_neto_pesos) - pagar_pesos_sum
-    
-    if balance_final_usdt > 0:
-        status_texto = "TE DEBEN PAGAR (Utilidad en USDT)"
-        status_color = "#228B22"
-    elif balance_final_usdt < 0:
-        status_texto = "DEBES PAGAR (Pérdida en USDT)"
-        status_color = "#DC143C"
-    else:
-        status_texto = "BALANCE CERO"
-        status_color = "gray"
-    _, col_balance, _ = st.columns([1, 1.2, 1])
-    with col_balance:
-        st.metric(label="BALANCE FINAL USDT", value=f"{abs(balance_final_usdt):,.2f} USDT")
-        st.markdown(f"<h3 style='text-align: center; color: {status_color};'>{status_texto}</h3>", unsafe_allow_html=True)
-    st.markdown("---")
-    
-    st.header("5. Registrar Operaciones")
-    col_save, col_clear_all = st.columns([3,1])
-    with col_save:
-        if st.button("💾 Guardar y Actualizar Saldo", use_container_width=True, type="primary"):
-            if not selected_client_name or selected_client_name == "-- Seleccione un Cliente --":
-                st.error("Por favor, seleccione un cliente antes de guardar.")
+            st.subheader("Balance Final de Cierre ⚖️")
+            balance_final_usdt = quote.balance_final_usdt
+            if balance_final_usdt > 0:
+                status_texto = "TE DEBEN PAGAR (Utilidad en USDT)"
+                status_color = "#228B22"
+            elif balance_final_usdt < 0:
+                status_texto = "DEBES PAGAR (Pérdida en USDT)"
+                status_color = "#DC143C"
             else:
-                operations_to_process = []
-                for i, row_data in enumerate(all_rows_data):
-                    if row_data["pesos_pagar"] > 0 or row_data["usdt_recibir"] > 0: operations_to_process.append({'type': 'Compra', 'index': i, 'data': row_data})
-                    if row_data["pesos_cobrar"] > 0 or row_data["usdt_entregar"] > 0: operations_to_process.append({'type': 'Venta', 'index': i, 'data': row_data})
-                for i, ajuste in enumerate(all_ajustes_data):
-                    if ajuste['pago_monto'] > 0: operations_to_process.append({'type': 'Pago', 'index': i, 'data': ajuste})
-                    if ajuste['recibo_monto'] > 0: operations_to_process.append({'type': 'Recibo', 'index': i, 'data': ajuste})
-
-                if not operations_to_process:
-                    st.warning("No hay operaciones con montos mayores a cero para guardar.")
-                else:
-                    progress_bar = st.progress(0, text="Iniciando guardado...")
-                    data_to_save_batch = []
-                    
-                    mexico_tz = pytz.timezone("America/Mexico_City")
-                    now_mexico = datetime.now(mexico_tz)
-                    timestamp = now_mexico.strftime("%Y-%m-%d %H:%M:%S")
-                    today_prefix = now_mexico.strftime("%y-%m-%d")
-                    next_folio_num = get_next_folio_number(gsheet_client, SPREADSHEET_ID, SHEET_TAB_NAME)
-                    
-                    total_ops = len(operations_to_process)
-                    
-                    for i, op in enumerate(operations_to_process):
-                        current_folio = f"{today_prefix}-{next_folio_num + i:04d}"
-                        progress_text = f"Procesando operación {current_folio}..."
-                        progress_bar.progress((i) / (total_ops + 2), text=progress_text)
-                        link = ""
-                        
-                        if op['type'] == 'Compra':
-                            uploader_key = f"uploader_vende_{op['index']}_{st.session_state.upload_key_iter}"
-                            if uploader_key in st.session_state and st.session_state[uploader_key]:
-                                link = upload_to_dropbox(dbx_client, st.session_state[uploader_key], selected_client_name)
-                            data_to_save_batch.append([current_folio, timestamp, selected_client_name, "Compra", op['data']["pesos_pagar"], op['data']["usdt_recibir"], precio_compra_casa, link])
-                        elif op['type'] == 'Venta':
-                            uploader_key = f"uploader_compra_{op['index']}_{st.session_state.upload_key_iter}"
-                            if uploader_key in st.session_state and st.session_state[uploader_key]:
-                                link = upload_to_dropbox(dbx_client, st.session_state[uploader_key], selected_client_name)
-                            data_to_save_batch.append([current_folio, timestamp, selected_client_name, "Venta", op['data']["pesos_cobrar"], op['data']["usdt_entregar"], precio_venta_casa, link])
-                        elif op['type'] == 'Pago':
-                            uploader_key = f"uploader_pago_{op['index']}_{st.session_state.upload_key_iter}"
-                            if uploader_key in st.session_state and st.session_state[uploader_key]:
-                               link = upload_to_dropbox(dbx_client, st.session_state[uploader_key], selected_client_name)
-                            pesos = op['data']['pago_monto'] if op['data']['pago_moneda'] == 'MXN' else ""
-                            usdt = op['data']['pago_monto'] if op['data']['pago_moneda'] == 'USDT' else ""
-                            data_to_save_batch.append([current_folio, timestamp, selected_client_name, "Pago", pesos, usdt, "N/A", link])
-                        elif op['type'] == 'Recibo':
-                            uploader_key = f"uploader_recibo_{op['index']}_{st.session_state.upload_key_iter}"
-                            if uploader_key in st.session_state and st.session_state[uploader_key]:
-                                link = upload_to_dropbox(dbx_client, st.session_state[uploader_key], selected_client_name)
-                            pesos = op['data']['recibo_monto'] if op['data']['recibo_moneda'] == 'MXN' else ""
-                            usdt = op['data']['recibo_monto'] if op['data']['recibo_moneda'] == 'USDT' else ""
-                            data_to_save_batch.append([current_folio, timestamp, selected_client_name, "Recibo", pesos, usdt, "N/A", link])
-                    
-                    try:
-                        progress_bar.progress((total_ops + 1) / (total_ops + 2), text="Guardando en Google Sheets...")
-                        sheet = gsheet_client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_TAB_NAME)
-                        sheet.append_rows(data_to_save_batch, value_input_option='USER_ENTERED')
-                        
-                        progress_bar.progress(1.0, text="Actualizando saldo del cliente...")
-                        update_success = update_client_balance(gsheet_client, SPREADSHEET_ID, selected_client_name, balance_final_usdt, balance_final_pesos)
-                        
-                        progress_bar.empty()
-                        if update_success:
-                            st.success(f"✅ ¡Éxito! Se guardaron las operaciones y se actualizó el saldo.")
+                status_texto = "BALANCE CERO"
+                status_color = "gray"
+            _, col_balance, _ = st.columns([1, 1.2, 1])
+            with col_balance:
+                st.metric(label="BALANCE FINAL USDT", value=f"{abs(balance_final_usdt):,.2f} USDT")
+                st.markdown(f"<h3 style='text-align: center; color: {status_color};'>{status_texto}</h3>", unsafe_allow_html=True)
+            st.markdown("---")
+
+        with timings.section("guardar"):
+            st.header("5. Registrar Operaciones")
+            col_save, col_clear_all = st.columns([3,1])
+            with col_save:
+                if st.button("💾 Guardar y Actualizar Saldo", use_container_width=True, type="primary"):
+                    operations = service.build_batch(quote)
+                    if not selected_client_name:
+                        st.error("Por favor, seleccione un cliente antes de guardar.")
+                    elif not operations:
+                        st.warning("No hay operaciones con montos mayores a cero para guardar.")
+                    else:
+                        receipts = {}
+                        if not bulk_mode:
+                            uploader_prefix = {'Compra': 'uploader_vende', 'Venta': 'uploader_compra', 'Pago': 'uploader_pago', 'Recibo': 'uploader_recibo'}
+                            for op in operations:
+                                uploaded = st.session_state.get(f"{uploader_prefix[op['type']]}_{op['index']}_{st.session_state.upload_key_iter}")
+                                if uploaded:
+                                    receipts[(op['type'], op['index'])] = uploaded
+                        dbx_client = None
+                        if receipts:
+                            # Dropbox solo se conecta cuando el guardado trae comprobantes
+                            dbx_client = connect_to_dropbox(manual_dbx_token)
+                            service.receipt_worker.set_dropbox_client(dbx_client)
+                        progress_bar = st.progress(0, text="Iniciando guardado...")
+                        try:
+                            result = service.commit(selected_client_name, quote, operations, receipts=receipts, dbx_client=dbx_client,
+                                                    deferred_uploads=deferred_uploads, compress_options=compress_options if compress_receipts else None,
+                                                    on_progress=progress_bar.progress)
+                        except Exception as e:
+                            progress_bar.empty()
+                            st.error(f"❌ {e}")
                         else:
-                            st.success(f"✅ ¡Éxito! Se guardaron las operaciones.")
-                        st.balloons()
-                    except Exception as e:
-                        progress_bar.empty()
-                        st.error(f"❌ Error al guardar: {e}")
-    with col_clear_all:
-        st.button("🔄 Limpiar Todo", use_container_width=True, on_click=limpiar_todo_callback)
+                            progress_bar.empty()
+                            captions, warnings = [], []
+                            if result["bytes_in"]:
+                                bytes_in, bytes_out = result["bytes_in"], result["bytes_out"]
+                                captions.append(f"Comprobantes: {bytes_in / 1e6:,.2f} MB → {bytes_out / 1e6:,.2f} MB (ahorro de {(bytes_in - bytes_out) / bytes_in:.0%})")
+                            if result["dropbox_calls"]:
+                                captions.append("Llamadas a Dropbox en este guardado: " + ", ".join(f"{name}={n}" for name, n in sorted(result["dropbox_calls"].items())))
+                            if result["balance_final_usdt"] != quote.balance_final_usdt:
+                                warnings.append(f"El saldo del cliente cambió mientras se cotizaba (otro registro); "
+                                                f"se guardó un balance final de {result['balance_final_usdt']:,.2f} USDT.")
+                            for folio, e in result["upload_errors"].items():
+                                warnings.append(f"No se pudo subir el archivo de {folio} a Dropbox; quedó en cola para reintentarse: {e}")
+                            if not result["online"] or service.replicator.last_error:
+                                message = "✅ Guardado sin conexión: las operaciones y el saldo quedaron registrados localmente y se enviarán a Google Sheets en cuanto vuelva la conexión."
+                            else:
+                                message = "✅ ¡Éxito! Se guardaron las operaciones y se actualizó el saldo."
+                            # El saldo del cliente es argumento del fragmento: se corre la página completa
+                            # para que el siguiente guardado parta del saldo nuevo.
+                            st.session_state.save_notice = {"message": message, "captions": captions, "warnings": warnings}
+                            st.rerun()
+            with col_clear_all:
+                if st.button("🔄 Limpiar Todo", use_container_width=True, on_click=limpiar_todo_callback):
+                    # Limpia también el cliente, que vive fuera del fragmento
+                    st.rerun()
+
+        if notice:
+            for warning in notice["warnings"]:
+                st.warning(warning)
+            for caption in notice["captions"]:
+                st.caption(caption)
+            st.success(notice["message"])
+            st.balloons()
+        with st.expander("⏱️ Tiempos de render por sección"):
+            st.table(timings.summary())
+
+def main():
+    st.set_page_config(page_title="Calculadora y Registro", page_icon="🏦", layout="wide")
+    timings = get_render_timings()
+    with timings.section("página completa"), tracer.trace("rerun"):
+        # Sheets se conecta y lee tasas y clientes en segundo plano mientras se dibuja el esqueleto
+        loads = start_initial_loads()
+        st.markdown("""
+        <style>
+            [data-testid="stFileUploader"] section [data-testid="stFileUploaderDropzone"] {display: none;}
+            [data-testid="stFileUploader"] section {padding: 0;border: none;}
+            [data-testid="stFileUploader"] {padding-top: 28px;}
+        </style>
+        """, unsafe_allow_html=True)
+
+        # --- ESQUELETO: TÍTULO Y SECCIÓN 1 CON MARCADORES MIENTRAS CARGAN LOS DATOS ---
+        with timings.section("esqueleto"):
+            st.sidebar.header("Configuración")
+            manual_dbx_token = st.sidebar.text_input("Dropbox Access Token (Opcional)", type="password", help="Pega aquí tu token si hay errores de conexión")
+            sidebar_status = st.sidebar.empty()
+            sidebar_status.caption("⏳ Conectando con Google Sheets...")
+
+            st.markdown("<h1 style='text-align: center;'>Calculadora y Registro de Operaciones 🏦</h1>", unsafe_allow_html=True)
+            st.markdown("---")
+
+            if 'num_rows' not in st.session_state: st.session_state.num_rows = 1
+            if 'num_ajustes' not in st.session_state: st.session_state.num_ajustes = 1
+            if 'upload_key_iter' not in st.session_state: st.session_state.upload_key_iter = 0
+
+            st.header("1. Configuración de Operación")
+            col_cliente, col_compra, col_venta = st.columns(3)
+            with col_cliente:
+                st.subheader("Cliente y Balance")
+                client_slot = st.empty()
+                client_slot.caption("⏳ Cargando clientes...")
+            with col_compra:
+                st.subheader("Configuración de Compra")
+                compra_slot = st.empty()
+                compra_slot.caption("⏳ Cargando tasas...")
+            with col_venta:
+                st.subheader("Configuración de Venta")
+                venta_slot = st.empty()
+                venta_slot.caption("⏳ Cargando tasas...")
+        # Desde que Streamlit empezó a correr el script (en frío incluye las importaciones)
+        timings.record("primer dibujo", time.perf_counter() - SCRIPT_STARTED)
+
+        # --- BARRA LATERAL: CONEXIONES, OPCIONES Y ESTADO ---
+        with timings.section("espera de la conexión a Sheets"):
+            sheets, service, SPREADSHEET_ID = loads["servicio"].result()
+        with timings.section("barra lateral"):
+            from cola_comprobantes import pending_count
+            from comprobantes import RECEIPT_FORMATS, RECEIPT_MAX_DIMENSION, RECEIPT_QUALITY
+            from espejo_local import failed_entries, pending_replication_count, retry_failed_entries
+            from peticiones import sheets_stats
+            sidebar_status.empty()
+            receipt_worker = service.receipt_worker
+            deferred_uploads = st.sidebar.toggle("Subir comprobantes en segundo plano", help="Guarda de inmediato con un link provisional; los comprobantes se suben después y el link se completa solo.")
+            with st.sidebar.expander("Compresión de comprobantes"):
+                compress_receipts = st.toggle("Comprimir antes de subir", value=True, help="Reduce la imagen, la recodifica y le quita los datos EXIF.")
+                compress_options = {
+                    "max_dimension": st.number_input("Lado máximo (px)", min_value=400, max_value=6000, value=RECEIPT_MAX_DIMENSION, step=100),
+                    "quality": st.slider("Calidad", min_value=30, max_value=95, value=RECEIPT_QUALITY),
+                    "image_format": st.selectbox("Formato", list(RECEIPT_FORMATS)),
+                }
+            replicator = service.replicator
+            por_replicar = pending_replication_count()
+            if por_replicar:
+                st.sidebar.caption(f"🔄 Cambios pendientes de enviar a Google Sheets: {por_replicar}")
+            if replicator.last_error:
+                st.sidebar.caption(f"⚠️ Último error al sincronizar con Google Sheets: {replicator.last_error}")
+            fallidos = failed_entries()
+            if fallidos:
+                with st.sidebar.expander(f"❌ Envíos a Google Sheets detenidos: {len(fallidos)}"):
+                    st.caption("Su cliente no aparece en la hoja 'Clientes' (¿se renombró o se borró?). "
+                               "Las operaciones siguen registradas localmente; corrige la hoja y reintenta.")
+                    st.dataframe(fallidos, hide_index=True)
+                    if st.button("Reintentar envíos detenidos"):
+                        retry_failed_entries()
+                        replicator.wake()
+            pendientes = pending_count()
+            if pendientes:
+                # Hay comprobantes en cola: el hilo de fondo necesita Dropbox para subirlos
+                receipt_worker.set_dropbox_client(connect_to_dropbox(manual_dbx_token))
+                st.sidebar.caption(f"📤 Comprobantes pendientes de subir: {pendientes}")
+            if receipt_worker.last_error:
+                st.sidebar.caption(f"⚠️ Último error de la cola: {receipt_worker.last_error}")
+            if (por_replicar or pendientes) and st.sidebar.button("🔄 Sincronizar ahora", help="Reintenta de inmediato el envío de lo guardado sin conexión."):
+                replicator.wake()
+                receipt_worker.wake()
+
+            with st.sidebar.expander("Cuota de Google Sheets"):
+                for kind, (used, quota) in sheets_stats.last_minute().items():
+                    st.progress(min(used / quota, 1.0), text=f"{kind.capitalize()}s: {used}/{quota} en el último minuto")
+                counts, throttled_seconds = sheets_stats.snapshot()
+                st.caption(f"429 recibidos: {counts.get('error_429', 0)} · reintentos: {counts.get('reintentos', 0)} · "
+                           f"fallidas: {counts.get('fallidas', 0)} · espera por límite: {throttled_seconds:,.1f} s")
+            if st.sidebar.toggle("Vista de administrador (latencias)", key="admin_latencias"):
+                render_latency_panel(replicator)
+
+        # --- SECCIÓN 1: CLIENTE, TASAS Y MODOS (entradas de todo lo demás) ---
+        with client_slot.container(), timings.section("cliente y saldo"):
+            client_directory = get_client_data(service.client_cache, loads["clientes"])
+            balance_inicial_usdt, balance_inicial_pesos, selected_client_name = 0.0, 0.0, ""
+            if client_directory["options"]:
+                selected_client_name = st.selectbox("Cliente", client_directory["options"], index=None, placeholder="-- Seleccione un Cliente --", key="cliente_selector")
+                if selected_client_name in client_directory["by_alias"]:
+                    # Saldo vigente según la base local: incluye lotes que registró api.py y que
+                    # el directorio de este proceso aún no ve
+                    balance_inicial_usdt, balance_inicial_pesos = service.client_balance(selected_client_name)
+                    metric_col1, metric_col2 = st.columns(2)
+                    with metric_col1: st.metric("Saldo USDT", f"{balance_inicial_usdt:,.2f}")
+                    with metric_col2: st.metric("Saldo Pesos", f"${balance_inicial_pesos:,.2f}")
+                    st.caption("Positivo = cliente te debe. Negativo = tú le debes.")
+            else:
+                st.warning("No se pudieron cargar los clientes.")
+        with timings.section("tasas y modos"):
+            # Cargar tasas iniciales
+            try:
+                initial_tasa_compra, initial_tasa_venta = loads["tasas"].result()
+            except Exception as e:
+                st.error(f"❌ No se pudieron leer las tasas de la hoja 'Tasas' ({e}). Captúralas manualmente.")
+                initial_tasa_compra = initial_tasa_venta = None
+            with compra_slot.container():
+                precio_compra_casa = st.number_input("Tasa de Compra", value=initial_tasa_compra, format="%.4f", key="precio_compra_input")
+                mode_vende = st.radio("Modo para 'Cliente Vende / Yo Compro'", (MODE_PESOS_TO_USDT, MODE_USDT_TO_PESOS), horizontal=True, key="mode_vende")
+            with venta_slot.container():
+                precio_venta_casa = st.number_input("Tasa de Venta", value=initial_tasa_venta, format="%.4f", key="precio_venta_input")
+                mode_compra = st.radio("Modo para 'Cliente Compra / Yo Vendo'", (MODE_PESOS_TO_USDT, MODE_USDT_TO_PESOS), horizontal=True, key="mode_compra")
+        if not precio_compra_casa or not precio_venta_casa:
+            st.warning("Captura la tasa de compra y la de venta para continuar.")
+            st.stop()
+        st.markdown("---")
+
+        # --- SECCIONES 2 A 5: FRAGMENTO QUE SOLO DEPENDE DE LAS ENTRADAS DE ARRIBA ---
+        operations_section(service, manual_dbx_token, deferred_uploads, compress_receipts, compress_options,
+                           selected_client_name, balance_inicial_usdt, balance_inicial_pesos,
+                           precio_compra_casa, precio_venta_casa, mode_vende, mode_compra)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,266 @@
+"""Acceso a la hoja 'Clientes': directorio indexado, mapa de columnas cacheado y escritura de saldos en lote."""
+import hashlib
+import re
+import threading
+import time
+from collections import namedtuple
+
+from gspread.utils import ValueRenderOption, rowcol_to_a1
+
+from dinero import from_micro, to_micro
+
+CLIENT_SHEET_NAME = "Clientes"
+CLIENT_DIRECTORY_MAX_AGE = 60
+ALIAS_COLUMN = 2
+
+_layouts = {}
+_lock = threading.Lock()
+
+ClientEntry = namedtuple("ClientEntry", "row usdt mxn")
+_AMOUNT_NOISE = re.compile(r'[$,]')
+
+def parse_amount(value):
+    """
+    Convierte un saldo de la hoja ('$1,234.50', '', 12) a float redondeado a micro-unidades
+    (así no se arrastra el ruido de saldos viejos); lo no numérico cuenta como 0.
+    """
+    try:
+        return from_micro(to_micro(float(_AMOUNT_NOISE.sub('', str(value)))))
+    except ValueError:
+        return 0.0
+
+def normalize_alias(value):
+    """Alias tal como lo usa la app: la celda de la hoja sin espacios alrededor."""
+    return str(value).strip()
+
+def empty_client_directory():
+    """Directorio sin clientes, con la misma forma que el de ClientDirectoryCache."""
+    return {"by_alias": {}, "options": []}
+
+def _column_range(col):
+    """Rango A1 de una columna completa a partir de la fila 2 (p. ej. 'C2:C')."""
+    letter = rowcol_to_a1(1, col)[:-1]
+    return f"{letter}2:{letter}"
+
+def _header_columns(values):
+    """{nombre: columna} a partir de la fila de encabezados devuelta por batch_get."""
+    return {name: col for col, name in enumerate(values[0] if values else [], start=1)}
+
+def _read_client_columns(worksheet, headers):
+    ranges = ["1:1", _column_range(ALIAS_COLUMN), _column_range(headers["Saldo USDT"]), _column_range(headers["Saldo MXN"])]
+    current, *columns = worksheet.batch_get(ranges, value_render_option=ValueRenderOption.unformatted)
+    return _header_columns(current), columns
+
+def fetch_client_columns(worksheet):
+    """
+    Lee en una sola llamada solo las columnas de alias, saldo USDT y saldo MXN, sin formato
+    (números como números), en vez de la pestaña completa. La misma llamada trae los
+    encabezados: si ya no son los del mapa cacheado (alguien movió columnas), se recarga
+    el mapa y se vuelven a leer las columnas.
+    """
+    headers = get_client_layout(worksheet)["headers"]
+    current, columns = _read_client_columns(worksheet, headers)
+    if current != headers:
+        _, columns = _read_client_columns(worksheet, load_client_layout(worksheet)["headers"])
+    return columns
+
+def _cell(values, index):
+    """Valor de la celda `index` de una columna devuelta por batch_get ('' si está vacía)."""
+    if index < len(values) and values[index]:
+        return values[index][0]
+    return ""
+
+class ClientDirectoryCache:
+    """
+    Directorio de clientes compartido por todas las sesiones, sincronizado de forma incremental.
+
+    Forma: {"by_alias": {alias: ClientEntry(fila, saldo USDT, saldo MXN)}, "options": [alias ordenados]}.
+
+    Al pasar `max_age` segundos primero se consulta la versión de la hoja (`get_version`,
+    p. ej. el modifiedTime de Drive); si no cambió no se descarga nada. Si cambió, se leen
+    solo las columnas de alias y saldos (`fetch_columns`), se comparan con la última copia
+    por checksum y fila por fila, y solo se vuelven a interpretar las filas distintas. La
+    lista de opciones se conserva tal cual si los alias no cambiaron.
+
+    Después de guardar, `patch_balance` actualiza la entrada del cliente en memoria
+    (write-through) y toma la nueva versión, para que la escritura propia no cuente como cambio.
+
+    Opcionales: `overrides()` devuelve saldos {alias: (usdt, mxn)} que aún no llegan a la
+    hoja y se aplican encima de cada sincronización; `on_sync(directorio)` recibe cada
+    directorio sincronizado; `fallback()` da un directorio si la primera carga falla.
+    """
+    def __init__(self, fetch_columns, get_version, max_age=CLIENT_DIRECTORY_MAX_AGE,
+                 overrides=None, on_sync=None, fallback=None):
+        self.fetch_columns = fetch_columns
+        self.get_version = get_version
+        self.max_age = max_age
+        self.overrides = overrides
+        self.on_sync = on_sync
+        self.fallback = fallback
+        self.directory = None
+        self.version = None
+        self.checksum = None
+        self.checked_at = 0.0
+        self.last_sync = {"rows": 0, "changed": 0, "fetched": False}
+        self.last_error = None
+        self._raw_rows = {}
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        """Versión de la hoja, o None si no se puede consultar (siempre se sincroniza)."""
+        try:
+            return self.get_version()
+        except Exception:
+            return None
+
+    def _sync(self):
+        aliases, usdt, mxn = self.fetch_columns()
+        checksum = hashlib.sha1(repr((aliases, usdt, mxn)).encode()).hexdigest()
+        self.last_sync = {"rows": len(aliases), "changed": 0, "fetched": True}
+        if checksum == self.checksum:
+            return
+        previous = self.directory or empty_client_directory()
+        previous_entries = {entry.row: (alias, entry) for alias, entry in previous["by_alias"].items()}
+        raw_rows, by_alias, changed = {}, {}, 0
+        for i in range(max(len(aliases), len(usdt), len(mxn))):
+            row = i + 2
+            raw = (normalize_alias(_cell(aliases, i)), _cell(usdt, i), _cell(mxn, i))
+            raw_rows[row] = raw
+            if not raw[0]:
+                continue
+            if self._raw_rows.get(row) == raw and row in previous_entries:
+                alias, entry = previous_entries[row]
+            else:
+                alias, entry = raw[0], ClientEntry(row, parse_amount(raw[1]), parse_amount(raw[2]))
+                changed += 1
+            by_alias[alias] = entry
+        options = previous["options"]
+        if by_alias.keys() != previous["by_alias"].keys():
+            options = sorted(by_alias, key=str.casefold)
+        self.directory = {"by_alias": by_alias, "options": options}
+        self._raw_rows = raw_rows
+        self.checksum = checksum
+        self.last_sync["changed"] = changed
+        if self.on_sync:
+            self.on_sync(self.directory)
+        if self.overrides:
+            for alias, (usdt, mxn) in self.overrides().items():
+                if alias in by_alias:
+                    by_alias[alias] = by_alias[alias]._replace(usdt=float(usdt), mxn=float(mxn))
+
+    def get(self):
+        """
+        Devuelve el directorio, sincronizándolo si ya venció. Si la sincronización falla se
+        sigue usando la última copia (o la de `fallback`) y el error queda en `last_error`;
+        solo se lanza la excepción si no hay ninguna copia que mostrar.
+        """
+        with self._lock:
+            if self.directory is not None and time.monotonic() - self.checked_at < self.max_age:
+                return self.directory
+            version = self._current_version()
+            try:
+                if self.directory is None or version is None or version != self.version:
+                    self._sync()
+                else:
+                    self.last_sync = {"rows": len(self._raw_rows), "changed": 0, "fetched": False}
+                self.version = version
+                self.last_error = None
+            except Exception as e:
+                if self.directory is None and self.fallback:
+                    self.directory = self.fallback()
+                if self.directory is None or not self.directory["by_alias"]:
+                    self.directory = None
+                    raise
+                self.last_error = e
+            self.checked_at = time.monotonic()
+            return self.directory
+
+    def patch_balance(self, client_alias, new_usdt, new_mxn, refresh_version=True):
+        """
+        Refleja en memoria un saldo nuevo. Con `refresh_version` (tras escribir en la hoja)
+        también toma la versión actual para no recargar por la escritura propia.
+        """
+        self.patch_balances({client_alias: (new_usdt, new_mxn)}, refresh_version)
+
+    def patch_balances(self, balances, refresh_version=True):
+        """Como patch_balance para varios saldos {alias: (usdt, mxn)}, con una sola consulta de versión."""
+        with self._lock:
+            if self.directory is None:
+                return
+            for client_alias, (new_usdt, new_mxn) in balances.items():
+                entry = self.directory["by_alias"].get(client_alias)
+                if entry is not None:
+                    self.directory["by_alias"][client_alias] = entry._replace(usdt=float(new_usdt), mxn=float(new_mxn))
+            if refresh_version:
+                self.version = self._current_version()
+
+def load_client_layout(worksheet):
+    """
+    Lee en una sola llamada los encabezados y la columna de alias: {"headers": {nombre: col},
+    "rows": {alias: fila}}, con los alias normalizados igual que en el directorio.
+    """
+    headers, aliases = worksheet.batch_get(["1:1", _column_range(ALIAS_COLUMN)])
+    layout = {
+        "headers": _header_columns(headers),
+        "rows": {normalize_alias(row[0]): i for i, row in enumerate(aliases, start=2) if row},
+    }
+    with _lock:
+        _layouts[worksheet.spreadsheet_id] = layout
+    return layout
+
+def get_client_layout(worksheet):
+    """
+    Devuelve el mapa cacheado de la hoja, leyéndolo solo si aún no existe. Quien lo usa
+    confirma los encabezados en su propia lectura (ver fetch_client_columns y
+    write_client_balances) y lo recarga si cambiaron.
+    """
+    with _lock:
+        layout = _layouts.get(worksheet.spreadsheet_id)
+    return layout or load_client_layout(worksheet)
+
+def _verified_rows(worksheet, layout, aliases):
+    """
+    Filas de `aliases` según el mapa, solo las que la celda de alias de esa fila todavía
+    confirma. Todas se verifican con una sola lectura, que también trae los encabezados:
+    si ya no son los del mapa devuelve None.
+    """
+    rows = {alias: layout["rows"][alias] for alias in aliases if alias in layout["rows"]}
+    if not rows:
+        return {}
+    headers, *cells = worksheet.batch_get(["1:1"] + [rowcol_to_a1(row, ALIAS_COLUMN) for row in rows.values()])
+    if _header_columns(headers) != layout["headers"]:
+        return None
+    return {alias: row for (alias, row), cell in zip(rows.items(), cells) if cell and cell[0] and normalize_alias(cell[0][0]) == alias}
+
+def write_client_balances(worksheet, balances):
+    """
+    Escribe los saldos {alias: (usdt, mxn)} de varios clientes con una lectura de
+    verificación y una sola escritura.
+
+    Las filas y columnas salen del mapa cacheado; antes de escribir se leen los encabezados
+    y solo las celdas de alias de esas filas para confirmar que nadie movió columnas ni
+    reordenó la hoja. Si algo no coincide se recarga el mapa una vez. Devuelve la lista de
+    clientes que no existen (no se escriben).
+    """
+    layout = get_client_layout(worksheet)
+    rows = _verified_rows(worksheet, layout, balances)
+    if rows is None or len(rows) < len(balances):
+        layout = load_client_layout(worksheet)
+        rows = _verified_rows(worksheet, layout, balances) or {}
+    missing = [alias for alias in balances if alias not in rows]
+    if not rows:
+        return missing
+
+    usdt_col = layout["headers"]["Saldo USDT"]
+    mxn_col = layout["headers"]["Saldo MXN"]
+    updates = []
+    for alias, row in rows.items():
+        new_usdt, new_mxn = balances[alias]
+        updates.append({"range": rowcol_to_a1(row, mxn_col), "values": [[new_mxn]]})
+        updates.append({"range": rowcol_to_a1(row, usdt_col), "values": [[new_usdt]]})
+    worksheet.batch_update(updates, value_input_option='USER_ENTERED')
+    return missing
+
+def write_client_balance(worksheet, client_alias, new_usdt, new_mxn):
+    """Escribe los saldos de un cliente (ver write_client_balances). Devuelve False si el cliente no existe."""
+    return not write_client_balances(worksheet, {client_alias: (new_usdt, new_mxn)})
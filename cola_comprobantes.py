@@ -0,0 +1,154 @@
+"""
+Cola persistente de comprobantes para subirlos a Dropbox en segundo plano.
+
+Los bytes se guardan en SQLite local antes de escribir el registro, así que las subidas
+pendientes sobreviven a un reinicio de Streamlit. Un hilo por proceso las sube y rellena
+la columna de link en la hoja de operaciones; la fila de cada folio sale del espejo local
+(espejo_local.py) una vez que la operación se replicó a la hoja.
+"""
+import threading
+import time
+from datetime import datetime
+
+from comprobantes import ReceiptFile, upload_or_reuse
+from espejo_local import connect_mirror, update_links
+from trazas import tracer
+
+PENDING_LINK = "Pendiente de subir"
+LINK_COLUMN = "H"
+STALE_CLAIM_SECONDS = 600
+WORKER_INTERVAL_SECONDS = 5
+MAX_ATTEMPTS = 10
+
+def _connect(db_path=None):
+    conn = connect_mirror(db_path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS comprobantes_pendientes (
+        folio TEXT PRIMARY KEY,
+        cliente TEXT NOT NULL,
+        nombre TEXT NOT NULL,
+        contenido BLOB NOT NULL,
+        intentos INTEGER NOT NULL DEFAULT 0,
+        reclamado_en REAL,
+        ultimo_error TEXT,
+        creado_en TEXT NOT NULL)""")
+    return conn
+
+def enqueue_receipts(receipts, client_name, db_path=None):
+    """
+    Guarda en la cola los comprobantes {folio: archivo} de un guardado. Los bytes se pasan a
+    SQLite desde el buffer de cada archivo, sin copiarlos.
+    """
+    if not receipts:
+        return
+    created = datetime.now().isoformat(timespec="seconds")
+    buffers = {folio: f.getbuffer() for folio, f in receipts.items()}
+    conn = _connect(db_path)
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO comprobantes_pendientes (folio, cliente, nombre, contenido, creado_en) VALUES (?, ?, ?, ?, ?)",
+            [(folio, client_name, receipts[folio].name, buffer, created) for folio, buffer in buffers.items()],
+        )
+    finally:
+        conn.close()
+        for buffer in buffers.values():
+            buffer.release()
+
+def discard_receipts(folios, db_path=None):
+    """Quita de la cola los comprobantes de un guardado que no se pudo registrar."""
+    conn = _connect(db_path)
+    try:
+        conn.executemany("DELETE FROM comprobantes_pendientes WHERE folio = ?", [(f,) for f in folios])
+    finally:
+        conn.close()
+
+def pending_count(db_path=None):
+    conn = _connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM comprobantes_pendientes").fetchone()[0]
+    finally:
+        conn.close()
+
+def _claim_batch(conn, limit):
+    """
+    Reclama hasta `limit` comprobantes libres (o abandonados por otro proceso) cuya operación
+    ya está en la hoja. Los antiguos cuyo folio no está en el espejo se buscan por folio.
+    """
+    now = time.time()
+    stale_before = datetime.fromtimestamp(now - STALE_CLAIM_SECONDS).isoformat(timespec="seconds")
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute(
+        "SELECT c.folio, c.cliente, c.nombre, c.contenido, o.fila FROM comprobantes_pendientes c "
+        "LEFT JOIN operaciones o ON o.folio = c.folio "
+        "WHERE (o.fila IS NOT NULL OR (o.folio IS NULL AND c.creado_en < ?)) AND (c.reclamado_en IS NULL OR c.reclamado_en < ?) AND c.intentos < ? "
+        "ORDER BY c.folio LIMIT ?",
+        (stale_before, now - STALE_CLAIM_SECONDS, MAX_ATTEMPTS, limit)).fetchall()
+    conn.executemany("UPDATE comprobantes_pendientes SET reclamado_en = ? WHERE folio = ?", [(now, r[0]) for r in rows])
+    conn.execute("COMMIT")
+    return rows
+
+def process_pending(dbx_client, ledger_sheet, limit=20, db_path=None):
+    """
+    Sube un lote de comprobantes pendientes y rellena sus links en una sola escritura.
+    Devuelve cuántos se completaron.
+    """
+    conn = _connect(db_path)
+    try:
+        rows = _claim_batch(conn, limit)
+        done, updates, links = [], [], {}
+        for folio, client_name, name, content, row in rows:
+            try:
+                link = upload_or_reuse(dbx_client, ReceiptFile(name, content), client_name, db_path=db_path)
+                if row is None:
+                    with tracer.span("sheets_buscar_folio"):
+                        cell = ledger_sheet.find(folio, in_column=1)
+                    if cell is None:
+                        raise LookupError(f"El folio {folio} no está en la hoja")
+                    row = cell.row
+                updates.append({"range": f"{LINK_COLUMN}{row}", "values": [[link]]})
+                links[folio] = link
+                done.append(folio)
+            except Exception as e:
+                conn.execute("UPDATE comprobantes_pendientes SET intentos = intentos + 1, reclamado_en = NULL, ultimo_error = ? WHERE folio = ?",
+                             (str(e), folio))
+        if updates:
+            with tracer.span("sheets_links"):
+                ledger_sheet.batch_update(updates, value_input_option='USER_ENTERED')
+            update_links(links, db_path)
+            conn.executemany("DELETE FROM comprobantes_pendientes WHERE folio = ?", [(f,) for f in done])
+        return len(done)
+    finally:
+        conn.close()
+
+class ReceiptUploadWorker:
+    """Hilo de fondo (uno por proceso) que vacía la cola de comprobantes."""
+    def __init__(self, get_ledger_sheet, interval=WORKER_INTERVAL_SECONDS, db_path=None):
+        self.get_ledger_sheet = get_ledger_sheet
+        self.interval = interval
+        self.db_path = db_path
+        self.dbx_client = None
+        self.last_error = None
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="receipt-upload-worker", daemon=True)
+        self._thread.start()
+
+    def set_dropbox_client(self, dbx_client):
+        """Usa el cliente de Dropbox más reciente que tenga la app (p. ej. un token manual)."""
+        if dbx_client is not None:
+            self.dbx_client = dbx_client
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self.dbx_client is None:
+                continue
+            try:
+                with tracer.trace("cola_comprobantes", keep_empty=False):
+                    while process_pending(self.dbx_client, self.get_ledger_sheet(), db_path=self.db_path):
+                        pass
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
@@ -0,0 +1,277 @@
+"""
+Preparación (compresión y deduplicación) y subida de comprobantes a Dropbox.
+
+El SDK de Dropbox (y requests) se importa en la primera subida y no al importar el módulo:
+tarda más que el resto de la app en cargar y la mayoría de las visitas no suben nada.
+"""
+import contextvars
+import hashlib
+import io
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pytz
+from cachetools import LRUCache
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from almacen_local import connect_local_db
+from trazas import note_retry, tracer
+
+MAX_UPLOAD_WORKERS = 4
+LINK_CACHE_SIZE = 1024
+RECEIPT_MAX_DIMENSION = 1600
+RECEIPT_QUALITY = 80
+RECEIPT_FORMATS = {"JPEG": ".jpg", "WEBP": ".webp"}
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_MAX_RETRIES = 3
+
+_link_cache = LRUCache(maxsize=LINK_CACHE_SIZE)
+_lock = threading.Lock()
+
+class ReceiptFile(io.BytesIO):
+    """Comprobante en memoria con la misma interfaz que un UploadedFile (name/read/getvalue)."""
+    def __init__(self, name, content):
+        super().__init__(content)
+        self.name = name
+
+def _file_size(file_object):
+    """Tamaño del archivo sin copiar su contenido."""
+    file_object.seek(0, io.SEEK_END)
+    size = file_object.tell()
+    file_object.seek(0)
+    return size
+
+def compress_receipt(file_object, max_dimension=RECEIPT_MAX_DIMENSION, quality=RECEIPT_QUALITY, image_format="JPEG"):
+    """
+    Reduce la imagen a `max_dimension` px en su lado mayor y la recodifica sin EXIF.
+    Si el archivo no es una imagen, o es un PNG que ya pesaba menos, se deja igual.
+    """
+    original_size = _file_size(file_object)
+    try:
+        with Image.open(file_object) as image:
+            source_format = image.format
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            output = io.BytesIO()
+            image.save(output, format=image_format, quality=quality, optimize=True)
+    except (UnidentifiedImageError, OSError):
+        return file_object
+    finally:
+        file_object.seek(0)
+    if source_format == "PNG" and output.tell() >= original_size:
+        return file_object
+    stem = file_object.name.rsplit(".", 1)[0]
+    return ReceiptFile(stem + RECEIPT_FORMATS[image_format], output.getvalue())
+
+def prepare_receipts(receipts, **compress_options):
+    """
+    Comprime los comprobantes {folio: archivo} de un guardado.
+    Devuelve (comprobantes preparados, bytes originales, bytes finales).
+    """
+    prepared, bytes_in, bytes_out = {}, 0, 0
+    for folio, file_object in receipts.items():
+        prepared[folio] = compress_receipt(file_object, **compress_options)
+        bytes_in += _file_size(file_object)
+        bytes_out += _file_size(prepared[folio])
+    return prepared, bytes_in, bytes_out
+
+def _connect_hash_store(db_path=None):
+    conn = connect_local_db(db_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS links_por_hash (sha256 TEXT PRIMARY KEY, link TEXT NOT NULL)")
+    return conn
+
+def _lookup_link(digest, db_path=None):
+    conn = _connect_hash_store(db_path)
+    try:
+        row = conn.execute("SELECT link FROM links_por_hash WHERE sha256 = ?", (digest,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def _remember_link(digest, link, db_path=None):
+    conn = _connect_hash_store(db_path)
+    try:
+        conn.execute("INSERT OR REPLACE INTO links_por_hash (sha256, link) VALUES (?, ?)", (digest, link))
+    finally:
+        conn.close()
+
+def _count(calls, name):
+    """Suma una llamada a la API de Dropbox al contador del guardado (si hay)."""
+    if calls is not None:
+        with _lock:
+            calls[name] += 1
+
+def get_shared_link(dbx_client, dropbox_path, calls=None):
+    """
+    Devuelve el link compartido de `dropbox_path`. Lo crea directamente y solo consulta
+    los links existentes si Dropbox responde que ya había uno. Se cachea por proceso.
+    """
+    import dropbox
+    with _lock:
+        url = _link_cache.get(dropbox_path)
+    if url:
+        return url
+    with tracer.span("dropbox_link"):
+        try:
+            _count(calls, "sharing_create_shared_link_with_settings")
+            url = dbx_client.sharing_create_shared_link_with_settings(dropbox_path).url
+        except dropbox.exceptions.ApiError as err:
+            error = err.error
+            if not (isinstance(error, dropbox.sharing.CreateSharedLinkWithSettingsError) and error.is_shared_link_already_exists()):
+                raise
+            existing = error.get_shared_link_already_exists()
+            if existing is not None and existing.is_metadata():
+                url = existing.get_metadata().url
+            else:
+                _count(calls, "sharing_list_shared_links")
+                links = dbx_client.sharing_list_shared_links(path=dropbox_path, direct_only=True).links
+                if not links: raise
+                url = links[0].url
+    with _lock:
+        _link_cache[dropbox_path] = url
+    return url
+
+def _retryable_errors():
+    """Errores transitorios de red o de Dropbox que vale la pena reintentar."""
+    import dropbox
+    import requests
+    return (dropbox.exceptions.InternalServerError, dropbox.exceptions.RateLimitError,
+            requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+def _with_retries(call, before_retry=None):
+    """Ejecuta `call` reintentando los errores transitorios de red o de Dropbox."""
+    retryable = _retryable_errors()
+    for attempt in range(UPLOAD_MAX_RETRIES + 1):
+        try:
+            return call()
+        except retryable as err:
+            if attempt == UPLOAD_MAX_RETRIES:
+                raise
+            time.sleep(getattr(err, "backoff", None) or 2 ** attempt)
+            note_retry()
+            if before_retry:
+                before_retry()
+
+def _correct_offset(err):
+    """Offset que Dropbox espera si rechazó un bloque por offset incorrecto; None en otro caso."""
+    import dropbox
+    error = err.error
+    if isinstance(error, dropbox.files.UploadSessionFinishError):
+        if not error.is_lookup_failed():
+            return None
+        error = error.get_lookup_failed()
+    if isinstance(error, dropbox.files.UploadSessionLookupError) and error.is_incorrect_offset():
+        return error.get_incorrect_offset().correct_offset
+    return None
+
+def _upload_in_chunks(dbx_client, file_object, size, dropbox_path, calls=None):
+    """
+    Sube un archivo grande por bloques con una sesión de subida de Dropbox, leyendo del
+    buffer del archivo bloque por bloque. Un bloque que falla por un error transitorio se
+    reenvía; si Dropbox indica otro offset, se continúa desde ahí. Devuelve los metadatos
+    del archivo (la ruta puede cambiar si ya existía uno con el mismo nombre).
+    """
+    import dropbox
+    file_object.seek(0)
+    _count(calls, "files_upload_session_start")
+    session = _with_retries(lambda: dbx_client.files_upload_session_start(file_object.read(UPLOAD_CHUNK_SIZE)),
+                            lambda: file_object.seek(0))
+    cursor = dropbox.files.UploadSessionCursor(session_id=session.session_id, offset=file_object.tell())
+    commit = dropbox.files.CommitInfo(path=dropbox_path, mode=dropbox.files.WriteMode('add'), autorename=True)
+    while True:
+        file_object.seek(cursor.offset)
+        chunk = file_object.read(UPLOAD_CHUNK_SIZE)
+        last = cursor.offset + len(chunk) >= size
+        try:
+            if last:
+                _count(calls, "files_upload_session_finish")
+                return _with_retries(lambda: dbx_client.files_upload_session_finish(chunk, cursor, commit))
+            _count(calls, "files_upload_session_append_v2")
+            _with_retries(lambda: dbx_client.files_upload_session_append_v2(chunk, cursor))
+            cursor.offset += len(chunk)
+        except dropbox.exceptions.ApiError as err:
+            offset = _correct_offset(err)
+            if offset is None or offset == cursor.offset:
+                raise
+            cursor.offset = offset
+
+def _sha256(file_object):
+    with file_object.getbuffer() as buffer:
+        return hashlib.sha256(buffer).hexdigest()
+
+def upload_to_dropbox(dbx_client, file_object, client_name, calls=None, digest=None):
+    """
+    Sube un archivo a Dropbox y devuelve el link para compartir. Lanza excepción si falla.
+
+    La ruta lleva el inicio del SHA-256 del contenido (`digest`, se calcula si no se da):
+    los comprobantes de un mismo guardado se suben en paralelo y suelen llamarse igual
+    (image.jpg). Nunca se sobrescribe: si la ruta ya existe Dropbox le cambia el nombre.
+    """
+    if dbx_client is None:
+        return "Error: Token de Dropbox no configurado"
+    import dropbox
+
+    mexico_tz = pytz.timezone("America/Mexico_City")
+    timestamp = datetime.now(mexico_tz).strftime("%Y%m%d_%H%M%S")
+    digest = digest or _sha256(file_object)
+    dropbox_path = f"/{client_name.replace(' ', '_')}/{timestamp}_{digest[:8]}_{file_object.name}"
+
+    size = _file_size(file_object)
+    with tracer.span("dropbox_subida", nbytes=size):
+        if size <= UPLOAD_CHUNK_SIZE:
+            _count(calls, "files_upload")
+            metadata = _with_retries(lambda: dbx_client.files_upload(file_object.read(), dropbox_path,
+                                                                     mode=dropbox.files.WriteMode('add'), autorename=True),
+                                     lambda: file_object.seek(0))
+        else:
+            metadata = _upload_in_chunks(dbx_client, file_object, size, dropbox_path, calls)
+    link = get_shared_link(dbx_client, metadata.path_display, calls)
+    return link.replace("?dl=0", "?raw=1")
+
+def upload_or_reuse(dbx_client, file_object, client_name, calls=None, db_path=None):
+    """
+    Sube el comprobante salvo que ya se haya subido uno idéntico (mismo SHA-256),
+    en cuyo caso devuelve el link existente.
+    """
+    if dbx_client is None:
+        return "Error: Token de Dropbox no configurado"
+    digest = _sha256(file_object)
+    link = _lookup_link(digest, db_path)
+    if link:
+        _count(calls, "reutilizados")
+        return link
+    link = upload_to_dropbox(dbx_client, file_object, client_name, calls, digest)
+    _remember_link(digest, link, db_path)
+    return link
+
+def upload_receipts(dbx_client, receipts, client_name, on_progress=None, max_workers=MAX_UPLOAD_WORKERS, db_path=None):
+    """
+    Sube varios comprobantes en paralelo con un pool de hilos acotado.
+
+    `receipts` es un dict {folio: archivo}. Devuelve (links, errores, llamadas): links y errores
+    son dicts por folio (un folio con error no detiene a los demás) y llamadas es un Counter
+    con las llamadas a la API de Dropbox que hizo este guardado. `on_progress(folio, terminados, total)` se
+    llama desde el hilo que invoca esta función cada vez que termina una subida, así que
+    puede actualizar widgets de Streamlit.
+    """
+    links, errors, calls = {}, {}, Counter()
+    if not receipts:
+        return links, errors, calls
+    with tracer.span("dropbox_comprobantes"), ThreadPoolExecutor(max_workers=min(max_workers, len(receipts))) as pool:
+        # Cada subida corre en una copia del contexto para que sus tramos caigan en la traza del guardado
+        futures = {pool.submit(contextvars.copy_context().run, upload_or_reuse, dbx_client, file_object, client_name, calls, db_path): folio
+                   for folio, file_object in receipts.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            folio = futures[future]
+            try:
+                links[folio] = future.result()
+            except Exception as e:
+                errors[folio] = e
+            if on_progress:
+                on_progress(folio, done, len(receipts))
+    return links, errors, calls
@@ -0,0 +1,73 @@
+"""
+Motor de cotización vectorizado (NumPy), independiente de Streamlit.
+
+Recibe arreglos de montos, modos y tasas de todas las filas y devuelve en una sola pasada
+los resultados por fila y los totales. Todo se calcula en micro-unidades enteras (ver
+dinero.py) y cada conversión se redondea una sola vez, half-up, como Decimal.quantize con
+ROUND_HALF_UP: pesos a centavos y USDT a 6 decimales.
+"""
+import numpy as np
+
+from dinero import MICRO, from_micro, mul_div, quantize, to_micro
+
+MODE_PESOS_TO_USDT = "Pesos -> USDT"
+MODE_USDT_TO_PESOS = "USDT -> Pesos"
+PESOS_DECIMALS = 2
+USDT_DECIMALS = 6
+
+ROW_FIELDS = ("pesos_pagar", "usdt_recibir", "pesos_cobrar", "usdt_entregar")
+
+def _convert(amounts, modes, rates):
+    """(pesos, usdt) de cada fila en micro-unidades: el monto capturado es pesos o USDT según el modo."""
+    amounts = np.atleast_1d(to_micro(amounts))
+    rates = np.broadcast_to(to_micro(rates), amounts.shape)
+    from_pesos = np.broadcast_to(np.asarray(modes) == MODE_PESOS_TO_USDT, amounts.shape)
+    pesos_step = 10 ** (6 - PESOS_DECIMALS)
+    pesos = np.where(from_pesos, quantize(amounts, PESOS_DECIMALS), mul_div(amounts, rates, MICRO * pesos_step) * pesos_step)
+    usdt = np.where(from_pesos, mul_div(amounts, MICRO, rates), quantize(amounts, USDT_DECIMALS))
+    return pesos, usdt
+
+def quote_rows(amounts_vende, amounts_compra, mode_vende, mode_compra, precio_compra, precio_venta):
+    """
+    Cotiza todas las filas de compra/venta. Los modos y tasas pueden ser un valor para todas
+    las filas o un arreglo por fila. Devuelve {campo: arreglo int64 en micro-unidades} con
+    los campos de ROW_FIELDS.
+    """
+    pesos_pagar, usdt_recibir = _convert(amounts_vende, mode_vende, precio_compra)
+    pesos_cobrar, usdt_entregar = _convert(amounts_compra, mode_compra, precio_venta)
+    return {"pesos_pagar": pesos_pagar, "usdt_recibir": usdt_recibir,
+            "pesos_cobrar": pesos_cobrar, "usdt_entregar": usdt_entregar}
+
+def net_adjustments(pago_montos, pago_monedas, recibo_montos, recibo_monedas):
+    """Ajuste neto (pesos, usdt) en micro-unidades: los pagos suman (aumentan la deuda) y los recibos restan."""
+    pagos = np.atleast_1d(to_micro(pago_montos))
+    recibos = np.atleast_1d(to_micro(recibo_montos))
+    pago_mxn = np.asarray(pago_monedas) == "MXN"
+    recibo_mxn = np.asarray(recibo_monedas) == "MXN"
+    neto_pesos = int(pagos[pago_mxn].sum()) - int(recibos[recibo_mxn].sum())
+    neto_usdt = int(pagos[~pago_mxn].sum()) - int(recibos[~recibo_mxn].sum())
+    return neto_pesos, neto_usdt
+
+def quote_totals(rows, ajuste_neto_pesos, ajuste_neto_usdt, balance_inicial_usdt):
+    """
+    Totales consolidados y balance final en USDT a partir de las filas cotizadas. Los
+    ajustes y el saldo inicial van en micro-unidades, igual que los totales devueltos.
+    """
+    recibir_usdt = int(rows["usdt_recibir"].sum())
+    entregar_usdt = int(rows["usdt_entregar"].sum())
+    return {
+        "pagar_pesos": int(rows["pesos_pagar"].sum()),
+        "recibir_usdt": recibir_usdt,
+        "cobrar_pesos": int(rows["pesos_cobrar"].sum()),
+        "entregar_usdt": entregar_usdt,
+        "ajuste_neto_pesos": ajuste_neto_pesos,
+        "ajuste_neto_usdt": ajuste_neto_usdt,
+        "recibidos_usdt": recibir_usdt + max(balance_inicial_usdt, 0) + max(ajuste_neto_usdt, 0),
+        "entregados_usdt": entregar_usdt + max(-balance_inicial_usdt, 0) + max(-ajuste_neto_usdt, 0),
+        "balance_final_usdt": (recibir_usdt + balance_inicial_usdt + ajuste_neto_usdt) - entregar_usdt,
+    }
+
+def row_records(rows):
+    """Las filas cotizadas como lista de dicts (una por fila) con floats de Python, listos para guardar."""
+    columns = [from_micro(rows[field]).tolist() for field in ROW_FIELDS]
+    return [dict(zip(ROW_FIELDS, values)) for values in zip(*columns)]
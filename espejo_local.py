@@ -0,0 +1,519 @@
+"""
+Espejo local (SQLite) del registro de operaciones y de los saldos de clientes.
+
+El guardado escribe aquí primero, en una sola transacción: las filas en el espejo y una
+entrada en el diario (lote completo + saldo que se quiere dejar al cliente). Un hilo por
+proceso reproduce el diario en Google Sheets de forma idempotente por folio. Así la app
+sigue registrando operaciones aunque Sheets esté caído o limitando la cuota, y las
+lecturas (folios, saldos, reportes) no dependen de la red.
+
+El hilo junta los guardados de todas las sesiones: después de cada aviso espera una
+ventana corta (REPLICATION_FLUSH_WINDOW_SECONDS) y envía todo lo pendiente con un solo
+append_rows y una sola escritura de saldos. Quien guarda puede esperar el Future de su
+entrada (SheetsReplicator.track), que se resuelve con los folios cuando llegan a la hoja.
+
+Estados de una entrada del diario:
+    pendiente   -> aún no se intenta enviar
+    enviando    -> se llamó a append_rows pero no se confirmó (puede o no estar en la hoja)
+    registrado  -> las filas ya están en la hoja; falta el saldo
+    enviado     -> completa (las entradas nunca se borran)
+    fallido     -> su cliente no apareció en la hoja de clientes en JOURNAL_MAX_ATTEMPTS
+                   intentos seguidos; ya no se reintenta sola (ver retry_failed_entries)
+"""
+import json
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+
+import numpy as np
+
+from gspread.utils import a1_range_to_grid_range
+
+from almacen_local import connect_local_db
+from clientes import ClientEntry, empty_client_directory, write_client_balances
+from dinero import from_micro, to_micro
+from trazas import tracer
+
+LEDGER_COLUMNS = ("folio", "fecha", "cliente", "tipo", "pesos", "usdt", "tasa", "link")
+REPLICATION_INTERVAL_SECONDS = 5
+REPLICATION_FLUSH_WINDOW_SECONDS = 0.2
+FLUSH_STATS_WINDOW = 200
+LEDGER_TAIL_INTERVAL_SECONDS = 60
+REPLICATION_LEASE_SECONDS = 300
+JOURNAL_MAX_ATTEMPTS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operaciones (
+    folio TEXT PRIMARY KEY,
+    fecha TEXT NOT NULL,
+    cliente TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    pesos,
+    usdt,
+    tasa,
+    link TEXT,
+    fila INTEGER);
+CREATE INDEX IF NOT EXISTS operaciones_fecha ON operaciones (fecha);
+CREATE INDEX IF NOT EXISTS operaciones_cliente ON operaciones (cliente, fecha);
+CREATE TABLE IF NOT EXISTS clientes (
+    alias TEXT PRIMARY KEY,
+    fila INTEGER,
+    saldo_usdt REAL NOT NULL,
+    saldo_mxn REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS diario (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    folios TEXT NOT NULL,
+    filas TEXT NOT NULL,
+    cliente TEXT NOT NULL,
+    saldo_usdt REAL NOT NULL,
+    saldo_mxn REAL NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    ultimo_error TEXT,
+    creado_en TEXT NOT NULL,
+    enviado_en TEXT);
+CREATE INDEX IF NOT EXISTS diario_estado ON diario (estado, id);
+CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+# Resultado de una reproducción del diario: entradas completadas, filas agregadas con
+# append_rows, clientes cuyo saldo se escribió y clientes que no están en la hoja
+ReplayResult = namedtuple("ReplayResult", "entries rows clients missing")
+
+# Guardado registrado por record_batch: id de la entrada del diario y saldo que quedó
+RecordedBatch = namedtuple("RecordedBatch", "entry_id usdt mxn")
+
+def connect_mirror(db_path=None):
+    conn = connect_local_db(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def _current_balance(conn, client_alias):
+    row = conn.execute("SELECT saldo_usdt, saldo_mxn FROM diario WHERE cliente = ? AND estado != 'enviado' "
+                       "ORDER BY id DESC LIMIT 1", (client_alias,)).fetchone()
+    if row is None:
+        row = conn.execute("SELECT saldo_usdt, saldo_mxn FROM clientes WHERE alias = ?", (client_alias,)).fetchone()
+    return tuple(row) if row else None
+
+def record_batch(rows, client_alias, new_usdt, new_mxn, usdt_change=None, db_path=None):
+    """
+    Registra un guardado en cuanto tiene sus folios, antes de subir comprobantes o de
+    escribir en Sheets: las filas del registro (en el orden de LEDGER_COLUMNS) en el
+    espejo, el nuevo saldo del cliente y la entrada del diario con el lote completo, todo
+    en una transacción.
+
+    Con `usdt_change` (micro-unidades) el saldo USDT se calcula dentro de esa transacción:
+    el vigente en la base (ver local_balance) más el cambio, así dos guardados del mismo
+    cliente a la vez (sesiones, o la app y api.py) no se pisan; `new_usdt` solo se usa si
+    el cliente aún no está en la base. Devuelve un RecordedBatch.
+    """
+    created = datetime.now().isoformat(timespec="seconds")
+    conn = connect_mirror(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if usdt_change is not None:
+                current = _current_balance(conn, client_alias)
+                if current is not None:
+                    new_usdt = from_micro(to_micro(current[0]) + usdt_change)
+            conn.executemany(f"INSERT INTO operaciones ({', '.join(LEDGER_COLUMNS)}) VALUES ({', '.join('?' * len(LEDGER_COLUMNS))})", rows)
+            conn.execute("INSERT INTO clientes (alias, saldo_usdt, saldo_mxn) VALUES (?, ?, ?) "
+                         "ON CONFLICT(alias) DO UPDATE SET saldo_usdt = excluded.saldo_usdt, saldo_mxn = excluded.saldo_mxn",
+                         (client_alias, new_usdt, new_mxn))
+            entry_id = conn.execute("INSERT INTO diario (folios, filas, cliente, saldo_usdt, saldo_mxn, creado_en) VALUES (?, ?, ?, ?, ?, ?)",
+                                    (json.dumps([row[0] for row in rows]), json.dumps(rows), client_alias, new_usdt, new_mxn, created)).lastrowid
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return RecordedBatch(entry_id, new_usdt, new_mxn)
+    finally:
+        conn.close()
+
+def pending_replication_count(db_path=None):
+    """Entradas del diario que aún no terminan de llegar a Sheets (sin contar las fallidas)."""
+    conn = connect_mirror(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM diario WHERE estado NOT IN ('enviado', 'fallido')").fetchone()[0]
+    finally:
+        conn.close()
+
+def failed_entries(db_path=None):
+    """Entradas del diario que dejaron de reintentarse ('fallido'), para mostrarlas: lista de dicts."""
+    conn = connect_mirror(db_path)
+    try:
+        rows = conn.execute("SELECT id, cliente, folios, intentos, ultimo_error, creado_en FROM diario "
+                            "WHERE estado = 'fallido' ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    return [{"entrada": entry_id, "cliente": alias, "folios": ", ".join(json.loads(folios)), "intentos": attempts,
+             "error": error or "", "creado": created} for entry_id, alias, folios, attempts, error, created in rows]
+
+def retry_failed_entries(db_path=None):
+    """Vuelve a poner en la fila de envío las entradas fallidas (p. ej. tras corregir el alias en la hoja). Devuelve cuántas."""
+    conn = connect_mirror(db_path)
+    try:
+        return conn.execute("UPDATE diario SET estado = 'registrado', intentos = 0 WHERE estado = 'fallido'").rowcount
+    finally:
+        conn.close()
+
+def pending_balances(db_path=None):
+    """Saldos guardados localmente que aún no llegan a la hoja: {alias: (usdt, mxn)}."""
+    conn = connect_mirror(db_path)
+    try:
+        rows = conn.execute("SELECT cliente, saldo_usdt, saldo_mxn FROM diario WHERE estado != 'enviado' ORDER BY id").fetchall()
+        return {alias: (usdt, mxn) for alias, usdt, mxn in rows}
+    finally:
+        conn.close()
+
+def local_balance(client_alias, db_path=None):
+    """
+    Saldo (usdt, mxn) más reciente del cliente en la base local, que comparten todos los
+    procesos del servidor (la app y api.py): el de su último guardado que aún no llega a la
+    hoja o, si no hay, el del espejo (último guardado o última sincronización con la hoja).
+    None si el cliente no está en la base.
+    """
+    conn = connect_mirror(db_path)
+    try:
+        return _current_balance(conn, client_alias)
+    finally:
+        conn.close()
+
+def store_client_directory(directory, db_path=None):
+    """Guarda en el espejo el directorio de clientes recién sincronizado desde la hoja."""
+    conn = connect_mirror(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT INTO clientes (alias, fila, saldo_usdt, saldo_mxn) VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT(alias) DO UPDATE SET fila = excluded.fila, saldo_usdt = excluded.saldo_usdt, saldo_mxn = excluded.saldo_mxn",
+                         [(alias, e.row, e.usdt, e.mxn) for alias, e in directory["by_alias"].items()])
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+def load_client_directory(db_path=None):
+    """Directorio de clientes leído del espejo (para cuando Sheets no responde)."""
+    conn = connect_mirror(db_path)
+    try:
+        rows = conn.execute("SELECT alias, fila, saldo_usdt, saldo_mxn FROM clientes WHERE fila IS NOT NULL").fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return empty_client_directory()
+    by_alias = {alias: ClientEntry(row, usdt, mxn) for alias, row, usdt, mxn in rows}
+    return {"by_alias": by_alias, "options": sorted(by_alias, key=str.casefold)}
+
+def update_links(links, db_path=None):
+    """Actualiza en el espejo los links de comprobantes {folio: link}."""
+    conn = connect_mirror(db_path)
+    try:
+        conn.executemany("UPDATE operaciones SET link = ? WHERE folio = ?", [(link, folio) for folio, link in links.items()])
+    finally:
+        conn.close()
+
+def fill_pending_links(entry_id, links, db_path=None):
+    """
+    Pone en el espejo los links {folio: link} de comprobantes subidos después de registrar
+    el lote y, si la entrada `entry_id` del diario sigue pendiente, también en sus filas,
+    para que lleguen a la hoja en el mismo append. Devuelve los folios que ya no alcanzaron
+    a entrar en el diario (la entrada ya iba hacia Sheets): esos los completa la cola de
+    comprobantes.
+    """
+    conn = connect_mirror(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            filas, state = conn.execute("SELECT filas, estado FROM diario WHERE id = ?", (entry_id,)).fetchone()
+            late = list(links)
+            if state == 'pendiente':
+                rows = json.loads(filas)
+                for row in rows:
+                    row[7] = links.get(row[0], row[7])
+                conn.execute("UPDATE diario SET filas = ? WHERE id = ?", (json.dumps(rows), entry_id))
+                late = []
+            conn.executemany("UPDATE operaciones SET link = ? WHERE folio = ?", [(link, folio) for folio, link in links.items()])
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return late
+    finally:
+        conn.close()
+
+def _first_appended_row(append_response):
+    updated_range = append_response["updates"]["updatedRange"]
+    return a1_range_to_grid_range(updated_range.split("!")[-1])["startRowIndex"] + 1
+
+def _set_state(conn, entry_ids, state):
+    # `intentos` cuenta los fallos seguidos del paso en curso: se reinicia al avanzar
+    sent_at = datetime.now().isoformat(timespec="seconds") if state == 'enviado' else None
+    conn.executemany("UPDATE diario SET estado = ?, enviado_en = ?, ultimo_error = NULL, intentos = 0 WHERE id = ?",
+                     [(state, sent_at, entry_id) for entry_id in entry_ids])
+
+def _mark_failed(conn, entry_ids, error):
+    conn.executemany("UPDATE diario SET intentos = intentos + 1, ultimo_error = ? WHERE id = ?",
+                     [(str(error), entry_id) for entry_id in entry_ids])
+
+def _folios_in_sheet(conn, ledger_sheet, folios):
+    """
+    Cuáles de `folios` ya están en la hoja, con su fila. Primero se usa la fila que ya
+    conozca el espejo (p. ej. por import_ledger_tail); para el resto solo se lee la columna
+    de folios desde la última fila importada, que es donde puede haber quedado un envío
+    sin confirmar.
+    """
+    placeholders = ", ".join("?" * len(folios))
+    found = dict(conn.execute(f"SELECT folio, fila FROM operaciones WHERE fila IS NOT NULL AND folio IN ({placeholders})",
+                              folios).fetchall())
+    wanted = set(folios) - set(found)
+    if wanted:
+        row = conn.execute("SELECT valor FROM meta WHERE clave = 'ultima_fila_registro'").fetchone()
+        first_row = int(row[0]) + 1 if row else 2
+        with tracer.span("sheets_verificar_folios"):
+            values = ledger_sheet.get(f"A{first_row}:A")
+        found.update({v[0]: first_row + i for i, v in enumerate(values) if v and v[0] in wanted})
+    return found
+
+def replay_journal(ledger_sheet, client_sheet, on_balances_written=None, db_path=None):
+    """
+    Reproduce en Sheets las entradas pendientes del diario. Es idempotente por folio: las
+    filas de entradas que quedaron 'enviando' se buscan antes en la hoja y no se vuelven a
+    agregar. Todas las filas nuevas van en un solo append_rows; después se escribe el último
+    saldo de cada cliente, todos en una sola escritura, y se avisa a
+    `on_balances_written({alias: (usdt, mxn)})`. Devuelve un ReplayResult; las entradas que
+    fallan siguen pendientes (con su error) para el siguiente ciclo, salvo las de un cliente
+    que no aparece en la hoja JOURNAL_MAX_ATTEMPTS veces seguidas, que pasan a 'fallido'.
+    """
+    conn = connect_mirror(db_path)
+    try:
+        entries = conn.execute("SELECT id, folios, filas, cliente, saldo_usdt, saldo_mxn, estado FROM diario "
+                               "WHERE estado NOT IN ('enviado', 'fallido') ORDER BY id").fetchall()
+        to_append = [e for e in entries if e[6] in ('pendiente', 'enviando')]
+        new_rows = []
+        if to_append:
+            ids = [e[0] for e in to_append]
+            uncertain = [f for e in to_append if e[6] == 'enviando' for f in json.loads(e[1])]
+            try:
+                rows_by_folio = _folios_in_sheet(conn, ledger_sheet, uncertain) if uncertain else {}
+                new_rows = [row for e in to_append for row in json.loads(e[2]) if row[0] not in rows_by_folio]
+                if new_rows:
+                    conn.execute("BEGIN IMMEDIATE")
+                    _set_state(conn, ids, 'enviando')
+                    # Se releen con el candado: un guardado pudo completar sus links (fill_pending_links)
+                    placeholders = ", ".join("?" * len(ids))
+                    filas = dict(conn.execute(f"SELECT id, filas FROM diario WHERE id IN ({placeholders})", ids).fetchall())
+                    new_rows = [row for entry_id in ids for row in json.loads(filas[entry_id]) if row[0] not in rows_by_folio]
+                    conn.execute("COMMIT")
+                    with tracer.span("sheets_append_rows"):
+                        response = ledger_sheet.append_rows(new_rows, value_input_option='USER_ENTERED')
+                    first_row = _first_appended_row(response)
+                    rows_by_folio.update({row[0]: first_row + i for i, row in enumerate(new_rows)})
+            except Exception as e:
+                # Sin las filas del registro no se escriben saldos: todo se reintenta después
+                _mark_failed(conn, [entry[0] for entry in entries], e)
+                raise
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE operaciones SET fila = ? WHERE folio = ?", [(r, f) for f, r in rows_by_folio.items()])
+            _set_state(conn, ids, 'registrado')
+            conn.execute("COMMIT")
+        if not entries:
+            return ReplayResult(0, 0, 0, [])
+
+        # Solo el último saldo de cada cliente
+        ids_by_alias, balances = {}, {}
+        for entry_id, _, _, alias, usdt, mxn, _ in entries:
+            ids_by_alias.setdefault(alias, []).append(entry_id)
+            balances[alias] = (usdt, mxn)
+        try:
+            with tracer.span("sheets_saldos_clientes"):
+                missing = write_client_balances(client_sheet, balances)
+        except Exception as e:
+            _mark_failed(conn, [entry[0] for entry in entries], e)
+            raise
+        for alias in missing:
+            _mark_failed(conn, ids_by_alias[alias], LookupError(f"No se encontró al cliente '{alias}' en la hoja"))
+        if missing:
+            # Un cliente renombrado o borrado no se arregla solo: se deja de releer la hoja por él
+            missing_ids = [entry_id for alias in missing for entry_id in ids_by_alias[alias]]
+            conn.execute(f"UPDATE diario SET estado = 'fallido' WHERE intentos >= ? AND id IN ({', '.join('?' * len(missing_ids))})",
+                         [JOURNAL_MAX_ATTEMPTS] + missing_ids)
+        written = {alias: balance for alias, balance in balances.items() if alias not in missing}
+        _set_state(conn, [entry_id for alias in written for entry_id in ids_by_alias[alias]], 'enviado')
+        if on_balances_written and written:
+            on_balances_written(written)
+        return ReplayResult(sum(len(ids_by_alias[alias]) for alias in written), len(new_rows), len(written), missing)
+    finally:
+        conn.close()
+
+def finished_entries(entry_ids, db_path=None):
+    """
+    De `entry_ids`, las entradas del diario que ya terminaron: {id: (estado, [folios], error)},
+    con estado 'enviado' (completas en Sheets) o 'fallido'.
+    """
+    conn = connect_mirror(db_path)
+    try:
+        placeholders = ", ".join("?" * len(entry_ids))
+        rows = conn.execute(f"SELECT id, estado, folios, ultimo_error FROM diario WHERE estado IN ('enviado', 'fallido') "
+                            f"AND id IN ({placeholders})", list(entry_ids)).fetchall()
+        return {entry_id: (state, json.loads(folios), error) for entry_id, state, folios, error in rows}
+    finally:
+        conn.close()
+
+def acquire_replication_lease(owner, ttl=REPLICATION_LEASE_SECONDS, db_path=None):
+    """
+    Toma (o renueva) por `ttl` segundos el turno de replicar. Varios procesos pueden compartir
+    la base local (la app y api.py), pero solo uno debe reproducir el diario: dos a la vez
+    agregarían las mismas filas. Si el dueño muere, otro toma el turno al vencer el plazo.
+    """
+    conn = connect_mirror(db_path)
+    try:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT valor FROM meta WHERE clave = 'turno_replicacion'").fetchone()
+        holder, expires_at = json.loads(row[0]) if row else (None, 0)
+        if holder != owner and expires_at > now:
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('turno_replicacion', ?)",
+                     (json.dumps([owner, now + ttl]),))
+        conn.execute("COMMIT")
+        return True
+    finally:
+        conn.close()
+
+def import_ledger_tail(ledger_sheet, db_path=None):
+    """
+    Trae al espejo las filas del registro que aún no ha visto (las escritas por otros
+    servidores o antes de existir el espejo), leyendo solo desde la última fila importada.
+    """
+    conn = connect_mirror(db_path)
+    try:
+        row = conn.execute("SELECT valor FROM meta WHERE clave = 'ultima_fila_registro'").fetchone()
+        last_row = int(row[0]) if row else 1
+        with tracer.span("sheets_leer_registro"):
+            values = ledger_sheet.get(f"A{last_row + 1}:H")
+        rows = [(list(v) + [""] * len(LEDGER_COLUMNS))[:len(LEDGER_COLUMNS)] + [last_row + 1 + i]
+                for i, v in enumerate(values) if v and v[0]]
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            f"INSERT INTO operaciones ({', '.join(LEDGER_COLUMNS)}, fila) VALUES ({', '.join('?' * (len(LEDGER_COLUMNS) + 1))}) "
+            "ON CONFLICT(folio) DO UPDATE SET fila = excluded.fila, link = excluded.link", rows)
+        conn.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('ultima_fila_registro', ?)", (str(last_row + len(values)),))
+        conn.execute("COMMIT")
+        return len(rows)
+    finally:
+        conn.close()
+
+class SheetsReplicator:
+    """
+    Hilo de fondo (uno por proceso) que reproduce el diario local en Google Sheets. Si
+    varios procesos comparten la base, replica el que tenga el turno (acquire_replication_lease).
+
+    Después de cada `wake()` espera `flush_window` segundos para juntar en un solo envío los
+    guardados de todas las sesiones. `flushes` guarda los últimos envíos (ver flush_summary).
+    """
+    def __init__(self, get_ledger_sheet, get_client_sheet, on_balances_written=None,
+                 interval=REPLICATION_INTERVAL_SECONDS, flush_window=REPLICATION_FLUSH_WINDOW_SECONDS, db_path=None):
+        self.get_ledger_sheet = get_ledger_sheet
+        self.get_client_sheet = get_client_sheet
+        self.on_balances_written = on_balances_written
+        self.interval = interval
+        self.flush_window = flush_window
+        self.db_path = db_path
+        self.last_error = None
+        self.flushes = deque(maxlen=FLUSH_STATS_WINDOW)
+        self._owner = uuid.uuid4().hex
+        self._tail_checked_at = 0.0
+        self._woken_at = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheets-replicator", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        with self._lock:
+            if self._woken_at is None:
+                self._woken_at = time.monotonic()
+        self._wake.set()
+
+    def track(self, entry_id):
+        """
+        Future que se resuelve con los folios de la entrada `entry_id` cuando llegan completos
+        a Sheets, o con un RuntimeError si la entrada pasa a 'fallido'.
+        """
+        future = Future()
+        with self._lock:
+            self._futures.setdefault(entry_id, []).append(future)
+        return future
+
+    def _resolve_futures(self):
+        # Se revisa el diario y no solo lo que envió este hilo: la entrada pudo enviarla otro proceso
+        with self._lock:
+            entry_ids = list(self._futures)
+        if not entry_ids:
+            return
+        finished = finished_entries(entry_ids, db_path=self.db_path)
+        with self._lock:
+            futures = [(f, finished[entry_id]) for entry_id in finished for f in self._futures.pop(entry_id, [])]
+        for future, (state, folios, error) in futures:
+            if state == 'enviado':
+                future.set_result(folios)
+            else:
+                future.set_exception(RuntimeError(f"No se pudieron enviar a Sheets los folios {', '.join(folios)}: {error}"))
+
+    def _replicate(self):
+        with self._lock:
+            woken_at, self._woken_at = self._woken_at, None
+        started = time.monotonic()
+        try:
+            result = replay_journal(self.get_ledger_sheet(), self.get_client_sheet(), self.on_balances_written, db_path=self.db_path)
+        except Exception:
+            # La latencia del reintento se sigue midiendo desde el primer aviso
+            with self._lock:
+                self._woken_at = min(t for t in (woken_at, self._woken_at, started) if t is not None)
+            raise
+        if result.entries:
+            finished = time.monotonic()
+            self.flushes.append({"entries": result.entries, "rows": result.rows, "clients": result.clients,
+                                 "latency": finished - (woken_at or started), "duration": finished - started})
+        return result
+
+    def flush_summary(self):
+        """Resumen de los últimos envíos: tamaño promedio del lote y latencia desde el aviso hasta la hoja."""
+        flushes = list(self.flushes)
+        if not flushes:
+            return {}
+        latency = np.array([f["latency"] for f in flushes]) * 1000
+        return {
+            "envíos": len(flushes),
+            "entradas por envío": round(float(np.mean([f["entries"] for f in flushes])), 1),
+            "filas por envío": round(float(np.mean([f["rows"] for f in flushes])), 1),
+            "clientes por envío": round(float(np.mean([f["clients"] for f in flushes])), 1),
+            "latencia p50 (ms)": round(float(np.percentile(latency, 50)), 1),
+            "latencia p95 (ms)": round(float(np.percentile(latency, 95)), 1),
+            "duración prom. (ms)": round(float(np.mean([f["duration"] for f in flushes])) * 1000, 1),
+        }
+
+    def _run(self):
+        while True:
+            try:
+                missing = []
+                # Si otro proceso tiene el turno de replicar, este ciclo no envía nada
+                if acquire_replication_lease(self._owner, db_path=self.db_path):
+                    with tracer.trace("replicación", keep_empty=False):
+                        missing = self._replicate().missing
+                        if time.monotonic() - self._tail_checked_at > LEDGER_TAIL_INTERVAL_SECONDS:
+                            import_ledger_tail(self.get_ledger_sheet(), db_path=self.db_path)
+                            self._tail_checked_at = time.monotonic()
+                self._resolve_futures()
+                # Los demás clientes sí se enviaron, pero hay que avisar de los que no están en la hoja
+                self.last_error = LookupError(f"Clientes que no están en la hoja 'Clientes': {', '.join(missing)}") if missing else None
+            except Exception as e:
+                self.last_error = e
+            if self._wake.wait(self.interval) and self.flush_window:
+                # Ventana para que los guardados de otras sesiones entren en el mismo envío
+                time.sleep(self.flush_window)
+            self._wake.clear()
@@ -0,0 +1,263 @@
+"""
+Dobles en memoria de gspread y Dropbox para pruebas de carga y benchmarks sin tocar la red.
+Imitan solo la parte de la API que usa la calculadora, cuentan cada llamada y permiten
+simular caídas (`offline`) y respuestas perdidas (`drop_responses`).
+"""
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import gspread
+import requests
+from gspread.cell import Cell
+from gspread.utils import a1_range_to_grid_range
+
+class FakeGSheetClient:
+    """
+    Sustituto de gspread.Client: guarda hojas de cálculo en memoria. Con `offline` cada
+    llamada falla como si no hubiera red; los nombres en `drop_responses` se aplican en
+    la hoja pero la respuesta se pierde (la llamada lanza ConnectionError).
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.offline = False
+        self.drop_responses = set()
+        self._lock = threading.Lock()
+        self.spreadsheets = {}
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.offline:
+            raise requests.exceptions.ConnectionError(f"{name}: sin conexión (simulado)")
+
+    def _respond(self, name, response=None):
+        if name in self.drop_responses:
+            self.drop_responses.discard(name)
+            raise requests.exceptions.ConnectionError(f"{name}: respuesta perdida (simulado)")
+        return response
+
+    def create_spreadsheet(self, spreadsheet_id, tabs):
+        """Crea una hoja de cálculo con pestañas {titulo: filas}."""
+        spreadsheet = FakeSpreadsheet(self, spreadsheet_id)
+        for title, rows in tabs.items():
+            spreadsheet._add(title, rows)
+        self.spreadsheets[spreadsheet_id] = spreadsheet
+        return spreadsheet
+
+    def open_by_key(self, key):
+        self._call("open_by_key")
+        try:
+            return self.spreadsheets[key]
+        except KeyError:
+            raise gspread.exceptions.SpreadsheetNotFound(key)
+
+class FakeSpreadsheet:
+    def __init__(self, client, spreadsheet_id):
+        self.client = client
+        self.id = spreadsheet_id
+        self.revision = 0
+        self._worksheets = {}
+
+    def _add(self, title, rows):
+        worksheet = FakeWorksheet(self, title, rows)
+        self._worksheets[title] = worksheet
+        return worksheet
+
+    def worksheet(self, title):
+        self.client._call("worksheet")
+        try:
+            return self._worksheets[title]
+        except KeyError:
+            raise gspread.exceptions.WorksheetNotFound(title)
+
+    def get_lastUpdateTime(self):
+        self.client._call("get_lastUpdateTime")
+        with self.client._lock:
+            return f"rev-{self.revision}"
+
+    def add_worksheet(self, title, rows, cols):
+        self.client._call("add_worksheet")
+        with self.client._lock:
+            if title in self._worksheets:
+                raise gspread.exceptions.GSpreadException(f"A sheet with the name \"{title}\" already exists.")
+            return self._add(title, [])
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, rows):
+        self.spreadsheet = spreadsheet
+        self.spreadsheet_id = spreadsheet.id
+        self.client = spreadsheet.client
+        self.title = title
+        self.rows = [list(map(str, row)) for row in rows]
+
+    # --- utilidades internas (sin contar llamadas) ---
+    def _bounds(self, range_name):
+        grid = a1_range_to_grid_range(range_name)
+        width = max((len(r) for r in self.rows), default=0)
+        return (grid.get("startRowIndex", 0), grid.get("endRowIndex", len(self.rows)),
+                grid.get("startColumnIndex", 0), grid.get("endColumnIndex", width))
+
+    def _read(self, range_name):
+        r0, r1, c0, c1 = self._bounds(range_name)
+        values = []
+        for row in self.rows[r0:r1]:
+            cells = row[c0:c1]
+            while cells and cells[-1] == "":
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def _write(self, range_name, values):
+        self.spreadsheet.revision += 1
+        r0, _, c0, _ = self._bounds(range_name)
+        for i, row in enumerate(values):
+            while len(self.rows) <= r0 + i:
+                self.rows.append([])
+            target = self.rows[r0 + i]
+            while len(target) < c0 + len(row):
+                target.append("")
+            for j, value in enumerate(row):
+                target[c0 + j] = str(value)
+
+    # --- API imitada de gspread.Worksheet ---
+    def get(self, range_name=None):
+        self.client._call("get")
+        with self.client._lock:
+            return self._read(range_name or "A1:ZZ")
+
+    def batch_get(self, ranges, **kwargs):
+        self.client._call("batch_get")
+        with self.client._lock:
+            return [self._read(r) for r in ranges]
+
+    def get_all_values(self):
+        self.client._call("get_all_values")
+        with self.client._lock:
+            return [list(r) for r in self.rows]
+
+    def get_all_records(self):
+        self.client._call("get_all_records")
+        with self.client._lock:
+            if not self.rows:
+                return []
+            headers = self.rows[0]
+            return [dict(zip(headers, row + [""] * (len(headers) - len(row)))) for row in self.rows[1:]]
+
+    def row_values(self, row):
+        self.client._call("row_values")
+        with self.client._lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col):
+        self.client._call("col_values")
+        with self.client._lock:
+            values = [r[col - 1] if len(r) >= col else "" for r in self.rows]
+            while values and values[-1] == "":
+                values.pop()
+            return values
+
+    def find(self, query, in_column=None):
+        self.client._call("find")
+        with self.client._lock:
+            for i, row in enumerate(self.rows):
+                for j, value in enumerate(row):
+                    if value == query and (in_column is None or in_column == j + 1):
+                        return Cell(i + 1, j + 1, value)
+        return None
+
+    def update(self, values, range_name, **kwargs):
+        self.client._call("update")
+        with self.client._lock:
+            self._write(range_name, values)
+
+    def update_cell(self, row, col, value):
+        self.client._call("update_cell")
+        with self.client._lock:
+            self._write(gspread.utils.rowcol_to_a1(row, col), [[value]])
+
+    def batch_update(self, data, **kwargs):
+        self.client._call("batch_update")
+        with self.client._lock:
+            for item in data:
+                self._write(item["range"], item["values"])
+
+    def append_rows(self, values, **kwargs):
+        self.client._call("append_rows")
+        with self.client._lock:
+            while self.rows and not any(self.rows[-1]):
+                self.rows.pop()
+            start = len(self.rows) + 1
+            self.spreadsheet.revision += 1
+            self.rows.extend([list(map(str, row)) for row in values])
+        return self.client._respond("append_rows", {"updates": {"updatedRange": f"'{self.title}'!A{start}:{gspread.utils.rowcol_to_a1(start + len(values) - 1, 8)}"}})
+
+class FakeDropbox:
+    """
+    Sustituto de dropbox.Dropbox: guarda los archivos en memoria y da un link por ruta.
+    Cada llamada tarda `latency` s y las subidas además su tamaño entre `bytes_per_second`.
+    """
+    def __init__(self, latency=0.0, bytes_per_second=None):
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.calls = Counter()
+        self.offline = False
+        self.files = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name, nbytes=0):
+        with self._lock:
+            self.calls[name] += 1
+        delay = self.latency + (nbytes / self.bytes_per_second if self.bytes_per_second else 0.0)
+        if delay:
+            time.sleep(delay)
+        if self.offline:
+            raise requests.exceptions.ConnectionError(f"{name}: sin conexión (simulado)")
+
+    def _store(self, path, content, autorename):
+        # Como WriteMode('add'): con autorename una ruta ocupada pasa a "nombre (1).ext"
+        if autorename:
+            stem, dot, extension = path.rpartition(".")
+            copy = 0
+            while path in self.files:
+                copy += 1
+                path = f"{stem} ({copy}){dot}{extension}" if dot else f"{extension} ({copy})"
+        self.files[path] = bytes(content)
+        return SimpleNamespace(path_display=path, size=len(content))
+
+    def files_upload(self, content, path, mode=None, autorename=False):
+        self._call("files_upload", len(content))
+        with self._lock:
+            return self._store(path, content, autorename)
+
+    def files_upload_session_start(self, content):
+        self._call("files_upload_session_start", len(content))
+        with self._lock:
+            session_id = f"session-{len(self._sessions) + 1}"
+            self._sessions[session_id] = bytearray(content)
+        return SimpleNamespace(session_id=session_id)
+
+    def files_upload_session_append_v2(self, content, cursor):
+        self._call("files_upload_session_append_v2", len(content))
+        with self._lock:
+            self._sessions[cursor.session_id] += content
+
+    def files_upload_session_finish(self, content, cursor, commit):
+        self._call("files_upload_session_finish", len(content))
+        with self._lock:
+            return self._store(commit.path, self._sessions.pop(cursor.session_id) + content, getattr(commit, "autorename", False))
+
+    def sharing_create_shared_link_with_settings(self, path):
+        self._call("sharing_create_shared_link_with_settings")
+        return SimpleNamespace(url=f"https://dropbox.invalid{path}?dl=0")
+
+    def sharing_list_shared_links(self, path=None, direct_only=False):
+        self._call("sharing_list_shared_links")
+        return SimpleNamespace(links=[SimpleNamespace(url=f"https://dropbox.invalid{path}?dl=0")])
@@ -0,0 +1,130 @@
+"""Reserva atómica de folios diarios (formato YY-MM-DD-NNNN)."""
+import gspread
+
+from espejo_local import connect_mirror
+from hojas import is_unavailable_error
+
+FOLIO_SHEET_NAME = "Folios"
+
+def get_folio_counter_sheet(spreadsheet, sheet_tab_name):
+    """Devuelve la hoja contador de folios. Si no existe, la crea a partir del último folio del registro."""
+    try:
+        return spreadsheet.worksheet(FOLIO_SHEET_NAME)
+    except gspread.exceptions.WorksheetNotFound:
+        pass
+    # Solo la primera vez: se lee la columna de folios para sembrar el contador
+    folios = spreadsheet.worksheet(sheet_tab_name).col_values(1)
+    fecha, ultimo = "", 0
+    if len(folios) >= 2:
+        parts = folios[-1].split('-')
+        fecha, ultimo = f"{parts[0]}-{parts[1]}-{parts[2]}", int(parts[3])
+    counter = spreadsheet.add_worksheet(FOLIO_SHEET_NAME, rows=2, cols=2)
+    counter.update([["Fecha", "Ultimo Folio"], [fecha, ultimo]], "A1:B2")
+    return counter
+
+def read_sheet_counter(counter_sheet, date_str):
+    """Último folio del día registrado en la hoja contador (0 si es de otro día)."""
+    values = counter_sheet.get("A2:B2")
+    if not values or len(values[0]) < 2 or values[0][0] != date_str:
+        return 0
+    return int(values[0][1])
+
+def _read_mirror_counter(conn, date_str):
+    """Último folio del día que ya está en el espejo local (0 si no hay ninguno)."""
+    # El máximo es numérico: como texto "...-999" quedaría por encima de "...-1000"
+    row = conn.execute(
+        "SELECT MAX(CAST(substr(folio, length(?) + 2) AS INTEGER)) FROM operaciones WHERE folio LIKE ?",
+        (date_str, f"{date_str}-%"),
+    ).fetchone()
+    return row[0] or 0
+
+def push_sheet_counter(counter_sheet, date_str, db_path=None):
+    """
+    Escribe en la hoja 'Folios' el último folio del día reservado localmente. Se lee el
+    valor local justo antes de escribir (no el del bloque propio) para que la hoja no
+    retroceda si otra reserva terminó antes; si aun así dos escrituras se cruzan, la
+    siguiente reserva con conexión la pone al día.
+    """
+    conn = connect_mirror(db_path)
+    try:
+        last = conn.execute("SELECT ultimo FROM folios WHERE fecha = ?", (date_str,)).fetchone()[0]
+    finally:
+        conn.close()
+    counter_sheet.update([[date_str, last]], "A2:B2")
+
+def _ensure_folio_table(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS folios (fecha TEXT PRIMARY KEY, ultimo INTEGER NOT NULL)")
+
+def is_day_seeded(date_str, db_path=None):
+    """True si el contador local ya tiene el día `date_str` (no hace falta leer la hoja)."""
+    conn = connect_mirror(db_path)
+    try:
+        _ensure_folio_table(conn)
+        return conn.execute("SELECT 1 FROM folios WHERE fecha = ?", (date_str,)).fetchone() is not None
+    finally:
+        conn.close()
+
+def reserve_local_folios(date_str, count, sheet_last=0, db_path=None):
+    """
+    Reserva en SQLite local un bloque de `count` folios consecutivos para el día `date_str`.
+
+    La secuencia se toma con BEGIN IMMEDIATE, así que dos sesiones (hilos o procesos del
+    mismo servidor) nunca reciben el mismo folio. Si el día aún no tiene contador se siembra
+    con el mayor entre el espejo y `sheet_last` (el último folio leído de la hoja 'Folios').
+    No hace llamadas de red; debe ejecutarse una sola vez por guardado, fuera de cualquier
+    reintento de Sheets.
+    """
+    if count < 1:
+        return []
+    conn = connect_mirror(db_path)
+    try:
+        _ensure_folio_table(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT ultimo FROM folios WHERE fecha = ?", (date_str,)).fetchone()
+            last = row[0] if row else max(_read_mirror_counter(conn, date_str), sheet_last)
+            first, last = last + 1, last + count
+            conn.execute(
+                "INSERT INTO folios (fecha, ultimo) VALUES (?, ?) "
+                "ON CONFLICT(fecha) DO UPDATE SET ultimo = excluded.ultimo",
+                (date_str, last),
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return [f"{date_str}-{num:04d}" for num in range(first, last + 1)]
+
+def reserve_folios(counter_sheet, date_str, count, db_path=None):
+    """
+    Reserva un bloque de `count` folios consecutivos para el día `date_str` (YY-MM-DD).
+
+    Ninguna llamada de red ocurre con el candado tomado: la hoja 'Folios' se lee antes
+    (solo para sembrar el primer folio del día) y se actualiza después de confirmar la
+    reserva local, así que un Sheets lento o con reintentos no bloquea los guardados de
+    las demás sesiones.
+
+    Sin conexión (`counter_sheet` es None o Sheets no responde) la reserva sigue siendo
+    local: la siembra sale del espejo y la hoja se pone al día en la siguiente reserva
+    con conexión, que siempre escribe el último folio.
+    """
+    if count < 1:
+        return []
+    sheet_last = 0
+    if counter_sheet is not None and not is_day_seeded(date_str, db_path):
+        try:
+            sheet_last = read_sheet_counter(counter_sheet, date_str)
+        except Exception as e:
+            if not is_unavailable_error(e):
+                raise
+            counter_sheet = None
+    folios = reserve_local_folios(date_str, count, sheet_last, db_path)
+    if counter_sheet is not None:
+        try:
+            push_sheet_counter(counter_sheet, date_str, db_path)
+        except Exception as e:
+            if not is_unavailable_error(e):
+                raise
+    return folios
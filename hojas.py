@@ -0,0 +1,82 @@
+"""Registro de handles de Spreadsheet/Worksheet reutilizables entre reruns."""
+import threading
+
+import gspread
+from google.auth.exceptions import TransportError
+
+# Errores tras los cuales un handle cacheado ya no es confiable
+INVALIDATING_API_CODES = (401, 403, 404)
+
+# Códigos con los que Sheets está saturado o caído (no es un error de la petición)
+UNAVAILABLE_API_CODES = (429, 500, 502, 503, 504)
+
+def is_unavailable_error(err):
+    """True si el error indica que Google Sheets no está disponible (red, cuota o servidor)."""
+    if isinstance(err, (OSError, TransportError)):
+        return True
+    return isinstance(err, gspread.exceptions.APIError) and err.code in UNAVAILABLE_API_CODES
+
+def is_stale_handle_error(err):
+    """True si el error indica credenciales vencidas o una hoja que ya no existe."""
+    if isinstance(err, (gspread.exceptions.WorksheetNotFound, gspread.exceptions.SpreadsheetNotFound)):
+        return True
+    return isinstance(err, gspread.exceptions.APIError) and err.code in INVALIDATING_API_CODES
+
+class WorksheetRegistry:
+    """
+    Cachea los handles por (spreadsheet_id, pestaña) para no repetir open_by_key() y
+    worksheet(), que son una llamada de metadatos cada una. Es seguro entre hilos.
+    """
+    def __init__(self, gsheet_client):
+        self.gsheet_client = gsheet_client
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    def spreadsheet(self, spreadsheet_id):
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(spreadsheet_id)
+        if spreadsheet is None:
+            spreadsheet = self.gsheet_client.open_by_key(spreadsheet_id)
+            with self._lock:
+                self._spreadsheets[spreadsheet_id] = spreadsheet
+        return spreadsheet
+
+    def worksheet(self, spreadsheet_id, title, create=None):
+        """
+        Devuelve la pestaña `title`. Si no está en caché se abre; `create(spreadsheet)`
+        permite abrirla o crearla con otra lógica (p. ej. la hoja contador de folios).
+        """
+        key = (spreadsheet_id, title)
+        with self._lock:
+            worksheet = self._worksheets.get(key)
+        if worksheet is None:
+            spreadsheet = self.spreadsheet(spreadsheet_id)
+            worksheet = create(spreadsheet) if create else spreadsheet.worksheet(title)
+            with self._lock:
+                self._worksheets[key] = worksheet
+        return worksheet
+
+    def invalidate(self, spreadsheet_id=None):
+        """Olvida los handles de una hoja de cálculo (o todos si no se indica)."""
+        with self._lock:
+            if spreadsheet_id is None:
+                self._spreadsheets.clear()
+                self._worksheets.clear()
+                return
+            self._spreadsheets.pop(spreadsheet_id, None)
+            for key in [k for k in self._worksheets if k[0] == spreadsheet_id]:
+                del self._worksheets[key]
+
+    def run(self, spreadsheet_id, title, fn, create=None):
+        """
+        Ejecuta `fn(worksheet)`. Si falla por un handle vencido (auth o no encontrado) se
+        invalida la caché y se reintenta una vez con handles nuevos.
+        """
+        try:
+            return fn(self.worksheet(spreadsheet_id, title, create))
+        except Exception as err:
+            if not is_stale_handle_error(err):
+                raise
+            self.invalidate(spreadsheet_id)
+            return fn(self.worksheet(spreadsheet_id, title, create))
@@ -0,0 +1,94 @@
+"""
+Importación masiva de operaciones y ajustes (CSV, XLSX o tabla pegada) con pandas.
+
+Cada fila trae tipo (Compra/Venta/Pago/Recibo), monto y moneda (MXN/USDT). En Compra y
+Venta la moneda indica qué se capturó: MXN cotiza Pesos -> USDT y USDT cotiza USDT -> Pesos.
+El resultado alimenta al mismo motor de cotización y al mismo guardado que la captura manual.
+"""
+import io
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from cotizador import MODE_PESOS_TO_USDT, MODE_USDT_TO_PESOS
+
+IMPORT_COLUMNS = ("tipo", "monto", "moneda")
+OPERATION_TYPES = ("Compra", "Venta", "Pago", "Recibo")
+CURRENCIES = ("MXN", "USDT")
+_CURRENCY_ALIASES = {"MXN": "MXN", "PESOS": "MXN", "MN": "MXN", "$": "MXN", "USDT": "USDT", "USD": "USDT"}
+
+def empty_operations():
+    """Tabla vacía con las columnas de importación (para capturar directo en la cuadrícula)."""
+    return pd.DataFrame({"tipo": pd.Series(dtype="object"), "monto": pd.Series(dtype="float64"),
+                         "moneda": pd.Series(dtype="object")})
+
+def _plain(text):
+    """Minúsculas sin acentos ni espacios sobrantes, para comparar encabezados y valores."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return text.strip().lower()
+
+def read_operations(source, filename=""):
+    """
+    Lee la tabla de un archivo subido (CSV o XLSX según `filename`) o de un texto pegado
+    (separado por tabuladores, comas o punto y coma). Lanza ImportError si se pide XLSX
+    sin openpyxl instalado.
+    """
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise ImportError("Para importar archivos XLSX instala openpyxl (pip install openpyxl) o usa CSV.")
+        return pd.read_excel(source, dtype=str)
+    if isinstance(source, str):
+        source = io.StringIO(source.strip())
+    return pd.read_csv(source, sep=None, engine="python", dtype=str, skipinitialspace=True)
+
+def normalize_operations(table):
+    """
+    Valida y normaliza la tabla importada. Devuelve (operaciones, errores): las filas
+    válidas con las columnas de IMPORT_COLUMNS y una lista de mensajes por fila inválida.
+    Las filas con monto 0 o vacío se descartan sin error.
+    """
+    table = table.rename(columns={column: _plain(column) for column in table.columns})
+    missing = [column for column in IMPORT_COLUMNS if column not in table.columns]
+    if missing:
+        return empty_operations(), [f"Faltan las columnas: {', '.join(missing)}"]
+
+    types_by_name = {_plain(name): name for name in OPERATION_TYPES}
+    tipo = table["tipo"].map(lambda v: types_by_name.get(_plain(v)))
+    moneda = table["moneda"].map(lambda v: _CURRENCY_ALIASES.get(str(v).strip().upper()))
+    raw_monto = table["monto"].fillna("").astype(str).str.replace(r"[$,\s]", "", regex=True)
+    monto = pd.to_numeric(raw_monto, errors="coerce")
+    skipped = (raw_monto == "") | (monto == 0)
+
+    errors = []
+    for i in np.flatnonzero(~skipped & (tipo.isna() | moneda.isna() | monto.isna() | (monto < 0))):
+        row = table.iloc[i]
+        errors.append(f"Fila {i + 2}: tipo '{row['tipo']}', monto '{row['monto']}', moneda '{row['moneda']}' no válidos")
+    valid = ~skipped & tipo.notna() & moneda.notna() & (monto > 0)
+    operations = pd.DataFrame({"tipo": tipo[valid], "monto": monto[valid], "moneda": moneda[valid]}).reset_index(drop=True)
+    return operations, errors
+
+def bulk_quote_inputs(operations):
+    """
+    Separa las operaciones en los argumentos del cotizador: filas de compra/venta (montos y
+    modos por fila; cada fila tiene solo un lado) y ajustes (pagos y recibos).
+    """
+    trades = operations[operations["tipo"].isin(("Compra", "Venta"))]
+    is_compra = (trades["tipo"] == "Compra").to_numpy()
+    amounts = trades["monto"].to_numpy(dtype=np.float64)
+    modes = np.where(trades["moneda"].to_numpy() == "MXN", MODE_PESOS_TO_USDT, MODE_USDT_TO_PESOS)
+    ajustes = operations[operations["tipo"].isin(("Pago", "Recibo"))]
+    is_pago = (ajustes["tipo"] == "Pago").to_numpy()
+    ajuste_amounts = ajustes["monto"].to_numpy(dtype=np.float64)
+    ajuste_currencies = ajustes["moneda"].to_numpy()
+    return {
+        "amounts_vende": np.where(is_compra, amounts, 0.0),
+        "amounts_compra": np.where(is_compra, 0.0, amounts),
+        "mode_vende": modes,
+        "mode_compra": modes,
+        "ajustes": [{"pago_monto": amount if pago else 0.0, "pago_moneda": currency,
+                     "recibo_monto": 0.0 if pago else amount, "recibo_moneda": currency}
+                    for pago, amount, currency in zip(is_pago.tolist(), ajuste_amounts.tolist(), ajuste_currencies.tolist())],
+    }
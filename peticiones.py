@@ -0,0 +1,151 @@
+"""
+Capa compartida de peticiones HTTP a Google Sheets/Drive.
+
+Todas las llamadas de gspread pasan por RateLimitedHTTPClient (se pasa a gspread.authorize):
+cada petición toma antes un turno de un token bucket por cuota (lecturas y escrituras de
+Sheets se cuentan por separado, como en la consola de Google) y los errores transitorios se
+reintentan con espera exponencial con jitter: en lecturas los 429/408/5xx, en escrituras
+solo los de cuota (un 5xx o un timeout pudo llegar después de aplicar un append_rows, y
+repetirlo duplicaría filas; el diario local reintenta esas escrituras verificando folios). Si se agotan los reintentos el APIError se propaga tal
+cual: nadie debe convertirlo en un valor por defecto. Los contadores del proceso quedan en
+`sheets_stats`; los bytes y reintentos de cada petición se suman además al tramo de
+traza en curso (ver trazas.py).
+"""
+import threading
+import time
+from collections import Counter, deque
+
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from trazas import note_bytes, note_retry
+
+# Cuota de Sheets por usuario (la cuenta de servicio) y por minuto: 60 lecturas y 60 escrituras.
+# Se deja margen: con 55/min y ráfagas de 5 nunca se pasan 60 en una ventana de 60 s.
+QUOTA_PER_MINUTE = {"lectura": 60, "escritura": 60}
+RATE_PER_MINUTE = {"lectura": 55, "escritura": 55}
+BURST = 5
+RETRYABLE_API_CODES = (408, 429, 500, 502, 503, 504)
+QUOTA_API_CODES = (429,)
+MAX_ATTEMPTS = 6
+BACKOFF_MAX_SECONDS = 32
+
+class TokenBucket:
+    """Token bucket seguro entre hilos: `rate` turnos por segundo con ráfagas de hasta `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Toma un turno, esperando lo necesario. Devuelve los segundos esperados."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class SheetsStats:
+    """Contadores del proceso: peticiones, errores, reintentos y espera por límite de cuota."""
+    def __init__(self):
+        self.counts = Counter()
+        self.throttled_seconds = 0.0
+        self._recent = {kind: deque() for kind in QUOTA_PER_MINUTE}
+        self._lock = threading.Lock()
+
+    def record_request(self, kind, waited):
+        with self._lock:
+            self.counts[f"peticiones_{kind}"] += 1
+            self.throttled_seconds += waited
+            if kind in self._recent:
+                self._recent[kind].append(time.monotonic())
+
+    def record_error(self, code):
+        with self._lock:
+            self.counts[f"error_{code}"] += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.counts["reintentos"] += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.counts["fallidas"] += 1
+
+    def last_minute(self):
+        """Peticiones de los últimos 60 s por cuota: {tipo: (usadas, cuota)}."""
+        cutoff = time.monotonic() - 60
+        with self._lock:
+            for recent in self._recent.values():
+                while recent and recent[0] < cutoff:
+                    recent.popleft()
+            return {kind: (len(recent), QUOTA_PER_MINUTE[kind]) for kind, recent in self._recent.items()}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts), self.throttled_seconds
+
+sheets_stats = SheetsStats()
+_buckets = {kind: TokenBucket(rate / 60, BURST) for kind, rate in RATE_PER_MINUTE.items()}
+
+def _quota_kind(method, endpoint):
+    """Cuota a la que cuenta la petición: lecturas o escrituras de Sheets, o Drive (sin límite local)."""
+    if "/drive/" in endpoint:
+        return "drive"
+    return "lectura" if method.upper() == "GET" else "escritura"
+
+def _count_retry(_retry_state):
+    sheets_stats.record_retry()
+    note_retry()
+
+def is_quota_error(err):
+    """True para errores de cuota (429, o 403 usageLimits de Drive): la petición no se aplicó."""
+    if not isinstance(err, APIError):
+        return False
+    if err.code in QUOTA_API_CODES:
+        return True
+    errors = err.error.get("errors") if isinstance(err.error, dict) else None
+    return err.code == 403 and bool(errors) and errors[0].get("domain") == "usageLimits"
+
+def is_retryable_error(err):
+    """True para errores de cuota y errores del servidor (408/5xx)."""
+    return is_quota_error(err) or (isinstance(err, APIError) and err.code in RETRYABLE_API_CODES)
+
+class RateLimitedHTTPClient(HTTPClient):
+    """HTTPClient de gspread con límite de cuota por token bucket y reintentos con backoff."""
+    def request(self, method, endpoint, *args, **kwargs):
+        kind = _quota_kind(method, endpoint)
+        # Solo las lecturas son idempotentes: una escritura se repite solo si se rechazó por cuota
+        retrying = Retrying(
+            retry=retry_if_exception(is_retryable_error if method.upper() == "GET" else is_quota_error),
+            wait=wait_random_exponential(multiplier=1, max=BACKOFF_MAX_SECONDS),
+            stop=stop_after_attempt(MAX_ATTEMPTS),
+            before_sleep=_count_retry,
+            reraise=True,
+        )
+        try:
+            for attempt in retrying:
+                with attempt:
+                    bucket = _buckets.get(kind)
+                    sheets_stats.record_request(kind, bucket.acquire() if bucket else 0.0)
+                    try:
+                        response = super().request(method, endpoint, *args, **kwargs)
+                        sent = response.request.body if response.request is not None else None
+                        note_bytes(len(sent or b"") + len(response.content))
+                        return response
+                    except APIError as err:
+                        sheets_stats.record_error(err.code)
+                        raise
+        except APIError:
+            sheets_stats.record_failure()
+            raise
@@ -0,0 +1,240 @@
+"""
+Servicio de registro de operaciones de cambio, independiente de Streamlit.
+
+ExchangeLedgerService reúne la lógica de un guardado en tres pasos, que llaman igual la
+interfaz, los scripts (benchmark.py) y cualquier proceso por lotes:
+
+    quote        cotiza las filas y los ajustes y calcula el balance final del cliente
+    build_batch  lista las operaciones con monto mayor a cero, en el orden del registro
+    commit       reserva los folios, registra el lote y el saldo nuevo en el espejo local
+                 con los comprobantes en cola y después los sube (o los deja a la cola);
+                 los hilos de fondo lo replican a Google Sheets
+"""
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+
+from cola_comprobantes import PENDING_LINK, discard_receipts, enqueue_receipts
+from comprobantes import prepare_receipts, upload_receipts
+from cotizador import net_adjustments, quote_rows, quote_totals, row_records
+from dinero import from_micro, to_micro
+from espejo_local import fill_pending_links, local_balance, record_batch
+from folios import (FOLIO_SHEET_NAME, get_folio_counter_sheet, is_day_seeded, push_sheet_counter,
+                    read_sheet_counter, reserve_local_folios)
+from hojas import is_unavailable_error
+from trazas import tracer
+
+RATES_SHEET_NAME = "Tasas"
+TIMEZONE = "America/Mexico_City"
+
+# Cotización de un guardado: filas en micro-unidades (`rows`) y como floats (`records`),
+# ajustes capturados, totales de cotizador.quote_totals, tasas y balances inicial y final.
+Quote = namedtuple("Quote", "rows records ajustes totals precio_compra precio_venta balance_inicial_usdt "
+                            "balance_final_usdt balance_final_pesos")
+
+class ExchangeLedgerService:
+    """
+    Cotiza y registra lotes de operaciones de un cliente. `sheets` es el WorksheetRegistry y
+    `client_cache` la ClientDirectoryCache del proceso; `replicator` y `receipt_worker` (los
+    hilos de fondo) son opcionales: si están, se despiertan después de cada guardado.
+    """
+    def __init__(self, sheets, spreadsheet_id, sheet_tab_name, client_cache,
+                 replicator=None, receipt_worker=None, db_path=None):
+        self.sheets = sheets
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_tab_name = sheet_tab_name
+        self.client_cache = client_cache
+        self.replicator = replicator
+        self.receipt_worker = receipt_worker
+        self.db_path = db_path
+
+    def rates(self):
+        """Tasas de compra y venta de la hoja 'Tasas'. Lanza excepción si no se pudieron leer."""
+        with tracer.span("sheets_tasas"):
+            rates = self.sheets.run(self.spreadsheet_id, RATES_SHEET_NAME, lambda ws: ws.row_values(2))
+        try:
+            return float(rates[0]), float(rates[1])
+        except (IndexError, ValueError):
+            raise ValueError(f"la fila 2 de la hoja 'Tasas' no tiene una tasa de compra y una de venta válidas: {rates}")
+
+    def client_balance(self, client_alias):
+        """
+        Saldo (usdt, mxn) vigente del cliente. Lanza LookupError si no está en el directorio.
+        El saldo de la base local (ver espejo_local.local_balance) manda sobre el directorio:
+        puede venir de otro proceso que comparte la base (la app y api.py) y que el
+        directorio de este proceso aún no ve.
+        """
+        entry = self.client_cache.get()["by_alias"].get(client_alias)
+        if entry is None:
+            raise LookupError(f"No se encontró al cliente '{client_alias}'")
+        return local_balance(client_alias, self.db_path) or (entry.usdt, entry.mxn)
+
+
+    def quote(self, amounts_vende, amounts_compra, mode_vende, mode_compra, precio_compra, precio_venta,
+              ajustes=(), balance_inicial_usdt=0.0):
+        """
+        Cotiza las filas de compra/venta (ver cotizador.quote_rows) y los ajustes, dicts con
+        pago_monto/pago_moneda/recibo_monto/recibo_moneda. Los pagos suman al saldo (aumentan
+        la deuda) y los recibos restan.
+        """
+        rows = quote_rows(amounts_vende, amounts_compra, mode_vende, mode_compra, precio_compra, precio_venta)
+        ajustes = list(ajustes)
+        ajuste_neto_pesos, ajuste_neto_usdt = net_adjustments(
+            [d['pago_monto'] for d in ajustes], [d['pago_moneda'] for d in ajustes],
+            [d['recibo_monto'] for d in ajustes], [d['recibo_moneda'] for d in ajustes])
+        totals = quote_totals(rows, ajuste_neto_pesos, ajuste_neto_usdt, to_micro(balance_inicial_usdt))
+        # El saldo en pesos no se lleva: la hoja de clientes se actualiza con 0
+        return Quote(rows, row_records(rows), ajustes, totals, precio_compra, precio_venta, balance_inicial_usdt,
+                     from_micro(totals["balance_final_usdt"]), 0)
+
+    def build_batch(self, quote):
+        """
+        Operaciones a registrar: {type, index, data} por cada lado de fila (Compra/Venta) y
+        cada ajuste (Pago/Recibo) con monto mayor a cero. `index` es la fila o el ajuste.
+        """
+        operations = []
+        for i, row_data in enumerate(quote.records):
+            if row_data["pesos_pagar"] > 0 or row_data["usdt_recibir"] > 0: operations.append({'type': 'Compra', 'index': i, 'data': row_data})
+            if row_data["pesos_cobrar"] > 0 or row_data["usdt_entregar"] > 0: operations.append({'type': 'Venta', 'index': i, 'data': row_data})
+        for i, ajuste in enumerate(quote.ajustes):
+            if ajuste['pago_monto'] > 0: operations.append({'type': 'Pago', 'index': i, 'data': ajuste})
+            if ajuste['recibo_monto'] > 0: operations.append({'type': 'Recibo', 'index': i, 'data': ajuste})
+        return operations
+
+    def reserve_folios(self, date_str, count):
+        """
+        Reserva `count` folios consecutivos del día; lanza excepción si no se pudo reservar.
+        Si Google Sheets no responde se reservan solo con el contador local (modo sin conexión).
+        Devuelve (folios, en_linea).
+        """
+        def on_counter_sheet(fn):
+            return self.sheets.run(self.spreadsheet_id, FOLIO_SHEET_NAME, fn,
+                                   create=lambda spreadsheet: get_folio_counter_sheet(spreadsheet, self.sheet_tab_name))
+
+        with tracer.span("folios"):
+            # Solo la E/S de la hoja pasa por sheets.run (que reintenta con handles nuevos);
+            # la reserva local se hace una única vez para no apartar un segundo bloque.
+            online, sheet_last = True, 0
+            if not is_day_seeded(date_str, self.db_path):
+                try:
+                    sheet_last = on_counter_sheet(lambda counter: read_sheet_counter(counter, date_str))
+                except Exception as e:
+                    if not is_unavailable_error(e):
+                        raise
+                    online = False
+            folios = reserve_local_folios(date_str, count, sheet_last, db_path=self.db_path)
+            if online:
+                try:
+                    on_counter_sheet(lambda counter: push_sheet_counter(counter, date_str, self.db_path))
+                except Exception as e:
+                    if not is_unavailable_error(e):
+                        raise
+                    online = False
+            return folios, online
+
+    def notify_background(self):
+        """Despierta al replicador y a la cola de comprobantes para que envíen lo recién registrado."""
+        if self.replicator:
+            self.replicator.wake()
+        if self.receipt_worker:
+            self.receipt_worker.wake()
+
+    def _ledger_row(self, operation, folio, timestamp, client_alias, quote):
+        data = operation['data']
+        if operation['type'] == 'Compra':
+            return [folio, timestamp, client_alias, "Compra", data["pesos_pagar"], data["usdt_recibir"], quote.precio_compra, ""]
+        if operation['type'] == 'Venta':
+            return [folio, timestamp, client_alias, "Venta", data["pesos_cobrar"], data["usdt_entregar"], quote.precio_venta, ""]
+        field = 'pago' if operation['type'] == 'Pago' else 'recibo'
+        pesos = data[f'{field}_monto'] if data[f'{field}_moneda'] == 'MXN' else ""
+        usdt = data[f'{field}_monto'] if data[f'{field}_moneda'] == 'USDT' else ""
+        return [folio, timestamp, client_alias, operation['type'], pesos, usdt, "N/A", ""]
+
+    def commit(self, client_alias, quote, operations, receipts=None, dbx_client=None, deferred_uploads=False,
+               compress_options=None, on_progress=None, now=None, reserved=None, notify=True):
+        """
+        Registra el lote de `operations` (de build_batch) con el balance final de `quote`.
+
+        `receipts` es {(tipo, índice): archivo} con los comprobantes de las operaciones; se
+        comprimen si `compress_options` no es None (ver comprobantes.compress_receipt). El lote
+        se registra en el diario local en cuanto tiene folios, con un link provisional en las
+        filas con comprobante, y los comprobantes quedan en la cola; si el proceso muere a la
+        mitad de una subida la operación ya está registrada y la cola termina el trabajo.
+        Sin `deferred_uploads` (y con `dbx_client`) después se suben a Dropbox y sus links se
+        completan en el diario (ver espejo_local.fill_pending_links); los que fallan siguen en
+        la cola.
+        `on_progress(fracción, texto)` se llama desde el hilo que invoca.
+
+        `reserved` son (folios, en_linea) ya reservados con reserve_folios, p. ej. un bloque
+        para varios lotes; con notify=False no se despiertan los hilos de fondo (quien registra
+        varios lotes seguidos los despierta una vez al final con notify_background).
+
+        Lanza RuntimeError indicando el paso que falló (folios o registro); si falla el
+        registro se descartan los comprobantes encolados de este lote. El saldo que se guarda
+        es el vigente al registrar más el efecto de `quote` (ver espejo_local.record_batch). Devuelve un
+        dict con folios, online, links, upload_errors, dropbox_calls, bytes_in, bytes_out,
+        balance_final_usdt, balance_final_pesos y replicated, el Future que se resuelve con
+        los folios cuando el lote llega a Sheets (None sin replicador).
+        """
+        receipts = receipts or {}
+        progress = on_progress or (lambda fraction, text: None)
+        now = now or datetime.now(pytz.timezone(TIMEZONE))
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        with tracer.trace("guardado"):
+            try:
+                folios, online = reserved if reserved is not None else self.reserve_folios(now.strftime("%y-%m-%d"), len(operations))
+            except Exception as e:
+                raise RuntimeError(f"No se pudieron reservar los folios: {e}") from e
+
+            batch, by_folio = [], {}
+            for operation, folio in zip(operations, folios):
+                batch.append(self._ledger_row(operation, folio, timestamp, client_alias, quote))
+                receipt = receipts.get((operation['type'], operation['index']))
+                if receipt:
+                    by_folio[folio] = receipt
+                    batch[-1][7] = PENDING_LINK
+
+            bytes_in = bytes_out = 0
+            if compress_options is not None and by_folio:
+                progress(0, "Comprimiendo comprobantes...")
+                with tracer.span("compresión") as span:
+                    by_folio, bytes_in, bytes_out = prepare_receipts(by_folio, **compress_options)
+                    span.bytes = bytes_in
+
+            progress(0, "Guardando operaciones...")
+            try:
+                with tracer.span("encolar_comprobantes"):
+                    enqueue_receipts(by_folio, client_alias, db_path=self.db_path)
+                # Se registra el cambio y no el balance de la cotización: otra sesión u otro
+                # proceso (api.py) pudo registrar un lote del mismo cliente después de cotizar
+                change = quote.totals["balance_final_usdt"] - to_micro(quote.balance_inicial_usdt)
+                with tracer.span("registro_local"):
+                    recorded = record_batch(batch, client_alias, quote.balance_final_usdt, quote.balance_final_pesos,
+                                            usdt_change=change, db_path=self.db_path)
+            except Exception as e:
+                discard_receipts(list(by_folio), db_path=self.db_path)
+                raise RuntimeError(f"Error al guardar: {e}") from e
+            replicated = self.replicator.track(recorded.entry_id) if self.replicator else None
+            self.client_cache.patch_balance(client_alias, recorded.usdt, recorded.mxn, refresh_version=False)
+
+            links = {folio: PENDING_LINK for folio in by_folio}
+            upload_errors, dropbox_calls = {}, None
+            if by_folio and not deferred_uploads and dbx_client is not None:
+                def on_upload_done(folio, done, total):
+                    progress(done / (total + 1), f"Comprobante de {folio} subido ({done}/{total})...")
+                progress(0, f"Subiendo {len(by_folio)} comprobantes...")
+                uploaded, upload_errors, dropbox_calls = upload_receipts(dbx_client, by_folio, client_alias,
+                                                                         on_progress=on_upload_done, db_path=self.db_path)
+                if uploaded:
+                    links.update(uploaded)
+                    # Los que ya no alcanzaron a entrar en el diario se quedan en la cola, que
+                    # reutiliza el link subido (mismo SHA-256) y lo escribe en la hoja
+                    late = fill_pending_links(recorded.entry_id, uploaded, db_path=self.db_path)
+                    discard_receipts([folio for folio in uploaded if folio not in late], db_path=self.db_path)
+
+        if notify:
+            self.notify_background()
+        return {"folios": folios, "online": online, "links": links, "upload_errors": upload_errors,
+                "dropbox_calls": dropbox_calls, "bytes_in": bytes_in, "bytes_out": bytes_out,
+                "balance_final_usdt": recorded.usdt, "balance_final_pesos": recorded.mxn, "replicated": replicated}
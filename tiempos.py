@@ -0,0 +1,33 @@
+"""Tiempos de render por sección de la página (por sesión), para ver qué cuesta cada rerun."""
+import time
+from collections import deque
+from contextlib import contextmanager
+
+RENDER_TIMING_WINDOW = 20
+
+class RenderTimings:
+    """Últimas `window` mediciones de cada sección y cuántas veces se ha dibujado."""
+    def __init__(self, window=RENDER_TIMING_WINDOW):
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """Agrega una medición tomada por fuera de section (p. ej. desde el inicio del script)."""
+        self.samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def summary(self):
+        """Filas {sección, veces, último ms, promedio ms} en el orden en que se midieron por primera vez."""
+        return [{"sección": name, "veces": self.counts[name],
+                 "último (ms)": round(samples[-1] * 1000, 1),
+                 "promedio (ms)": round(sum(samples) / len(samples) * 1000, 1)}
+                for name, samples in self.samples.items()]
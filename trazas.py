@@ -0,0 +1,193 @@
+"""
+Trazas de latencia de las llamadas externas (Google Sheets, Dropbox y la base local).
+
+Cada llamada se mide como un tramo con su duración, bytes enviados/recibidos y reintentos.
+Los tramos pertenecen a una traza (un rerun de la página, un guardado, un ciclo de un hilo
+de fondo), que a su vez se registra como un tramo con el nombre de su tipo. La traza y el
+tramo actuales viajan en contextvars, así que el cliente HTTP de Sheets y los reintentos
+de Dropbox suman bytes y reintentos al tramo en curso sin recibirlo como argumento; para
+los hilos de un pool hay que copiar el contexto (contextvars.copy_context().run).
+
+Los tramos se acumulan en memoria y se escriben en la tabla `trazas` de la base local al
+terminar cada traza, conservando solo los últimos TRACE_RETENTION. Un fallo al escribirlos
+nunca interrumpe la operación que se estaba midiendo.
+"""
+import contextvars
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from almacen_local import connect_local_db
+
+TRACE_RETENTION = 5000
+TRACE_FLUSH_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trazas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    traza TEXT,
+    tipo TEXT,
+    nombre TEXT NOT NULL,
+    inicio REAL NOT NULL,
+    duracion_ms REAL NOT NULL,
+    bytes INTEGER NOT NULL,
+    reintentos INTEGER NOT NULL,
+    error TEXT);
+CREATE INDEX IF NOT EXISTS trazas_tipo ON trazas (tipo, id);
+"""
+
+_current_trace = contextvars.ContextVar("traza_actual", default=None)
+_current_span = contextvars.ContextVar("tramo_actual", default=None)
+
+class Span:
+    """Tramo en curso: acumula los bytes y reintentos de la llamada que mide."""
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.bytes = nbytes
+        self.retries = 0
+
+class Trace:
+    """Traza en curso: agrupa los tramos de una misma unidad de trabajo."""
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.spans = 0
+
+def note_bytes(nbytes):
+    """Suma bytes transferidos al tramo en curso (si hay)."""
+    span = _current_span.get()
+    if span is not None:
+        span.bytes += nbytes
+
+def note_retry():
+    """Cuenta un reintento en el tramo en curso (si hay)."""
+    span = _current_span.get()
+    if span is not None:
+        span.retries += 1
+
+def _connect(db_path=None):
+    conn = connect_local_db(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+class Tracer:
+    """Registro de tramos del proceso, con escritura diferida a la base local."""
+    def __init__(self, retention=TRACE_RETENTION, flush_size=TRACE_FLUSH_SIZE, db_path=None):
+        self.retention = retention
+        self.flush_size = flush_size
+        self.db_path = db_path
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def _record(self, trace, span, started, elapsed, error):
+        if trace is not None:
+            trace.spans += 1
+        row = (trace.id if trace else None, trace.kind if trace else None, span.name, started,
+               elapsed * 1000, span.bytes, span.retries, error)
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self.flush()
+
+    @contextmanager
+    def span(self, name, nbytes=0):
+        """Mide el bloque como un tramo de la traza actual. Las excepciones se registran y se propagan."""
+        span = Span(name, nbytes)
+        token = _current_span.set(span)
+        started, start = time.time(), time.perf_counter()
+        error = None
+        try:
+            yield span
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            _current_span.reset(token)
+            self._record(_current_trace.get(), span, started, time.perf_counter() - start, error)
+
+    @contextmanager
+    def trace(self, kind, keep_empty=True):
+        """
+        Abre una traza de tipo `kind` (su duración total queda como un tramo con ese nombre)
+        y escribe sus tramos al terminar. Con keep_empty=False la traza se descarta si no hubo
+        ninguna llamada medida dentro (p. ej. un ciclo de un hilo de fondo sin trabajo).
+        """
+        trace = Trace(kind)
+        token = _current_trace.set(trace)
+        span = Span(kind)
+        span_token = _current_span.set(span)
+        started, start = time.time(), time.perf_counter()
+        error = None
+        try:
+            yield trace
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            _current_span.reset(span_token)
+            if keep_empty or trace.spans:
+                self._record(trace, span, started, time.perf_counter() - start, error)
+            _current_trace.reset(token)
+            self.flush()
+
+    def flush(self):
+        """Escribe los tramos acumulados y recorta la tabla a los últimos `retention`."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            conn = _connect(self.db_path)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT INTO trazas (traza, tipo, nombre, inicio, duracion_ms, bytes, reintentos, error) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("DELETE FROM trazas WHERE id <= (SELECT MAX(id) FROM trazas) - ?", (self.retention,))
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    def latency_summary(self):
+        """p50/p95 por tipo de llamada sobre los tramos guardados, de la más lenta (p95) a la más rápida."""
+        self.flush()
+        conn = _connect(self.db_path)
+        try:
+            rows = conn.execute("SELECT nombre, duracion_ms, bytes, reintentos, error IS NOT NULL FROM trazas").fetchall()
+        finally:
+            conn.close()
+        by_name = {}
+        for name, *values in rows:
+            by_name.setdefault(name, []).append(values)
+        summary = []
+        for name, values in by_name.items():
+            durations, nbytes, retries, errors = np.array(values, dtype=np.float64).T
+            p50, p95 = np.percentile(durations, [50, 95])
+            summary.append({"llamada": name, "n": len(durations), "p50 (ms)": round(p50, 1), "p95 (ms)": round(p95, 1),
+                            "KB prom.": round(nbytes.mean() / 1024, 1), "reintentos": int(retries.sum()), "errores": int(errors.sum())})
+        return sorted(summary, key=lambda row: row["p95 (ms)"], reverse=True)
+
+    def last_trace(self, kind):
+        """Tramos de la traza más reciente de tipo `kind`, en orden de inicio ([] si no hay)."""
+        self.flush()
+        conn = _connect(self.db_path)
+        try:
+            row = conn.execute("SELECT traza FROM trazas WHERE tipo = ? ORDER BY id DESC LIMIT 1", (kind,)).fetchone()
+            if row is None:
+                return []
+            spans = conn.execute("SELECT nombre, inicio, duracion_ms, bytes, reintentos, error FROM trazas "
+                                 "WHERE traza = ? ORDER BY inicio, id", (row[0],)).fetchall()
+        finally:
+            conn.close()
+        first = min(span[1] for span in spans)
+        return [{"llamada": name, "inicio (ms)": round((started - first) * 1000, 1), "duración (ms)": round(duration, 1),
+                 "bytes": nbytes, "reintentos": retries, "error": error or ""}
+                for name, started, duration, nbytes, retries, error in spans]
+
+tracer = Tracer()